@@ -0,0 +1,143 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+# 优先级类别：数值越小越优先
+PRIORITIES = {
+    'interactive': 0,
+    'evaluation': 1,
+    'batch': 2
+}
+
+class AdmissionRejected(Exception):
+    """生成请求未被接纳（队列已满或排队超时）"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class _Waiter:
+    def __init__(self, priority: int):
+        self.priority = priority
+        self.granted = False
+        self.evicted = False
+
+class AdmissionController:
+    """
+    LLM生成的准入控制
+
+    限制同时进行的生成数量，超出部分按优先级进入有界等待队列；
+    队列已满时直接拒绝（高优先级请求可挤掉队尾的低优先级请求），排队超过期限同样拒绝。
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 32, queue_timeout: float = 30.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._service_times = deque(maxlen=100)
+        self.admitted_count = 0
+        self.rejected_count = 0
+
+    @contextmanager
+    def admit(self, priority: str = 'interactive', timeout: Optional[float] = None):
+        """在准入许可内执行代码块"""
+        self.acquire(priority, timeout)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def acquire(self, priority: str = 'interactive', timeout: Optional[float] = None):
+        """
+        获取生成许可
+
+        Raises:
+            AdmissionRejected: 队列已满或排队超时
+        """
+        level = PRIORITIES.get(priority, PRIORITIES['batch'])
+        deadline = time.monotonic() + (self.queue_timeout if timeout is None else timeout)
+
+        with self._cond:
+            if self._active < self.max_concurrent and not self._waiters:
+                self._active += 1
+                self.admitted_count += 1
+                return
+
+            if len(self._waiters) >= self.max_queue and not self._evict_lower_priority(level):
+                self.rejected_count += 1
+                raise AdmissionRejected("生成队列已满，请稍后再试", self._retry_after())
+
+            waiter = _Waiter(level)
+            entry = (level, next(self._seq), waiter)
+            heapq.heappush(self._waiters, entry)
+
+            while not waiter.granted:
+                remaining = deadline - time.monotonic()
+                if waiter.evicted or remaining <= 0:
+                    if not waiter.evicted:
+                        self._waiters.remove(entry)
+                        heapq.heapify(self._waiters)
+                    self.rejected_count += 1
+                    message = "生成队列已被更高优先级请求占用" if waiter.evicted else "排队等待超时"
+                    raise AdmissionRejected(message, self._retry_after())
+                self._cond.wait(remaining)
+
+            self.admitted_count += 1
+
+    def release(self, service_time: float = 0.0):
+        """释放许可，直接转交给队列中优先级最高的等待者"""
+        with self._cond:
+            self._service_times.append(service_time)
+            if self._waiters:
+                _, _, waiter = heapq.heappop(self._waiters)
+                waiter.granted = True
+                self._cond.notify_all()
+            else:
+                self._active -= 1
+
+    def _evict_lower_priority(self, level: int) -> bool:
+        """队列已满时挤掉最后入队的最低优先级等待者（调用时需持有锁）"""
+        if not self._waiters:
+            return False
+        victim = max(self._waiters, key=lambda entry: (entry[0], entry[1]))
+        if victim[0] <= level:
+            return False
+        self._waiters.remove(victim)
+        heapq.heapify(self._waiters)
+        victim[2].evicted = True
+        self._cond.notify_all()
+        return True
+
+    def _retry_after(self) -> int:
+        """根据平均生成耗时和排队长度估算重试等待秒数（调用时需持有锁）"""
+        if self._service_times:
+            mean_service = sum(self._service_times) / len(self._service_times)
+        else:
+            mean_service = 1.0
+        return max(1, math.ceil(mean_service * (len(self._waiters) + 1) / self.max_concurrent))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取准入状态"""
+        with self._cond:
+            queued = {name: 0 for name in PRIORITIES}
+            names = {level: name for name, level in PRIORITIES.items()}
+            for level, _, _ in self._waiters:
+                queued[names.get(level, 'batch')] += 1
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'active': self._active,
+                'queued': queued,
+                'admitted': self.admitted_count,
+                'rejected': self.rejected_count
+            }
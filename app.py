@@ -1,6 +1,7 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
+from fastapi.responses import HTMLResponse, StreamingResponse, PlainTextResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 import os
 import shutil
 from typing import List
@@ -12,6 +13,12 @@ from rag_system import RAGSystem
 from qa_system import QASystem
 from config import Config
 from rag_evaluator import RAGEvaluator
+from admission import AdmissionController, AdmissionRejected
+from metrics import REGISTRY, HTTP_REQUESTS, HTTP_LATENCY
+from profiling import ProfileStore
+from tokenizer import init_tokenizer, tokenizer_stats
+from auto_evaluation import AutoEvaluator
+from evaluation_aggregator import EvaluationAggregator
 
 app = FastAPI(title="RAG演示系统", description="检索增强生成系统演示")
 
@@ -28,10 +35,110 @@ current_config = {
     "embedding_config": Config.get_ollama_embedding_config()
 }
 
+# 全局共享的LLM生成准入控制（重新应用配置时保持不变）
+admission_controller = AdmissionController(
+    max_concurrent=Config.LLM_MAX_CONCURRENCY,
+    max_queue=Config.LLM_MAX_QUEUE,
+    queue_timeout=Config.LLM_QUEUE_TIMEOUT
+)
+
 # 初始化RAG系统、QA系统和评估器
 rag_system = RAGSystem(embedding_config=current_config["embedding_config"])
-qa_system = QASystem(rag_system, llm_config=current_config["llm_config"])
+qa_system = QASystem(rag_system, llm_config=current_config["llm_config"], admission=admission_controller)
 evaluator = RAGEvaluator()
+evaluation_aggregator = EvaluationAggregator(
+    window_seconds=Config.EVAL_AGG_WINDOW_SECONDS,
+    max_windows=Config.EVAL_AGG_MAX_WINDOWS,
+    snapshot_path=Config.EVAL_AGG_SNAPSHOT_PATH or None,
+    snapshot_interval=Config.EVAL_AGG_SNAPSHOT_INTERVAL
+)
+auto_evaluator = AutoEvaluator(
+    evaluator,
+    evaluation_aggregator,
+    sample_rate=Config.AUTO_EVAL_SAMPLE_RATE,
+    max_workers=Config.AUTO_EVAL_WORKERS,
+    max_pending=Config.AUTO_EVAL_MAX_PENDING,
+    metrics=Config.AUTO_EVAL_METRICS
+)
+profile_store = ProfileStore(Config.PROFILE_DIR, max_profiles=Config.PROFILE_MAX_FILES)
+
+def profiling_requested(request: Request) -> bool:
+    """请求是否要求性能剖析（需在配置中启用）"""
+    if not Config.PROFILING_ENABLED:
+        return False
+    flag = request.headers.get("X-Profile") or request.query_params.get("profile")
+    return flag in ("1", "true")
+
+def model_config_label() -> str:
+    """当前模型配置的名称，用于按配置分组聚合评估结果"""
+    llm_config = current_config['llm_config']
+    return f"{llm_config.get('provider', 'unknown')}/{llm_config.get('model', 'unknown')}"
+
+def check_admin(request: Request):
+    """管理接口仅在启用剖析时可用，配置了令牌时需校验"""
+    if not Config.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if Config.ADMIN_TOKEN and request.headers.get("X-Admin-Token") != Config.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="无权访问")
+
+@app.on_event("startup")
+async def warm_up_tokenizer():
+    """启动时加载jieba词典，避免首个评估请求承担数秒的词典构建耗时"""
+    state = await run_in_threadpool(init_tokenizer)
+    print(f"jieba词典已加载，耗时 {state['load_ms']:.0f} ms")
+
+@app.on_event("startup")
+async def start_evaluation_snapshots():
+    evaluation_aggregator.start_snapshots()
+
+@app.on_event("shutdown")
+async def stop_auto_evaluation():
+    auto_evaluator.shutdown()
+    evaluation_aggregator.stop()
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """记录每个路由的请求数和耗时"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        HTTP_REQUESTS.inc(route=path, method=request.method, status=status)
+        HTTP_LATENCY.observe(time.perf_counter() - start, route=path, method=request.method)
+
+def collect_system_metrics():
+    """抓取时计算的系统指标"""
+    admission_stats = admission_controller.get_stats()
+    samples = [
+        ("rag_documents", "文档块数量", {}, len(rag_system.documents)),
+        ("rag_index_vectors", "索引中的向量数量", {}, rag_system.index.ntotal if rag_system.index is not None else 0),
+        ("rag_generations_in_flight", "正在进行的LLM生成数", {}, admission_stats['active']),
+        ("rag_answers_in_flight", "正在进行的问答请求数（合并后）", {}, qa_system._singleflight.in_flight()),
+        ("rag_admission_rejected", "被准入控制拒绝的生成请求累计数", {}, admission_stats['rejected']),
+    ]
+    memory = rag_system.get_memory_stats()
+    for component, value in (('chunk_text', memory['chunk_text_bytes']),
+                             ('chunk_metadata', memory['chunk_metadata_bytes']),
+                             ('chunk_signatures', memory['chunk_signatures_bytes']),
+                             ('faiss_index', memory['index']['bytes']),
+                             ('jieba_dictionary', memory['jieba_dictionary_bytes']),
+                             ('latency_window', qa_system.latency_stats.approximate_bytes())):
+        samples.append(("rag_memory_bytes", "各组件占用的内存估算（字节）", {"component": component}, value))
+    samples.append(("rag_process_resident_memory_bytes", "进程常驻内存（字节）", {}, memory['process_rss_bytes']))
+    for priority, count in admission_stats['queued'].items():
+        samples.append(("rag_generations_queued", "排队等待的LLM生成数", {"priority": priority}, count))
+    for backend in qa_system.backend_pool.get_stats():
+        samples.append(("rag_llm_backend_outstanding", "各LLM后端未完成的请求数", {"backend": backend['url']}, backend['outstanding']))
+        samples.append(("rag_llm_backend_up", "LLM后端熔断器是否闭合", {"backend": backend['url']},
+                        1 if backend['state'] == 'closed' else 0))
+    return samples
+
+REGISTRY.add_collector(collect_system_metrics)
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root():
@@ -1063,7 +1170,9 @@ async def read_root():
                         query: query,
                         answer: result.answer,
                         sources: result.sources,
-                        response_time: responseTime / 1000.0  // 转换为秒
+                        response_time: responseTime / 1000.0,  // 转换为秒
+                        llm_usage: result.llm_usage,
+                        timings: result.timings
                     };
                     
                     let html = '';
@@ -1152,7 +1261,9 @@ async def read_root():
                             query: lastQAResult.query,
                             answer: lastQAResult.answer,
                             retrieved_sources: lastQAResult.sources,
-                            response_time: lastQAResult.response_time
+                            response_time: lastQAResult.response_time,
+                            llm_usage: lastQAResult.llm_usage,
+                            timings: lastQAResult.timings
                         })
                     });
                     
@@ -1185,7 +1296,7 @@ async def read_root():
                         <div class="overall-score">
                             <h3>🎯 总体评分</h3>
                             <div class="score-display">
-                                <span class="score-value">${(overall.overall_score * 100).toFixed(1)}</span>
+                                <span class="score-value">${overall.overall_score === null ? '—' : (overall.overall_score * 100).toFixed(1)}</span>
                                 <span class="score-label">/ 100</span>
                             </div>
                             <div class="score-description">
@@ -1374,6 +1485,11 @@ async def read_root():
                                             <span class="breakdown-label">处理速度:</span>
                                             <span class="breakdown-value">${performance.tokens_per_second.toFixed(1)}字符/秒</span>
                                         </div>
+                                        ${performance.generation_tokens_per_second != null ? `
+                                        <div class="breakdown-item">
+                                            <span class="breakdown-label">生成速度:</span>
+                                            <span class="breakdown-value">${performance.generation_tokens_per_second.toFixed(1)} tokens/秒</span>
+                                        </div>` : ''}
                                         <div class="breakdown-item">
                                             <span class="breakdown-label">查询长度:</span>
                                             <span class="breakdown-value">${performance.query_length}字符</span>
@@ -1454,17 +1570,61 @@ async def read_root():
     """
 
 @app.get("/stats")
-async def get_stats():
-    """获取系统状态"""
+def get_stats():
+    """获取系统状态（同步路由，在线程池中执行）"""
     stats = rag_system.get_stats()
     # 添加LLM模型信息
     stats['llm_model'] = current_config['llm_config'].get('model', 'unknown')
     stats['llm_provider'] = current_config['llm_config'].get('provider', 'unknown')
+    stats['llm_backends'] = qa_system.backend_pool.get_stats()
+    stats['admission'] = dict(admission_controller.get_stats(), answers_in_flight=qa_system._singleflight.in_flight())
+    stats['timings'] = qa_system.latency_stats.summary()
+    stats['memory']['caches'] = {
+        'latency_window_bytes': qa_system.latency_stats.approximate_bytes()
+    }
+    stats['tokenizer'] = tokenizer_stats()
     return stats
 
+@app.get("/auto-eval")
+async def get_auto_evaluation():
+    """在线抽样评估的计数（分数见 /evaluation-stats）"""
+    return auto_evaluator.get_stats()
+
+@app.get("/evaluation-stats")
+async def get_evaluation_stats(metric: str = None, config: str = None, minutes: float = None,
+                               per_window: bool = False):
+    """按模型配置聚合的评估分数和请求耗时（均值及 p50/p95/p99），可按指标、配置和最近分钟数筛选"""
+    since = time.time() - minutes * 60 if minutes else None
+    return evaluation_aggregator.query(metric=metric, config=config, since=since, per_window=per_window)
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus文本格式的指标（同步路由，在线程池中执行，抓取不阻塞事件循环）"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/profiles")
+async def list_profiles(request: Request):
+    """列出已保存的性能剖析"""
+    check_admin(request)
+    return {"profiles": profile_store.list_profiles()}
+
+@app.get("/admin/profiles/{name}")
+async def download_profile(name: str, request: Request, format: str = "pstats"):
+    """下载性能剖析（format=text 返回按累计耗时排序的摘要）"""
+    check_admin(request)
+    if format == "text":
+        summary = profile_store.summary(name)
+        if summary is None:
+            raise HTTPException(status_code=404, detail="剖析文件不存在")
+        return PlainTextResponse(summary)
+    path = profile_store.path_for(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="剖析文件不存在")
+    return FileResponse(path, media_type="application/octet-stream", filename=name)
+
 @app.post("/upload")
-async def upload_files(files: List[UploadFile] = File(...)):
-    """上传文档"""
+async def upload_files(files: List[UploadFile] = File(...), index: bool = Form(False)):
+    """上传文档（index 为真时流式解析、嵌入并立即加入索引，无需再调用 /build-index）"""
     uploaded_files = []
     
     for file in files:
@@ -1475,8 +1635,17 @@ async def upload_files(files: List[UploadFile] = File(...)):
             uploaded_files.append(file_path)
     
     if uploaded_files:
-        rag_system.add_documents(uploaded_files)
-        return {"message": f"成功上传 {len(uploaded_files)} 个文件"}
+        # 文档解析为CPU密集操作（多个文件时在进程池中并行），放到线程池中等待，避免阻塞事件循环
+        if index:
+            try:
+                report = await run_in_threadpool(rag_system.ingest_documents, uploaded_files)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"索引失败: {e}")
+        else:
+            report = await run_in_threadpool(rag_system.add_documents, uploaded_files)
+        failed = sum(1 for item in report if item['error'])
+        return {"message": f"成功上传 {len(uploaded_files)} 个文件" + (f"，其中 {failed} 个解析失败" if failed else ""),
+                "files": report}
     else:
         raise HTTPException(status_code=400, detail="没有文件被上传")
 
@@ -1484,21 +1653,55 @@ async def upload_files(files: List[UploadFile] = File(...)):
 async def build_index():
     """构建索引"""
     try:
-        rag_system.build_index()
+        # 在线程池中执行：等待进行中的导入完成时不阻塞事件循环
+        await run_in_threadpool(rag_system.build_index)
         return {"message": "索引构建成功"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/ask")
-async def ask_question(query: dict):
+async def ask_question(query: dict, request: Request):
     """提问"""
     try:
-        result = qa_system.get_answer_with_sources(query["query"])
+        # 在线程池中执行，使并发请求可以重叠并被合并
+        if profiling_requested(request):
+            result, profile_id = await run_in_threadpool(
+                profile_store.profile_call, "ask", qa_system.get_answer_with_sources, query["query"]
+            )
+            result = dict(result, profile_id=profile_id)
+        else:
+            result = await run_in_threadpool(qa_system.get_answer_with_sources, query["query"])
+        label = model_config_label()
+        if not result.get('coalesced'):
+            # 合并请求共享领头请求的阶段耗时，只统计一次
+            evaluation_aggregator.ingest_timings(result.get('timings') or {}, label)
+        auto_evaluator.maybe_submit(result, config=label)
         return result
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/ask-batch")
+async def ask_batch(batch: dict):
+    """批量提问，按完成顺序以NDJSON流式返回结果"""
+    queries = batch.get("queries")
+    if not isinstance(queries, list) or not queries:
+        raise HTTPException(status_code=400, detail="queries 必须是非空列表")
+    
+    try:
+        max_workers = int(batch.get("max_workers", Config.BATCH_MAX_WORKERS))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="max_workers 必须是整数")
+    max_workers = max(1, min(max_workers, Config.BATCH_MAX_WORKERS_LIMIT))
+    
+    def generate():
+        for result in qa_system.answer_batch([str(q) for q in queries], max_workers=max_workers):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
 @app.post("/test-llm")
 async def test_llm_connection(config: dict):
     """测试LLM连接"""
@@ -1529,7 +1732,7 @@ async def apply_config(config: dict):
         
         # 重新初始化系统
         rag_system = RAGSystem(embedding_config=current_config["embedding_config"])
-        qa_system = QASystem(rag_system, llm_config=current_config["llm_config"])
+        qa_system = QASystem(rag_system, llm_config=current_config["llm_config"], admission=admission_controller)
         
         return {"success": True, "message": "配置应用成功"}
     except Exception as e:
@@ -1546,12 +1749,18 @@ async def evaluate_response(evaluation_data: dict):
         else:
             response_time = None
             
-        evaluation_results = evaluator.evaluate_rag_response(
+        # jieba分词为CPU密集操作，放到线程池中执行，避免阻塞事件循环
+        evaluation_results = await run_in_threadpool(
+            evaluator.evaluate_rag_response,
             query=evaluation_data["query"],
             answer=evaluation_data["answer"],
             retrieved_sources=evaluation_data["retrieved_sources"],
-            response_time=response_time
+            response_time=response_time,
+            llm_usage=evaluation_data.get("llm_usage"),
+            timings=evaluation_data.get("timings"),
+            metrics=evaluation_data.get("metrics")
         )
+        evaluation_aggregator.ingest_evaluation(evaluation_results, model_config_label())
         
         return evaluation_results
     except Exception as e:
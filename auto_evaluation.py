@@ -0,0 +1,116 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List
+
+from metrics import AUTO_EVAL_SAMPLES
+from rag_evaluator import RAGEvaluator, METRIC_NAMES
+from evaluation_aggregator import EvaluationAggregator
+
+class AutoEvaluator:
+    """
+    在线问答响应的抽样自动评估
+
+    按 sample_rate 抽样 /ask 的响应，在后台线程池中评估，不占用请求路径。
+    待评估数量达到 max_pending 时直接丢弃新样本而不是排队；评估分数写入 EvaluationAggregator 按时间窗口聚合。
+    metrics 指定时只计算这些指标组（如只检查相关性和忠实度），默认计算全部。
+    """
+
+    def __init__(self, evaluator: RAGEvaluator, aggregator: EvaluationAggregator, sample_rate: float = 0.0,
+                 max_workers: int = 1, max_pending: int = 16, metrics: Optional[List[str]] = None):
+        self.evaluator = evaluator
+        self.aggregator = aggregator
+        # 启动时校验指标名称，而不是在每次后台评估中失败
+        unknown = set(metrics or []) - set(METRIC_NAMES)
+        if unknown:
+            raise ValueError(f"未知的评估指标: {', '.join(sorted(unknown))}")
+        self.metrics = list(metrics) if metrics else None
+        self.sample_rate = max(0.0, min(sample_rate, 1.0))
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._counts = {'sampled': 0, 'dropped': 0, 'completed': 0, 'failed': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def maybe_submit(self, result: Dict[str, Any], config: str = 'default') -> bool:
+        """
+        按抽样率提交一次问答结果进行评估
+
+        Args:
+            result: 问答结果
+            config: 生成该结果的模型配置，用于分组聚合
+
+        Returns:
+            是否已提交（未抽中、不可评估或因积压被丢弃时为False）
+        """
+        if not self.enabled or not self._evaluable(result) or random.random() >= self.sample_rate:
+            return False
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._counts['dropped'] += 1
+                AUTO_EVAL_SAMPLES.inc(result='dropped')
+                return False
+            self._pending += 1
+            self._counts['sampled'] += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='auto-eval')
+            executor = self._executor
+
+        AUTO_EVAL_SAMPLES.inc(result='sampled')
+        executor.submit(self._evaluate, result, config)
+        return True
+
+    @staticmethod
+    def _evaluable(result: Dict[str, Any]) -> bool:
+        """
+        只评估正常生成的答案：跳过出错（包括后端失败和系统未初始化，QASystem 以 error 字段标记）、
+        被门控拒答和合并到其他请求的结果
+        """
+        return bool(result.get('answer')) and not result.get('error') and 'gate' not in result \
+            and not result.get('coalesced')
+
+    def _evaluate(self, result: Dict[str, Any], config: str):
+        try:
+            evaluation = self.evaluator.evaluate_rag_response(
+                query=result['query'],
+                answer=result['answer'],
+                retrieved_sources=result.get('sources', []),
+                response_time=result.get('response_time'),
+                llm_usage=result.get('llm_usage'),
+                timings=result.get('timings'),
+                metrics=self.metrics
+            )
+            self.aggregator.ingest_evaluation(evaluation, config)
+            outcome = 'completed'
+        except Exception as e:
+            print(f"自动评估失败: {e}")
+            outcome = 'failed'
+        with self._lock:
+            self._pending -= 1
+            self._counts[outcome] += 1
+        AUTO_EVAL_SAMPLES.inc(result=outcome)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """抽样计数（聚合分数通过 EvaluationAggregator.query 查询）"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'sample_rate': self.sample_rate,
+                'max_pending': self.max_pending,
+                'pending': self._pending,
+                'metrics': self.metrics or 'all',
+                **self._counts
+            }
+
+    def shutdown(self):
+        """停止后台评估，丢弃尚未开始的样本"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
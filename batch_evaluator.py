@@ -0,0 +1,282 @@
+from typing import List, Dict, Any, Tuple
+
+import jieba
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+
+from config import Config
+from minhash import NUM_PERM, EMPTY_SIGNATURE, pair_similarity, text_shingles
+from rag_evaluator import RAGEvaluator
+
+def _identity(tokens):
+    """CountVectorizer的analyzer：输入已是jieba分词结果"""
+    return tokens
+
+def _row_sums(matrix) -> np.ndarray:
+    return np.asarray(matrix.sum(axis=1)).ravel()
+
+class BatchRAGEvaluator(RAGEvaluator):
+    """
+    批量RAG评估器
+
+    对一批 (query, answer, sources) 记录只构建一个jieba词项稀疏矩阵，
+    相关性、忠实度、精确率、召回率和多样性均以整批稀疏矩阵运算完成。
+    指标定义与 RAGEvaluator 一致，另外 tfidf_similarity 为查询与答案的真实TF-IDF余弦相似度
+    （IDF在当前批次上拟合）。
+    """
+
+    def evaluate_batch(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        批量评估
+
+        Args:
+            records: 评估记录列表，每条包含 query、answer、sources，
+                     可选 ground_truth、response_time、llm_usage、timings
+
+        Returns:
+            与 records 顺序一致的评估结果，格式同 RAGEvaluator.evaluate_rag_response
+        """
+        if not records:
+            return []
+
+        texts, query_rows, answer_rows, truth_rows, source_rows, source_owner = self._layout(records)
+        presence, tfidf = self._build_matrices(texts)
+
+        keyword = self._keyword_metrics(presence, query_rows, answer_rows, truth_rows,
+                                        source_rows, source_owner, len(records))
+        tfidf_similarity = _row_sums(tfidf[query_rows].multiply(tfidf[answer_rows]))
+        diversity = self._diversity_metrics(source_rows, source_owner, records)
+
+        results = []
+        for i, record in enumerate(records):
+            query = record.get('query', '')
+            answer = record.get('answer', '')
+            sources = record.get('sources') or []
+
+            evaluation_results = self._assemble(i, query, answer, sources, keyword, tfidf_similarity, diversity)
+            evaluation_results['answer_completeness'] = self._evaluate_answer_completeness(query, answer)
+            evaluation_results['performance_metrics'] = self._evaluate_performance_metrics(
+                query, answer, sources, record.get('response_time'), record.get('llm_usage'), record.get('timings')
+            )
+            evaluation_results['overall_score'] = self._calculate_overall_score(evaluation_results)
+            results.append(evaluation_results)
+
+        return results
+
+    def _layout(self, records: List[Dict[str, Any]]) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray,
+                                                              np.ndarray, np.ndarray]:
+        """
+        为每段不同的文本分配矩阵行，重复出现的文本（如多条记录命中同一文档块）共享一行
+
+        没有参考答案的记录，其参考答案行号为-1
+        """
+        row_of: Dict[str, int] = {}
+        texts: List[str] = []
+
+        def row(text: str) -> int:
+            if text not in row_of:
+                row_of[text] = len(texts)
+                texts.append(text)
+            return row_of[text]
+
+        query_rows, answer_rows, truth_rows, source_rows, source_owner = [], [], [], [], []
+        for i, record in enumerate(records):
+            query_rows.append(row(record.get('query', '')))
+            answer_rows.append(row(record.get('answer', '')))
+            truth_rows.append(row(record['ground_truth']) if record.get('ground_truth') else -1)
+            for source in record.get('sources') or []:
+                source_rows.append(row(source.get('content', '')))
+                source_owner.append(i)
+
+        return (texts, np.array(query_rows, dtype=np.int64), np.array(answer_rows, dtype=np.int64),
+                np.array(truth_rows, dtype=np.int64), np.array(source_rows, dtype=np.int64),
+                np.array(source_owner, dtype=np.int64))
+
+    def _build_matrices(self, texts: List[str]) -> Tuple[sp.csr_matrix, sp.csr_matrix]:
+        """返回 (二值词项矩阵, L2归一化的TF-IDF矩阵)，每段文本只分词一次"""
+        tokenized = [jieba.lcut(text) for text in texts]
+        try:
+            counts = CountVectorizer(analyzer=_identity).fit_transform(tokenized).tocsr()
+        except ValueError:
+            # 整批文本均为空时词表为空
+            counts = sp.csr_matrix((len(texts), 1), dtype=np.int64)
+
+        presence = counts.copy()
+        presence.data = np.ones_like(presence.data)
+        tfidf = TfidfTransformer().fit_transform(counts).tocsr()
+        return presence, tfidf
+
+    def _keyword_metrics(self, presence: sp.csr_matrix, query_rows: np.ndarray, answer_rows: np.ndarray,
+                         truth_rows: np.ndarray, source_rows: np.ndarray, source_owner: np.ndarray,
+                         n_records: int) -> Dict[str, np.ndarray]:
+        """基于关键词集合的相关性、忠实度、精确率和召回率"""
+        queries = presence[query_rows]
+        answers = presence[answer_rows]
+        query_sizes = _row_sums(queries)
+        answer_sizes = _row_sums(answers)
+
+        # 每条记录所有来源文档关键词的并集：记录×来源的归属矩阵乘以来源词项矩阵
+        if len(source_rows):
+            sources = presence[source_rows]
+            owner = sp.csr_matrix((np.ones(len(source_owner)), (source_owner, np.arange(len(source_owner)))),
+                                  shape=(n_records, len(source_owner)))
+            source_union = (owner @ sources).tocsr()
+            source_union.data = np.ones_like(source_union.data)
+
+            # 每个来源文档与其所属查询的关键词重叠度
+            source_query_overlap = _row_sums(sources.multiply(queries[source_owner])) / np.maximum(query_sizes[source_owner], 1)
+            relevant_counts = np.bincount(source_owner, weights=source_query_overlap > 0.3, minlength=n_records)
+        else:
+            source_union = sp.csr_matrix((n_records, presence.shape[1]))
+            relevant_counts = np.zeros(n_records)
+
+        source_counts = np.bincount(source_owner, minlength=n_records)
+
+        # 有参考答案的记录：参考答案关键词被来源文档覆盖的比例
+        truth_in_sources = np.full(n_records, np.nan)
+        has_truth = np.flatnonzero(truth_rows >= 0)
+        if len(has_truth):
+            truths = presence[truth_rows[has_truth]]
+            truth_in_sources[has_truth] = (_row_sums(truths.multiply(source_union[has_truth]))
+                                           / np.maximum(_row_sums(truths), 1))
+
+        return {
+            'query_sizes': query_sizes,
+            'answer_sizes': answer_sizes,
+            'keyword_overlap': _row_sums(queries.multiply(answers)) / np.maximum(query_sizes, 1),
+            'answer_in_sources': _row_sums(answers.multiply(source_union)) / np.maximum(answer_sizes, 1),
+            'query_in_sources': _row_sums(queries.multiply(source_union)) / np.maximum(query_sizes, 1),
+            'truth_in_sources': truth_in_sources,
+            'relevant_counts': relevant_counts.astype(np.int64),
+            'source_counts': source_counts
+        }
+
+    def _diversity_metrics(self, source_rows: np.ndarray, source_owner: np.ndarray,
+                           records: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+        """
+        每条记录内来源文档两两之间的平均Jaccard重叠度（词级shingle集合）及近似重复的来源对数
+
+        与 RAGEvaluator 一致：记录的所有来源文档均带有MinHash签名时以签名估计，否则用shingle矩阵精确计算
+        """
+        n_records = len(records)
+        avg_overlap = np.zeros(n_records)
+        near_duplicates = np.zeros(n_records, dtype=np.int64)
+        if len(source_rows) < 2:
+            return {'avg_overlap': avg_overlap, 'near_duplicates': near_duplicates}
+
+        # 同一记录内的来源文档对 (i, j)，i < j
+        starts = np.searchsorted(source_owner, np.arange(n_records))
+        ends = np.searchsorted(source_owner, np.arange(n_records), side='right')
+        pair_i, pair_j = [], []
+        for start, end in zip(starts, ends):
+            if end - start >= 2:
+                i, j = np.triu_indices(end - start, k=1)
+                pair_i.append(i + start)
+                pair_j.append(j + start)
+        if not pair_i:
+            return {'avg_overlap': avg_overlap, 'near_duplicates': near_duplicates}
+        pair_i = np.concatenate(pair_i)
+        pair_j = np.concatenate(pair_j)
+        pair_owner = source_owner[pair_i]
+
+        # 与 source_owner 顺序一致的来源签名，没有签名的来源以空签名占位
+        source_signatures = [source.get('minhash') for record in records for source in record.get('sources') or []]
+        has_signature = np.array([signature is not None for signature in source_signatures])
+        signatures = np.tile(EMPTY_SIGNATURE, (len(source_signatures), 1))
+        if has_signature.any():
+            signatures[has_signature] = np.array([signature for signature in source_signatures if signature is not None],
+                                                 dtype=np.uint32).reshape(-1, NUM_PERM)
+        missing = np.bincount(source_owner, weights=~has_signature, minlength=n_records)
+        use_signature = (missing == 0)[pair_owner]
+
+        overlaps = np.zeros(len(pair_i))
+        overlaps[use_signature] = pair_similarity(signatures[pair_i[use_signature]], signatures[pair_j[use_signature]])
+        exact = ~use_signature
+        if exact.any():
+            # 只对需要精确计算的来源文档构建shingle矩阵
+            contents = [source.get('content', '') for record in records for source in record.get('sources') or []]
+            needed = np.unique(np.concatenate([pair_i[exact], pair_j[exact]]))
+            try:
+                shingles = CountVectorizer(analyzer=text_shingles, binary=True).fit_transform(
+                    [contents[k] for k in needed]).tocsr()
+            except ValueError:
+                # 来源文档均为空，没有任何shingle，重叠度为0
+                shingles = None
+            if shingles is not None:
+                sizes = _row_sums(shingles)
+                exact_i, exact_j = np.searchsorted(needed, pair_i[exact]), np.searchsorted(needed, pair_j[exact])
+                intersections = _row_sums(shingles[exact_i].multiply(shingles[exact_j]))
+                unions = sizes[exact_i] + sizes[exact_j] - intersections
+                overlaps[exact] = intersections / np.maximum(unions, 1)
+
+        totals = np.bincount(pair_owner, weights=overlaps, minlength=n_records)
+        pair_counts = np.bincount(pair_owner, minlength=n_records)
+        np.divide(totals, pair_counts, out=avg_overlap, where=pair_counts > 0)
+        near_duplicates = np.bincount(pair_owner, weights=overlaps >= Config.NEAR_DUPLICATE_THRESHOLD,
+                                      minlength=n_records).astype(np.int64)
+        return {'avg_overlap': avg_overlap, 'near_duplicates': near_duplicates}
+
+    def _assemble(self, i: int, query: str, answer: str, sources: List[Dict], keyword: Dict[str, np.ndarray],
+                  tfidf_similarity: np.ndarray, diversity: Dict[str, np.ndarray]) -> Dict[str, Any]:
+        """将第 i 条记录的向量化结果组装为与 RAGEvaluator 相同的结构"""
+        keyword_overlap = float(keyword['keyword_overlap'][i])
+        length_ratio = min(len(answer) / max(len(query), 1), 10.0) / 10.0
+
+        results = {
+            'answer_relevance': {
+                'tfidf_similarity': float(tfidf_similarity[i]),
+                'keyword_overlap': keyword_overlap,
+                'overall_relevance': float((keyword_overlap + length_ratio) / 2)
+            }
+        }
+
+        if not sources:
+            results['answer_faithfulness'] = {'faithfulness_score': 0.0, 'source_coverage': 0.0}
+            results['context_precision'] = {'precision_score': 0.0, 'relevant_sources_count': 0}
+            results['context_recall'] = {'recall_score': 0.0, 'coverage_estimate': 0.0}
+            results['answer_consistency'] = {'consistency_score': 0.0, 'contradictions_count': 0}
+            results['source_diversity'] = {'diversity_score': 0.0, 'unique_sources': 0}
+            return results
+
+        faithfulness = float(keyword['answer_in_sources'][i])
+        recall = float(keyword['query_in_sources'][i])
+        relevant = int(keyword['relevant_counts'][i])
+        precision = relevant / len(sources)
+
+        results['answer_faithfulness'] = {
+            'faithfulness_score': faithfulness,
+            'source_coverage': faithfulness,
+            'max_source_similarity': faithfulness
+        }
+        results['context_precision'] = {
+            'precision_score': float(precision),
+            'avg_similarity': float(precision),
+            'relevant_sources_count': relevant,
+            'total_sources_count': len(sources)
+        }
+        results['context_recall'] = {
+            'recall_score': recall,
+            'coverage_estimate': recall,
+            'keyword_coverage': recall
+        }
+        if not np.isnan(keyword['truth_in_sources'][i]):
+            truth_coverage = float(keyword['truth_in_sources'][i])
+            results['context_recall']['recall_score'] = truth_coverage
+            results['context_recall']['ground_truth_coverage'] = truth_coverage
+        results['answer_consistency'] = {
+            'consistency_score': faithfulness,
+            'contradictions_count': 0,
+            'consistency_checks': int(keyword['answer_sizes'][i])
+        }
+        if len(sources) < 2:
+            results['source_diversity'] = {'diversity_score': 1.0, 'unique_sources': 1}
+        else:
+            avg_overlap = float(diversity['avg_overlap'][i])
+            results['source_diversity'] = {
+                'diversity_score': 1.0 - avg_overlap,
+                'avg_source_similarity': avg_overlap,
+                'unique_sources': len(set(source.get('content', '') for source in sources)),
+                'near_duplicate_pairs': int(diversity['near_duplicates'][i])
+            }
+        return results
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+RAGEvaluator 评估延迟基准测试
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+import jieba
+
+from rag_evaluator import RAGEvaluator, METRIC_NAMES
+from batch_evaluator import BatchRAGEvaluator
+
+SAMPLE_TEXT = """
+人工智能是计算机科学的一个分支，它企图了解智能的实质，并生产出一种新的能以人类智能相似的方式做出反应的智能机器。
+该领域的研究包括机器人、语言识别、图像识别、自然语言处理和专家系统等。机器学习是人工智能的一个子领域，
+它使计算机能够在没有明确编程的情况下学习和改进。机器学习算法通过分析数据来识别模式，并使用这些模式来做出预测或决策。
+深度学习是机器学习的一个分支，它基于人工神经网络，特别是深度神经网络。深度学习模型可以自动学习数据的层次化表示，
+这使得它在处理复杂模式识别任务时非常有效。常见的深度学习架构包括卷积神经网络、循环神经网络、长短期记忆网络和变换器。
+"""
+
+QUERIES = [
+    "什么是人工智能？",
+    "机器学习有哪些类型？",
+    "深度学习和机器学习有什么区别？",
+    "如何训练一个神经网络模型？"
+]
+
+def make_records(count: int, sources_per_record: int, source_length: int, seed: int = 0, corpus_chunks: int = 0):
+    """生成合成评估记录；corpus_chunks > 0 时来源文档从固定数量的文档块中抽取（模拟检索同一语料库）"""
+    rng = random.Random(seed)
+    sentences = [s for s in SAMPLE_TEXT.replace("\n", "").split("。") if s]
+
+    def paragraph(length):
+        parts = []
+        while sum(len(p) for p in parts) < length:
+            parts.append(rng.choice(sentences) + "。")
+        return "".join(parts)[:length]
+
+    corpus = [paragraph(source_length) for _ in range(corpus_chunks)]
+
+    records = []
+    for i in range(count):
+        records.append({
+            "query": rng.choice(QUERIES),
+            "answer": paragraph(300),
+            "sources": [{"content": rng.choice(corpus) if corpus else paragraph(source_length), "score": rng.random()}
+                        for _ in range(sources_per_record)]
+        })
+    return records
+
+def main():
+    parser = argparse.ArgumentParser(description="RAGEvaluator 评估延迟基准测试")
+    parser.add_argument("--records", type=int, default=200, help="评估记录数")
+    parser.add_argument("--sources", type=int, default=5, help="每条记录的来源文档数")
+    parser.add_argument("--source-length", type=int, default=1000, help="来源文档长度（字符）")
+    parser.add_argument("--corpus-chunks", type=int, default=0, help="来源文档从多少个文档块中抽取（0 表示每个来源都不同）")
+    parser.add_argument("--batch", action="store_true", help="同时测试 BatchRAGEvaluator 批量评估")
+    parser.add_argument("--metrics", nargs="+", choices=METRIC_NAMES, help="只计算这些指标组（默认全部）")
+    args = parser.parse_args()
+
+    records = make_records(args.records, args.sources, args.source_length, corpus_chunks=args.corpus_chunks)
+    evaluator = RAGEvaluator()
+
+    # 预热jieba词典，避免冷启动计入评估耗时
+    jieba.lcut("预热")
+
+    # 统计分词调用次数
+    calls = {"count": 0}
+    original_lcut = jieba.lcut
+    def counting_lcut(*a, **kw):
+        calls["count"] += 1
+        return original_lcut(*a, **kw)
+    jieba.lcut = counting_lcut
+
+    latencies = []
+    try:
+        for record in records:
+            start = time.perf_counter()
+            evaluator.evaluate_rag_response(record["query"], record["answer"], record["sources"], response_time=1.0,
+                                            metrics=args.metrics)
+            latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        jieba.lcut = original_lcut
+
+    latencies.sort()
+    print(f"记录数: {len(records)}，每条来源数: {args.sources}，来源长度: {args.source_length}")
+    print(f"评估指标: {', '.join(args.metrics) if args.metrics else '全部'}")
+    print(f"每条记录分词调用次数: {calls['count'] / len(records):.1f}")
+    print(f"平均延迟: {statistics.mean(latencies):.2f} ms")
+    print(f"p50延迟: {latencies[len(latencies) // 2]:.2f} ms")
+    print(f"p95延迟: {latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]:.2f} ms")
+
+    if args.batch:
+        benchmark_batch(records, sum(latencies) / 1000)
+
+def benchmark_batch(records, sequential_seconds: float):
+    """批量评估耗时，分别统计分词和稀疏矩阵运算"""
+    evaluator = BatchRAGEvaluator()
+    texts = {r["query"] for r in records} | {r["answer"] for r in records}
+    texts |= {s["content"] for r in records for s in r["sources"]}
+
+    start = time.perf_counter()
+    for text in texts:
+        jieba.lcut(text)
+    tokenize_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    evaluator.evaluate_batch(records)
+    batch_seconds = time.perf_counter() - start
+
+    print(f"逐条评估总耗时: {sequential_seconds:.2f} s")
+    print(f"批量评估总耗时: {batch_seconds:.2f} s（其中分词约 {tokenize_seconds:.2f} s，矩阵运算约 {max(batch_seconds - tokenize_seconds, 0):.2f} s）")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+检索延迟与召回率对比：在同一批嵌入和标注查询集上比较不同的FAISS索引配置
+"""
+
+import argparse
+import math
+import time
+from typing import List, Dict, Any, Tuple
+
+import faiss
+import numpy as np
+
+from config import Config
+from eval_runner import load_dataset
+from rag_evaluator import RAGEvaluator
+from rag_system import RAGSystem
+
+def build_variants(embeddings: np.ndarray, nlist: int, nprobes: List[int], hnsw_m: int,
+                   ef_searches: List[int]) -> Dict[str, Tuple[Any, str]]:
+    """
+    构建待比较的索引：Flat（基准）、8位标量量化、IVF（不同nprobe）和HNSW（不同efSearch）
+
+    Returns:
+        {配置名称: (索引, 检索参数字符串)}
+    """
+    dimension = embeddings.shape[1]
+    variants = {}
+
+    flat = faiss.IndexFlatIP(dimension)
+    flat.add(embeddings)
+    variants['Flat'] = (flat, '')
+
+    sq8 = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    sq8.train(embeddings)
+    sq8.add(embeddings)
+    variants['SQ8'] = (sq8, '')
+
+    # IVF训练至少需要 nlist 个向量
+    nlist = max(1, min(nlist, len(embeddings)))
+    quantizer = faiss.IndexFlatIP(dimension)
+    ivf = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+    ivf.train(embeddings)
+    ivf.add(embeddings)
+    for nprobe in nprobes:
+        variants[f'IVF{nlist},nprobe={nprobe}'] = (ivf, f'nprobe={min(nprobe, nlist)}')
+
+    hnsw = faiss.IndexHNSWFlat(dimension, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+    hnsw.add(embeddings)
+    for ef_search in ef_searches:
+        variants[f'HNSW{hnsw_m},ef={ef_search}'] = (hnsw, f'efSearch={ef_search}')
+
+    return variants
+
+def run_variant(index, query_vectors: np.ndarray, top_k: int):
+    """逐条查询检索（与在线请求一致），返回 (各查询结果位置, 各查询耗时毫秒)"""
+    positions, latencies = [], []
+    for vector in query_vectors:
+        start = time.perf_counter()
+        _, indices = index.search(vector.reshape(1, -1), top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        positions.append([int(i) for i in indices[0] if i >= 0])
+    return positions, latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="检索延迟与召回率对比")
+    parser.add_argument("dataset", help="带 relevant_chunk_ids 标注的数据集JSONL文件")
+    parser.add_argument("--index", required=True, help="已保存的索引文件")
+    parser.add_argument("--provider", choices=["ollama", "openai"], default="ollama", help="嵌入模型提供商")
+    parser.add_argument("--level", choices=["chunk", "document"], default="chunk",
+                        help="按文档块编号还是文档来源判断相关性（document 时标注应为 source）")
+    parser.add_argument("--k", type=int, default=5, help="对比表中报告的截断位置")
+    parser.add_argument("--nlist", type=int, default=0, help="IVF聚类中心数（默认为 4*sqrt(文档块数)）")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16], help="IVF检索的聚类数")
+    parser.add_argument("--hnsw-m", type=int, default=32, help="HNSW每个节点的连接数")
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64], help="HNSW检索的候选列表大小")
+    args = parser.parse_args()
+
+    embedding_config = (Config.get_openai_embedding_config() if args.provider == 'openai'
+                        else Config.get_ollama_embedding_config())
+    rag_system = RAGSystem(embedding_config=embedding_config)
+    rag_system.load_index(args.index)
+
+    field = 'relevant_chunk_ids' if args.level == 'chunk' else 'relevant_sources'
+    records = [record for record in load_dataset(args.dataset) if record.get(field)]
+    if not records:
+        raise SystemExit(f"数据集中没有带 {field} 标注的记录")
+    query_vectors = rag_system.embed_queries([record['query'] for record in records])
+
+    embeddings = rag_system.embeddings_matrix
+    nlist = args.nlist or int(4 * math.sqrt(len(embeddings)))
+    variants = build_variants(embeddings, nlist, args.nprobe, args.hnsw_m, args.ef_search)
+
+    evaluator = RAGEvaluator()
+    top_k = max(args.k, 10)
+    runs = {}
+    parameters = faiss.ParameterSpace()
+    for name, (index, search_parameters) in variants.items():
+        if search_parameters:
+            parameters.set_index_parameters(index, search_parameters)
+        positions, latencies = run_variant(index, query_vectors, top_k)
+        if args.level == 'chunk':
+            retrieved = [[rag_system._get_chunk_metadata(i)['chunk_id'] for i in row] for row in positions]
+        else:
+            # 文档级标注同时匹配去重时合并到该文档块的重复块所在文档
+            retrieved = [evaluator.retrieved_ids_from_sources(
+                [{'metadata': rag_system._get_chunk_metadata(i)} for i in row], 'source') for row in positions]
+        runs[name] = {
+            'retrieval': evaluator.evaluate_retrieval(retrieved, [record[field] for record in records],
+                                                      k_values=(1, 3, args.k, 10)),
+            'latencies_ms': latencies
+        }
+
+    print(f"文档块数: {len(embeddings)}，标注查询数: {len(records)}")
+    print(evaluator.retrieval_tradeoff_table(runs, k=args.k))
+
+if __name__ == "__main__":
+    main()
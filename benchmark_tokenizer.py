@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+jieba分词冷启动与预热后的延迟对比
+
+每种场景在独立的子进程中运行，以测得真实的首次分词耗时。
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+SAMPLE_TEXT = "机器学习是人工智能的一个子领域，它使计算机能够在没有明确编程的情况下学习和改进。"
+
+# 子进程：计时初始化（可选）、首次分词及之后的分词
+# mode: cold 不预热；warm 先调用 init_tokenizer()；fork 预热后在fork出的子进程中计时首次分词
+CHILD = r"""
+import json, multiprocessing, sys, time
+import jieba
+jieba.setLogLevel(60)
+cache_file, mode, text, repeat = sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4])
+from tokenizer import init_tokenizer, freeze_for_fork
+
+def measure():
+    start = time.perf_counter()
+    jieba.lcut(text)
+    first_ms = (time.perf_counter() - start) * 1000
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        jieba.lcut(text)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return first_ms, samples[len(samples) // 2]
+
+init_ms = None
+if mode == "cold":
+    jieba.dt.cache_file = cache_file
+else:
+    start = time.perf_counter()
+    init_tokenizer(cache_file=cache_file, user_dicts=[])
+    init_ms = (time.perf_counter() - start) * 1000
+
+if mode == "fork":
+    freeze_for_fork()
+    with multiprocessing.get_context("fork").Pool(1) as pool:
+        first_ms, steady_ms = pool.apply(measure)
+else:
+    first_ms, steady_ms = measure()
+print(json.dumps({"init_ms": init_ms, "first_ms": first_ms, "steady_p50_ms": steady_ms}))
+"""
+
+def run_child(cache_file: str, mode: str, repeat: int):
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, cache_file, mode, SAMPLE_TEXT, str(repeat)],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="jieba分词冷启动与预热延迟对比")
+    parser.add_argument("--runs", type=int, default=3, help="每种场景的子进程次数")
+    parser.add_argument("--repeat", type=int, default=200, help="每个子进程中稳态分词次数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache_file = os.path.join(directory, "jieba.cache")
+        scenarios = []
+
+        # 无缓存冷启动：首次分词时从词典文件构建前缀词典
+        cold = []
+        for _ in range(args.runs):
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+            cold.append(run_child(cache_file, "cold", args.repeat))
+        scenarios.append(("冷启动（无缓存）", cold))
+
+        # 有缓存但未预热：首次分词时加载缓存
+        scenarios.append(("首次分词加载缓存", [run_child(cache_file, "cold", args.repeat) for _ in range(args.runs)]))
+
+        # 启动时 init_tokenizer() 预热：加载耗时发生在启动阶段，首次分词不再阻塞
+        scenarios.append(("init_tokenizer预热", [run_child(cache_file, "warm", args.repeat) for _ in range(args.runs)]))
+
+        # 预热后fork的子进程（如评估进程池）：继承父进程已加载的词典
+        scenarios.append(("fork子进程继承", [run_child(cache_file, "fork", args.repeat) for _ in range(args.runs)]))
+
+    print(f"{'场景':<20} {'初始化 ms':>10} {'首次分词 ms':>12} {'稳态分词 p50 ms':>16}")
+    for name, results in scenarios:
+        init = [r["init_ms"] for r in results if r["init_ms"] is not None]
+        init_ms = f"{sum(init) / len(init):.1f}" if init else "-"
+        first_ms = sum(r["first_ms"] for r in results) / len(results)
+        steady_ms = sum(r["steady_p50_ms"] for r in results) / len(results)
+        print(f"{name:<20} {init_ms:>10} {first_ms:>12.1f} {steady_ms:>16.3f}")
+
+if __name__ == "__main__":
+    main()
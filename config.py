@@ -7,6 +7,79 @@ class Config:
     OLLAMA_LLM_MODEL = os.getenv("OLLAMA_LLM_MODEL", "deepseek-r1:1.5b")
     OLLAMA_EMBEDDING_MODEL = os.getenv("OLLAMA_EMBEDDING_MODEL", "bge-small-zh")
 
+    # 提示词上下文的token预算
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+
+    # 批量问答的并发生成线程数及上限
+    BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "4"))
+    BATCH_MAX_WORKERS_LIMIT = int(os.getenv("BATCH_MAX_WORKERS_LIMIT", "16"))
+
+    # 多LLM后端：对冲请求与熔断
+    LLM_HEDGING = os.getenv("LLM_HEDGING", "false").lower() == "true"
+    LLM_FAILURE_THRESHOLD = int(os.getenv("LLM_FAILURE_THRESHOLD", "3"))
+    LLM_CIRCUIT_COOLDOWN = float(os.getenv("LLM_CIRCUIT_COOLDOWN", "30"))
+
+    # 是否以流式方式调用LLM（可测量首个token的时间）
+    LLM_STREAM = os.getenv("LLM_STREAM", "false").lower() == "true"
+
+    # LLM生成准入控制：并发上限、等待队列长度、排队期限（秒）
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+    LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+    LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+    # 批量问答和离线评估的问题未被接纳时按退避重试，等待超过该秒数才记为失败
+    BATCH_ADMISSION_MAX_WAIT = float(os.getenv("BATCH_ADMISSION_MAX_WAIT", "1800"))
+
+    # 检索置信度门控（未设置最低分时关闭）；证据不足时的处理方式：no_answer 或 retrieval_only
+    RETRIEVAL_GATE_MIN_SCORE = float(os.environ["RETRIEVAL_GATE_MIN_SCORE"]) if os.getenv("RETRIEVAL_GATE_MIN_SCORE") else None
+    RETRIEVAL_GATE_CONFIDENT_SCORE = float(os.environ["RETRIEVAL_GATE_CONFIDENT_SCORE"]) if os.getenv("RETRIEVAL_GATE_CONFIDENT_SCORE") else None
+    RETRIEVAL_GATE_MIN_RELATIVE_GAP = float(os.getenv("RETRIEVAL_GATE_MIN_RELATIVE_GAP", "0"))
+    RETRIEVAL_GATE_MODE = os.getenv("RETRIEVAL_GATE_MODE", "no_answer")
+
+    # 检索数量；启用自适应top-k时在 [最小值, 最大值] 内按分数分布截断
+    RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+    ADAPTIVE_TOP_K = os.getenv("ADAPTIVE_TOP_K", "false").lower() == "true"
+    ADAPTIVE_TOP_K_MIN = int(os.getenv("ADAPTIVE_TOP_K_MIN", "2"))
+    ADAPTIVE_TOP_K_MAX = int(os.getenv("ADAPTIVE_TOP_K_MAX", "10"))
+    ADAPTIVE_TOP_K_RELATIVE_THRESHOLD = float(os.getenv("ADAPTIVE_TOP_K_RELATIVE_THRESHOLD", "0.8"))
+    ADAPTIVE_TOP_K_MAX_RELATIVE_GAP = float(os.getenv("ADAPTIVE_TOP_K_MAX_RELATIVE_GAP", "0.1"))
+
+    # 按需性能剖析（请求头 X-Profile: 1 或查询参数 profile=1 触发）及管理接口令牌
+    PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+    PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "20"))
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+    # jieba分词器：预构建的词典缓存文件（为空时使用jieba默认的临时目录缓存）及逗号分隔的用户词典
+    TOKENIZER_CACHE_FILE = os.getenv("TOKENIZER_CACHE_FILE", "")
+    TOKENIZER_USER_DICTS = [path for path in os.getenv("TOKENIZER_USER_DICTS", "").split(",") if path]
+
+    # MinHash估计的Jaccard相似度（相邻3个词项组成的shingle集合）不低于该值的文档块视为近似重复
+    NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+    # 导入文档时的去重：near 去除内容相同及近似重复的文档块，exact 只去除内容相同的文档块，off 关闭
+    INGEST_DEDUP = os.getenv("INGEST_DEDUP", "near")
+    # 导入文档时并行解析的进程数（0 表示CPU核数）及单个文件从开始解析起的超时（秒，超时的解析进程被终止并替换）；
+    # 超时为0且进程数为1时在当前线程中逐个解析
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0"))
+    INGEST_FILE_TIMEOUT = float(os.getenv("INGEST_FILE_TIMEOUT", "300"))
+    # 流式导入（解析 → 嵌入 → 索引）时每批嵌入的文档块数及解析线程与嵌入之间的队列长度
+    INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "64"))
+    INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "256"))
+    # 分段读取文本文件时每段的字符数（决定分割大文件时的内存占用）
+    TEXT_CHUNK_WINDOW_CHARS = int(os.getenv("TEXT_CHUNK_WINDOW_CHARS", "1000000"))
+
+    # 在线问答的抽样自动评估（抽样率为0时关闭）
+    AUTO_EVAL_SAMPLE_RATE = float(os.getenv("AUTO_EVAL_SAMPLE_RATE", "0"))
+    AUTO_EVAL_WORKERS = int(os.getenv("AUTO_EVAL_WORKERS", "1"))
+    AUTO_EVAL_MAX_PENDING = int(os.getenv("AUTO_EVAL_MAX_PENDING", "16"))
+    # 逗号分隔的评估指标组，为空时计算全部（见 rag_evaluator.METRIC_NAMES）
+    AUTO_EVAL_METRICS = [name for name in os.getenv("AUTO_EVAL_METRICS", "").split(",") if name]
+
+    # 评估结果与请求耗时的流式聚合（按时间窗口、模型配置分组），定期快照到磁盘（路径为空时不快照）
+    EVAL_AGG_WINDOW_SECONDS = float(os.getenv("EVAL_AGG_WINDOW_SECONDS", "300"))
+    EVAL_AGG_MAX_WINDOWS = int(os.getenv("EVAL_AGG_MAX_WINDOWS", "288"))
+    EVAL_AGG_SNAPSHOT_PATH = os.getenv("EVAL_AGG_SNAPSHOT_PATH", "evaluation_stats.json")
+    EVAL_AGG_SNAPSHOT_INTERVAL = float(os.getenv("EVAL_AGG_SNAPSHOT_INTERVAL", "60"))
+
     @staticmethod
     def get_ollama_llm_config():
         return {
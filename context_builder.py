@@ -0,0 +1,117 @@
+import re
+from typing import List, Dict, Any, Tuple
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数量
+
+    中日韩字符约按每字1个token计算，其余字符约按每4个字符1个token计算。
+    """
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+class ContextBuilder:
+    """在token预算内构建提示词上下文，合并同一来源中重叠或相邻的文档块"""
+
+    def __init__(self, token_budget: int = 3000, min_fragment_tokens: int = 32):
+        self.token_budget = token_budget
+        self.min_fragment_tokens = min_fragment_tokens
+
+    def build(self, results: List[Dict[str, Any]]) -> Tuple[str, Dict[str, Any]]:
+        """
+        构建上下文
+
+        Args:
+            results: 检索结果列表（含 content、score、metadata）
+
+        Returns:
+            (上下文文本, 统计信息)
+        """
+        raw_tokens = sum(estimate_tokens(result['content']) for result in results)
+        segments = self._dedupe_segments(self._merge_segments(results))
+        segments.sort(key=lambda segment: segment['score'], reverse=True)
+
+        # 按分数顺序填充token预算
+        parts = []
+        used_tokens = 0
+        dropped_segments = 0
+        for segment in segments:
+            content = segment['content']
+            tokens = estimate_tokens(content)
+            remaining = self.token_budget - used_tokens
+            if tokens > remaining:
+                if remaining < self.min_fragment_tokens:
+                    dropped_segments += 1
+                    continue
+                content = self._truncate_to_tokens(content, remaining)
+                tokens = estimate_tokens(content)
+            parts.append(content)
+            used_tokens += tokens
+
+        context = "\n\n".join([f"文档片段 {i+1}: {content}" for i, content in enumerate(parts)])
+
+        stats = {
+            'token_budget': self.token_budget,
+            'raw_tokens': raw_tokens,
+            'context_tokens': used_tokens,
+            'tokens_saved': max(raw_tokens - used_tokens, 0),
+            'chunks_in': len(results),
+            'segments_out': len(parts),
+            'dropped_segments': dropped_segments
+        }
+        return context, stats
+
+    def _merge_segments(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """合并同一来源（同一页）中位置重叠或相邻的文档块"""
+        segments = []
+        positioned: Dict[Tuple, List[Dict[str, Any]]] = {}
+
+        for result in results:
+            metadata = result.get('metadata') or {}
+            start = metadata.get('start_index')
+            if metadata.get('source') is not None and start is not None and start >= 0:
+                key = (metadata['source'], metadata.get('page'))
+                positioned.setdefault(key, []).append(result)
+            else:
+                segments.append({'content': result['content'], 'score': result['score']})
+
+        for group in positioned.values():
+            group.sort(key=lambda result: result['metadata']['start_index'])
+            current = None
+            for result in group:
+                start = result['metadata']['start_index']
+                end = start + len(result['content'])
+                if current is not None and start <= current['end']:
+                    # 只追加尚未覆盖的部分
+                    if end > current['end']:
+                        current['content'] += result['content'][current['end'] - start:]
+                        current['end'] = end
+                    current['score'] = max(current['score'], result['score'])
+                else:
+                    if current is not None:
+                        segments.append(current)
+                    current = {'content': result['content'], 'score': result['score'], 'end': end}
+            if current is not None:
+                segments.append(current)
+
+        return segments
+
+    def _dedupe_segments(self, segments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """去除完全包含在其他片段中的重复片段"""
+        unique = []
+        for segment in sorted(segments, key=lambda segment: len(segment['content']), reverse=True):
+            container = next((u for u in unique if segment['content'] in u['content']), None)
+            if container is not None:
+                container['score'] = max(container['score'], segment['score'])
+                continue
+            unique.append(segment)
+        return unique
+
+    def _truncate_to_tokens(self, text: str, max_tokens: int) -> str:
+        """将文本截断到不超过指定token数"""
+        cut = int(len(text) * max_tokens / max(estimate_tokens(text), 1))
+        while cut > 0 and estimate_tokens(text[:cut]) > max_tokens:
+            cut -= max(cut // 20, 1)
+        return text[:cut]
@@ -126,12 +126,11 @@ def main():
         "神经网络在哪些领域有应用？"
     ]
     
-    for question in demo_questions:
-        print(f"\n问题: {question}")
+    # 批量检索并并发生成，按完成顺序输出
+    for result in qa_system.answer_batch(demo_questions):
+        print(f"\n问题: {result['query']}")
         print("-" * 30)
         
-        result = qa_system.get_answer_with_sources(question)
-        
         if "error" in result:
             print(f"错误: {result['error']}")
         else:
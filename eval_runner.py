@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+离线评估运行器：对JSONL数据集批量执行检索问答并评估
+
+数据集每行一个JSON对象：
+    {"id": "q1", "query": "问题", "ground_truth": "可选参考答案", "relevant_chunk_ids": [可选相关文档块编号]}
+
+结果逐条追加写入输出JSONL文件，该文件同时作为检查点：中断后重新运行会跳过已成功完成的记录。
+"""
+
+import argparse
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Sequence, Set, Iterator
+
+from config import Config
+from rag_system import RAGSystem, worker_context
+from qa_system import QASystem
+from rag_evaluator import RAGEvaluator, primary_scores
+from telemetry import LatencyStats
+from tokenizer import init_tokenizer
+
+_worker_evaluator: Optional[RAGEvaluator] = None
+
+def _init_scoring_worker():
+    """评分进程初始化：从缓存文件加载词典（父进程已在创建进程池前生成缓存）"""
+    global _worker_evaluator
+    init_tokenizer()
+    _worker_evaluator = RAGEvaluator()
+
+def _score_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """在评分进程中评估单条记录"""
+    evaluator = _worker_evaluator or RAGEvaluator()
+    record['evaluation'] = evaluator.evaluate_rag_response(
+        record['query'], record['answer'], record['sources'],
+        ground_truth=record.get('ground_truth'),
+        response_time=record.get('response_time'),
+        llm_usage=record.get('llm_usage'),
+        timings=record.get('timings')
+    )
+    return record
+
+def load_dataset(path: str) -> List[Dict[str, Any]]:
+    """读取JSONL数据集，缺少 id 的记录以行号作为 id"""
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"数据集第 {line_no} 行不是合法JSON: {e}")
+            if not record.get('query'):
+                raise ValueError(f"数据集第 {line_no} 行缺少 query 字段")
+            record['id'] = str(record.get('id', line_no))
+            records.append(record)
+    return records
+
+def read_results(path: str) -> Iterator[Dict[str, Any]]:
+    """读取结果文件；跳过中断时写了一半的最后一行"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+def truncate_partial_line(path: str):
+    """截掉中断时写了一半的最后一行，避免续跑追加的记录与其拼接在同一行"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            step = min(4096, position)
+            f.seek(position - step)
+            block = f.read(step)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                position = position - step + newline + 1
+                break
+            position -= step
+        if position < end:
+            f.truncate(position)
+
+def completed_ids(path: str) -> Set[str]:
+    """检查点中已成功完成的记录 id（出错的记录会在续跑时重试）"""
+    return {result['id'] for result in read_results(path) if 'error' not in result}
+
+class EvaluationRunner:
+    """
+    离线评估运行器
+
+    按批驱动 QASystem.answer_batch（以 evaluation 优先级经过生成准入控制），
+    评分提交到进程池执行（jieba分词受GIL限制），下一批的检索生成与上一批的评分重叠进行。
+    进程池按需创建评分进程时 answer_batch 的线程仍在运行，因此以 forkserver/spawn 而非fork启动评分进程。
+    """
+
+    def __init__(self, qa_system: QASystem, concurrency: int = 4, scoring_workers: Optional[int] = None,
+                 batch_size: int = 32):
+        self.qa_system = qa_system
+        self.concurrency = max(1, concurrency)
+        self.scoring_workers = scoring_workers or os.cpu_count() or 1
+        self.batch_size = max(1, batch_size)
+
+    def run(self, dataset_path: str, output_path: str, resume: bool = True,
+            k_values: Sequence[int] = (1, 3, 5, 10)) -> Dict[str, Any]:
+        """
+        执行评估
+
+        Args:
+            dataset_path: 数据集JSONL路径
+            output_path: 逐条结果JSONL路径（检查点）
+            resume: 是否跳过输出文件中已完成的记录；为False时覆盖输出文件
+            k_values: 检索指标的截断位置（检索至其中的最大值，与交给LLM的来源数无关）
+
+        Returns:
+            全部结果（含此前运行完成的记录）的汇总统计
+        """
+        records = load_dataset(dataset_path)
+        if resume:
+            truncate_partial_line(output_path)
+            done = completed_ids(output_path)
+        else:
+            done = set()
+            open(output_path, 'w').close()
+        pending = [record for record in records if record['id'] not in done]
+        print(f"数据集共 {len(records)} 条，已完成 {len(records) - len(pending)} 条，待评估 {len(pending)} 条")
+
+        # 在创建评分进程前加载词典并生成缓存文件，评分进程直接加载缓存
+        init_tokenizer()
+
+        scoring: deque = deque()
+        with open(output_path, 'a', encoding='utf-8') as output, \
+                ProcessPoolExecutor(max_workers=self.scoring_workers, initializer=_init_scoring_worker,
+                                    mp_context=worker_context('rag_evaluator')) as pool:
+            for start in range(0, len(pending), self.batch_size):
+                batch = pending[start:start + self.batch_size]
+                for record in self._answer(batch, max(k_values)):
+                    if 'error' in record:
+                        self._write(output, record)
+                    else:
+                        scoring.append(pool.submit(_score_record, record))
+                    # 限制在途评分任务数量，避免结果在内存中堆积
+                    while len(scoring) > self.scoring_workers * 4:
+                        self._write(output, scoring.popleft().result())
+                    self._write_finished(output, scoring)
+                print(f"已处理 {min(start + self.batch_size, len(pending))}/{len(pending)}")
+
+            while scoring:
+                self._write(output, scoring.popleft().result())
+
+        return summarize(list(read_results(output_path)), k_values)
+
+    def _answer(self, batch: List[Dict[str, Any]], retrieval_depth: int) -> Iterator[Dict[str, Any]]:
+        """
+        检索并生成一批问题的答案，按完成顺序产出待评分记录
+
+        检索指标使用检索至 retrieval_depth 的原始排序结果，而不是经门控和截断后交给LLM的来源
+        """
+        queries = [record['query'] for record in batch]
+        for result in self.qa_system.answer_batch(queries, max_workers=self.concurrency, priority='evaluation',
+                                                  retrieval_depth=retrieval_depth):
+            record = batch[result['index']]
+            sources = result.get('sources', [])
+            retrieved = result.get('retrieved_chunk_ids')
+            if retrieved is None:
+                retrieved = [source.get('metadata', {}).get('chunk_id') for source in sources]
+            output = {
+                'id': record['id'],
+                'query': record['query'],
+                'ground_truth': record.get('ground_truth'),
+                'relevant_chunk_ids': record.get('relevant_chunk_ids'),
+                'answer': result.get('answer', ''),
+                'sources': sources,
+                'retrieved_chunk_ids': retrieved,
+                'response_time': result.get('response_time'),
+                'timings': result.get('timings'),
+                'llm_usage': result.get('llm_usage')
+            }
+            if 'error' in result:
+                output['error'] = result['error']
+            yield output
+
+    def _write_finished(self, output, scoring: deque):
+        """写出已完成的评分结果（保持提交顺序，不阻塞）"""
+        while scoring and scoring[0].done():
+            self._write(output, scoring.popleft().result())
+
+    def _write(self, output, record: Dict[str, Any]):
+        # 结果文件中不保存来源全文，只保留块编号和分数
+        record = dict(record)
+        record['sources'] = [
+            {'chunk_id': source.get('metadata', {}).get('chunk_id'), 'score': source.get('score'),
+             'source': source.get('metadata', {}).get('source')}
+            for source in record.get('sources', [])
+        ]
+        output.write(json.dumps(record, ensure_ascii=False) + '\n')
+        output.flush()
+
+def summarize(results: List[Dict[str, Any]], k_values: Sequence[int] = (1, 3, 5, 10)) -> Dict[str, Any]:
+    """汇总结果：同一 id 只取最后一次记录；k_values 为检索指标的截断位置"""
+    latest = {}
+    for result in results:
+        latest[result['id']] = result
+    results = list(latest.values())
+
+    scored = [result for result in results if 'evaluation' in result]
+    summary = {
+        'records': len(results),
+        'evaluated': len(scored),
+        'errors': sum(1 for result in results if 'error' in result),
+        'scores': {}
+    }
+
+    totals: Dict[str, List[float]] = {}
+    for result in scored:
+        for name, value in primary_scores(result['evaluation']).items():
+            totals.setdefault(name, []).append(value)
+    summary['scores'] = {name: sum(values) / len(values) for name, values in totals.items()}
+
+    latency = LatencyStats(window=max(len(results), 1))
+    for result in results:
+        latency.observe(dict({'response_time_ms': result.get('response_time')}, **(result.get('timings') or {})))
+    summary['latency'] = latency.summary()
+
+    # 有标注相关文档块的记录：在整个查询集上计算排序检索指标
+    labelled = [result for result in scored if result.get('relevant_chunk_ids')]
+    if labelled:
+        summary['retrieval'] = RAGEvaluator().evaluate_retrieval(
+            [result['retrieved_chunk_ids'] for result in labelled],
+            [result['relevant_chunk_ids'] for result in labelled],
+            k_values=k_values
+        )
+    return summary
+
+def build_qa_system(args) -> QASystem:
+    """按命令行参数构建检索问答系统"""
+    if args.provider == 'openai':
+        embedding_config, llm_config = Config.get_openai_embedding_config(), Config.get_openai_llm_config()
+    else:
+        embedding_config, llm_config = Config.get_ollama_embedding_config(), Config.get_ollama_llm_config()
+
+    rag_system = RAGSystem(embedding_config=embedding_config)
+    if args.index:
+        rag_system.load_index(args.index)
+    else:
+        rag_system.add_documents(args.docs)
+        rag_system.build_index()
+    return QASystem(rag_system, llm_config=llm_config)
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG系统离线评估")
+    parser.add_argument("dataset", help="数据集JSONL文件")
+    parser.add_argument("--output", default="eval_results.jsonl", help="逐条结果JSONL文件（兼作检查点）")
+    parser.add_argument("--summary", help="汇总结果JSON文件（默认为输出文件名加 .summary.json）")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--index", help="已保存的索引文件")
+    source.add_argument("--docs", nargs="+", help="用于构建索引的文档")
+    parser.add_argument("--provider", choices=["ollama", "openai"], default="ollama", help="模型提供商")
+    parser.add_argument("--concurrency", type=int, default=Config.BATCH_MAX_WORKERS, help="并发生成答案的最大线程数")
+    parser.add_argument("--workers", type=int, default=None, help="评分进程数（默认为CPU核数）")
+    parser.add_argument("--batch-size", type=int, default=32, help="每批检索的问题数")
+    parser.add_argument("--k", type=int, default=5, help="检索指标对比表中报告的截断位置")
+    parser.add_argument("--no-resume", action="store_true", help="忽略已有结果，重新评估全部记录")
+    args = parser.parse_args()
+
+    runner = EvaluationRunner(build_qa_system(args), concurrency=args.concurrency,
+                              scoring_workers=args.workers, batch_size=args.batch_size)
+    summary = runner.run(args.dataset, args.output, resume=not args.no_resume,
+                         k_values=sorted({1, 3, 5, 10, args.k}))
+
+    summary_path = args.summary or os.path.splitext(args.output)[0] + ".summary.json"
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if summary.get('retrieval'):
+        latencies = [result['timings']['search_ms'] for result in read_results(args.output)
+                     if (result.get('timings') or {}).get('search_ms') is not None]
+        run = {'retrieval': summary['retrieval'], 'latencies_ms': latencies}
+        print(RAGEvaluator().retrieval_tradeoff_table({os.path.basename(args.output): run}, k=args.k))
+    print(f"汇总结果已保存到: {summary_path}")
+    return 0 if summary['errors'] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
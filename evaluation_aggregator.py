@@ -0,0 +1,312 @@
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, Any, Optional, List
+
+from rag_evaluator import primary_scores, OVERALL_WEIGHTS
+
+class QuantileSketch:
+    """
+    对数分桶的流式分位数草图（DDSketch）
+
+    数值按 gamma 的幂分桶，分位数估计的相对误差不超过 relative_accuracy；
+    桶数超过 max_buckets 时合并最低的两个桶，内存占用恒定（高分位数的精度不受影响）。
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 512, min_value: float = 1e-6):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        """记录一个非负数值（不大于 min_value 的数值计入零桶）"""
+        if value <= self.min_value:
+            self.zero_count += 1
+        else:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[key] = self.buckets.get(key, 0) + 1
+            if len(self.buckets) > self.max_buckets:
+                self._collapse()
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def _collapse(self):
+        lowest, second = sorted(self.buckets)[:2]
+        self.buckets[second] += self.buckets.pop(lowest)
+
+    def merge(self, other: 'QuantileSketch'):
+        """合并另一个相同参数的草图"""
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        while len(self.buckets) > self.max_buckets:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """估计分位数；没有数据时返回None"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return max(self.min, 0.0)
+        cumulative = self.zero_count
+        for key in sorted(self.buckets):
+            cumulative += self.buckets[key]
+            if cumulative > rank:
+                # 桶中心值：(gamma^(key-1), gamma^key] 区间的相对误差最小点
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        """数量、均值、极值和 p50/p95/p99"""
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else None,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'p50': self.quantile(0.50),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99)
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'buckets': {str(key): count for key, count in self.buckets.items()},
+            'zero_count': self.zero_count,
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], relative_accuracy: float = 0.01,
+                  max_buckets: int = 512) -> 'QuantileSketch':
+        sketch = cls(relative_accuracy, max_buckets)
+        sketch.buckets = {int(key): count for key, count in data['buckets'].items()}
+        sketch.zero_count = data['zero_count']
+        sketch.count = data['count']
+        sketch.sum = data['sum']
+        sketch.min = data['min'] if data['min'] is not None else math.inf
+        sketch.max = data['max'] if data['max'] is not None else -math.inf
+        return sketch
+
+class EvaluationAggregator:
+    """
+    评估结果与请求耗时的流式聚合
+
+    按 时间窗口 × 模型配置 × 指标 维护分位数草图（同时提供均值），
+    窗口数和模型配置数均有上限，内存占用恒定；可定期将全部窗口快照到磁盘，重启后恢复。
+    """
+
+    def __init__(self, window_seconds: float = 300.0, max_windows: int = 288, max_configs: int = 20,
+                 relative_accuracy: float = 0.01, snapshot_path: Optional[str] = None,
+                 snapshot_interval: float = 60.0):
+        self.window_seconds = window_seconds
+        self.max_windows = max_windows
+        self.max_configs = max_configs
+        self.relative_accuracy = relative_accuracy
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        # {窗口起点: {模型配置: {指标: 草图}}}
+        self._windows: Dict[float, Dict[str, Dict[str, QuantileSketch]]] = {}
+        self._configs: List[str] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        if snapshot_path and os.path.exists(snapshot_path):
+            try:
+                self.load(snapshot_path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"加载评估聚合快照失败: {e}")
+
+    def record(self, values: Dict[str, float], config: str = 'default', timestamp: Optional[float] = None):
+        """记录一组指标值"""
+        timestamp = time.time() if timestamp is None else timestamp
+        window_start = timestamp - timestamp % self.window_seconds
+        with self._lock:
+            if config not in self._configs:
+                # 模型配置数达到上限后，新配置归入 other
+                if len(self._configs) >= self.max_configs:
+                    config = 'other'
+                if config not in self._configs:
+                    self._configs.append(config)
+            window = self._windows.get(window_start)
+            if window is None:
+                window = self._windows[window_start] = {}
+                self._expire()
+            series = window.setdefault(config, {})
+            for metric, value in values.items():
+                if value is None:
+                    continue
+                sketch = series.get(metric)
+                if sketch is None:
+                    sketch = series[metric] = QuantileSketch(self.relative_accuracy)
+                sketch.add(float(value))
+
+    def ingest_evaluation(self, evaluation_results: Dict[str, Any], config: str = 'default',
+                          timestamp: Optional[float] = None):
+        """
+        记录一次评估结果的各指标主分数
+
+        只评估了部分指标时，综合评分按所选指标的权重重新归一化，与完整评估的综合评分不可比，
+        记为 overall_score[指标+指标] 单独聚合；未评估任何计权指标时没有综合评分，不记录
+        """
+        scores = primary_scores(evaluation_results)
+        components = evaluation_results.get('overall_score', {}).get('weighted_components')
+        if 'overall_score' in scores and components is not None and set(components) != set(OVERALL_WEIGHTS):
+            label = '+'.join(metric for metric in OVERALL_WEIGHTS if metric in components)
+            scores[f'overall_score[{label}]'] = scores.pop('overall_score')
+        self.record(scores, config, timestamp)
+
+    def ingest_timings(self, timings: Dict[str, Any], config: str = 'default', timestamp: Optional[float] = None):
+        """记录一次请求的各阶段耗时（毫秒）"""
+        self.record({name: value for name, value in timings.items() if isinstance(value, (int, float))},
+                    config, timestamp)
+
+    def _expire(self):
+        """丢弃超出窗口数上限的最旧窗口"""
+        while len(self._windows) > self.max_windows:
+            del self._windows[min(self._windows)]
+
+    def query(self, metric: Optional[str] = None, config: Optional[str] = None, since: Optional[float] = None,
+              per_window: bool = False) -> Dict[str, Any]:
+        """
+        查询聚合结果
+
+        Args:
+            metric: 只返回该指标
+            config: 只返回该模型配置
+            since: 只合并起点不早于该时间戳所在窗口的数据
+            per_window: 是否同时返回每个时间窗口的结果
+
+        Returns:
+            {'configs': {模型配置: {指标: 统计}}, 'windows': [...]}，统计包含 count/mean/min/max/p50/p95/p99
+        """
+        with self._lock:
+            starts = sorted(start for start in self._windows
+                            if since is None or start + self.window_seconds > since)
+            merged: Dict[str, Dict[str, QuantileSketch]] = {}
+            windows = []
+            for start in starts:
+                selected = self._select(self._windows[start], metric, config)
+                for name, series in selected.items():
+                    for metric_name, sketch in series.items():
+                        target = merged.setdefault(name, {}).get(metric_name)
+                        if target is None:
+                            target = merged[name][metric_name] = QuantileSketch(self.relative_accuracy)
+                        target.merge(sketch)
+                if per_window and selected:
+                    windows.append({'start': start, 'configs': self._summarize(selected)})
+
+        result = {
+            'window_seconds': self.window_seconds,
+            'from': starts[0] if starts else None,
+            'to': starts[-1] + self.window_seconds if starts else None,
+            'configs': self._summarize(merged)
+        }
+        if per_window:
+            result['windows'] = windows
+        return result
+
+    @staticmethod
+    def _select(window: Dict[str, Dict[str, QuantileSketch]], metric: Optional[str],
+                config: Optional[str]) -> Dict[str, Dict[str, QuantileSketch]]:
+        selected = {}
+        for name, series in window.items():
+            if config is not None and name != config:
+                continue
+            series = {m: s for m, s in series.items() if metric is None or m == metric}
+            if series:
+                selected[name] = series
+        return selected
+
+    @staticmethod
+    def _summarize(configs: Dict[str, Dict[str, QuantileSketch]]) -> Dict[str, Dict[str, Any]]:
+        return {name: {metric: sketch.summary() for metric, sketch in sorted(series.items())}
+                for name, series in configs.items()}
+
+    def snapshot(self, path: Optional[str] = None):
+        """将全部窗口写入磁盘（先写临时文件再替换，避免写了一半的快照）"""
+        path = path or self.snapshot_path
+        if not path:
+            return
+        with self._lock:
+            data = {
+                'window_seconds': self.window_seconds,
+                'configs': list(self._configs),
+                'windows': [
+                    {'start': start,
+                     'configs': {name: {metric: sketch.to_dict() for metric, sketch in series.items()}
+                                 for name, series in window.items()}}
+                    for start, window in sorted(self._windows.items())
+                ]
+            }
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def load(self, path: str):
+        """从快照恢复（窗口长度不一致时忽略快照）"""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('window_seconds') != self.window_seconds:
+            return
+        windows = {}
+        for window in data['windows']:
+            windows[window['start']] = {
+                name: {metric: QuantileSketch.from_dict(sketch, self.relative_accuracy)
+                       for metric, sketch in series.items()}
+                for name, series in window['configs'].items()
+            }
+        with self._lock:
+            self._windows = windows
+            self._configs = list(data.get('configs', []))[:self.max_configs]
+            self._expire()
+
+    def start_snapshots(self):
+        """启动后台定期快照线程"""
+        if not self.snapshot_path or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._snapshot_loop, name='evaluation-snapshots', daemon=True)
+        self._thread.start()
+
+    def _snapshot_loop(self):
+        while not self._stop.wait(self.snapshot_interval):
+            try:
+                self.snapshot()
+            except OSError as e:
+                print(f"保存评估聚合快照失败: {e}")
+
+    def stop(self):
+        """停止定期快照并写入最后一次快照"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        try:
+            self.snapshot()
+        except OSError as e:
+            print(f"保存评估聚合快照失败: {e}")
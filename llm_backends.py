@@ -0,0 +1,215 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Any, Callable, Optional, TypeVar
+
+T = TypeVar('T')
+
+class LLMBackendError(RuntimeError):
+    """LLM后端调用失败"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, base_url: Optional[str] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.base_url = base_url
+
+class NoBackendAvailableError(LLMBackendError):
+    """所有LLM后端均已熔断"""
+
+def _is_backend_failure(error: Exception) -> bool:
+    """是否计为后端故障：5xx、超时与连接错误计入，4xx（请求或模型配置错误）不计入"""
+    if isinstance(error, LLMBackendError) and error.status_code is not None:
+        return error.status_code >= 500
+    return True
+
+class _BackendState:
+    """单个后端的健康状态"""
+
+    def __init__(self, url: str, latency_window: int):
+        self.url = url
+        self.outstanding = 0
+        self.latencies = deque(maxlen=latency_window)
+        self.consecutive_failures = 0
+        self.total_requests = 0
+        self.total_failures = 0
+        self.open_until = 0.0
+        self.half_open_trial = False
+
+class BackendPool:
+    """
+    一组等价的LLM后端
+
+    - 路由：选择未完成请求数最少的健康后端
+    - 失败转移：调用失败时依次尝试其余后端（4xx 属于请求错误，直接抛出，不转移也不计入熔断）
+    - 对冲：等待超过近期延迟的p95后，向另一个后端发送重复请求，取先返回者
+    - 熔断：连续失败达到阈值后在冷却期内移出轮询，冷却结束后放行一次试探请求
+    """
+
+    def __init__(self, urls: List[str], hedge: bool = False, failure_threshold: int = 3,
+                 cooldown_seconds: float = 30.0, hedge_quantile: float = 0.95,
+                 default_hedge_delay: float = 2.0, min_hedge_delay: float = 0.2,
+                 latency_window: int = 200, max_workers: int = 32):
+        if not urls:
+            raise ValueError("至少需要一个LLM后端地址")
+        self.backends = [_BackendState(url.rstrip('/'), latency_window) for url in urls]
+        self.hedge = hedge and len(self.backends) > 1
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.hedge_quantile = hedge_quantile
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.hedged_requests = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if self.hedge else None
+
+    def call(self, fn: Callable[[str], T]) -> T:
+        """
+        在某个后端上执行 fn(base_url)，失败时转移到其他后端
+
+        Raises:
+            NoBackendAvailableError: 所有后端都已熔断
+            最后一个后端抛出的异常
+        """
+        if self.hedge:
+            return self._call_hedged(fn)
+
+        tried = []
+        last_error = None
+        while True:
+            backend = self._acquire(exclude=tried)
+            if backend is None:
+                break
+            tried.append(backend)
+            try:
+                return self._run(backend, fn)
+            except Exception as e:
+                if not _is_backend_failure(e):
+                    raise
+                last_error = e
+        raise last_error or NoBackendAvailableError("所有LLM后端暂时不可用（已熔断）")
+
+    def _call_hedged(self, fn: Callable[[str], T]) -> T:
+        """带对冲的调用"""
+        tried = []
+        pending = {}
+        last_error = None
+
+        def launch() -> bool:
+            backend = self._acquire(exclude=tried)
+            if backend is None:
+                return False
+            tried.append(backend)
+            pending[self._executor.submit(self._run, backend, fn)] = backend
+            return True
+
+        if not launch():
+            raise NoBackendAvailableError("所有LLM后端暂时不可用（已熔断）")
+
+        hedged = False
+        while pending:
+            timeout = None if hedged else self.hedge_delay()
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                if launch():
+                    with self._lock:
+                        self.hedged_requests += 1
+                continue
+            for future in done:
+                pending.pop(future)
+                try:
+                    # 先成功返回者胜出，落后的请求在后台完成并计入延迟统计
+                    return future.result()
+                except Exception as e:
+                    if not _is_backend_failure(e):
+                        raise
+                    last_error = e
+            if not pending:
+                launch()
+        raise last_error
+
+    def hedge_delay(self) -> float:
+        """对冲等待时间：近期成功请求延迟的分位数（样本不足时使用默认值）"""
+        with self._lock:
+            samples = sorted(latency for backend in self.backends for latency in backend.latencies)
+        if len(samples) < 20:
+            return self.default_hedge_delay
+        index = min(int(len(samples) * self.hedge_quantile), len(samples) - 1)
+        return max(samples[index], self.min_hedge_delay)
+
+    def _acquire(self, exclude: List[_BackendState]) -> Optional[_BackendState]:
+        """选择未完成请求数最少的可用后端并占用"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            for backend in self.backends:
+                if backend in exclude:
+                    continue
+                if backend.open_until > now:
+                    continue
+                if backend.consecutive_failures >= self.failure_threshold and backend.half_open_trial:
+                    # 半开状态下已有试探请求在进行
+                    continue
+                candidates.append(backend)
+            if not candidates:
+                return None
+            backend = min(candidates, key=lambda b: (b.outstanding, self._mean_latency(b)))
+            if backend.consecutive_failures >= self.failure_threshold:
+                backend.half_open_trial = True
+            backend.outstanding += 1
+            backend.total_requests += 1
+            return backend
+
+    def _run(self, backend: _BackendState, fn: Callable[[str], T]) -> T:
+        """在指定后端上执行并记录健康状态"""
+        start = time.monotonic()
+        try:
+            result = fn(backend.url)
+        except Exception as e:
+            with self._lock:
+                backend.outstanding -= 1
+                if not _is_backend_failure(e):
+                    # 后端正常响应了请求，只是请求本身有误
+                    backend.half_open_trial = False
+                    raise
+                backend.total_failures += 1
+                backend.consecutive_failures += 1
+                backend.half_open_trial = False
+                if backend.consecutive_failures >= self.failure_threshold:
+                    backend.open_until = time.monotonic() + self.cooldown_seconds
+            raise
+        with self._lock:
+            backend.outstanding -= 1
+            backend.consecutive_failures = 0
+            backend.half_open_trial = False
+            backend.open_until = 0.0
+            backend.latencies.append(time.monotonic() - start)
+        return result
+
+    def _mean_latency(self, backend: _BackendState) -> float:
+        if not backend.latencies:
+            return 0.0
+        return sum(backend.latencies) / len(backend.latencies)
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """获取各后端的健康状态"""
+        now = time.monotonic()
+        with self._lock:
+            stats = []
+            for backend in self.backends:
+                if backend.open_until > now:
+                    state = 'open'
+                elif backend.consecutive_failures >= self.failure_threshold:
+                    state = 'half_open'
+                else:
+                    state = 'closed'
+                stats.append({
+                    'url': backend.url,
+                    'state': state,
+                    'outstanding': backend.outstanding,
+                    'total_requests': backend.total_requests,
+                    'total_failures': backend.total_failures,
+                    'mean_latency_ms': self._mean_latency(backend) * 1000
+                })
+            return stats
@@ -0,0 +1,188 @@
+import bisect
+import threading
+from typing import List, Dict, Tuple, Callable, Sequence
+
+# 延迟直方图的默认分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    parts = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value))
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    """只增计数器"""
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in values.items()]
+
+class Gauge(_Metric):
+    """可增可减的瞬时值"""
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in values.items()]
+
+class Histogram(_Metric):
+    """固定分桶直方图"""
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [各分桶计数（最后一个为+Inf）, 总和, 次数]
+                series = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._series[key] = series
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            snapshot = {key: (list(series[0]), series[1], series[2]) for key, series in self._series.items()}
+        lines = []
+        bucket_labelnames = self.labelnames + ("le",)
+        for key, (counts, total, count) in snapshot.items():
+            cumulative = 0
+            for upper, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(bucket_labelnames, key + (_format_value(upper),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Registry:
+    """指标注册表，负责以Prometheus文本格式输出"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], List[Tuple[str, str, Dict[str, str], float]]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[Tuple[str, str, Dict[str, str], float]]]):
+        """
+        注册在抓取时计算的指标
+
+        collector 返回 (指标名, 说明, 标签, 数值) 列表，均以gauge输出
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+
+        families: Dict[str, Tuple[str, List[str]]] = {}
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception:
+                continue
+            for name, documentation, labels, value in samples:
+                if value is None:
+                    continue
+                family = families.setdefault(name, (documentation, []))
+                names = tuple(labels)
+                family[1].append(f"{name}{_format_labels(names, [labels[n] for n in names])} {_format_value(value)}")
+        for name, (documentation, samples) in families.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(samples)
+
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "rag_http_requests_total", "HTTP请求数", ["route", "method", "status"]))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "rag_http_request_duration_seconds", "HTTP请求耗时（秒）", ["route", "method"]))
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    "rag_stage_duration_seconds", "问答流水线各阶段耗时（秒）", ["stage"]))
+EMBED_BATCH_SIZE = REGISTRY.register(Histogram(
+    "rag_embedding_batch_size", "每次嵌入调用的文本数量", [],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "rag_llm_tokens_total", "LLM处理的token数", ["kind"]))
+LLM_TOKEN_RATE = REGISTRY.register(Histogram(
+    "rag_llm_tokens_per_second", "LLM后端报告的token速率", ["phase"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)))
+ANSWER_REQUESTS = REGISTRY.register(Counter(
+    "rag_answer_requests_total", "问答请求数（shared 表示合并到进行中的相同请求）", ["result"]))
+AUTO_EVAL_SAMPLES = REGISTRY.register(Counter(
+    "rag_auto_eval_samples_total", "在线抽样评估数（sampled/dropped/completed/failed）", ["result"]))
@@ -0,0 +1,143 @@
+"""
+文档块的MinHash签名
+
+对jieba分词后的词级shingle（每 SHINGLE_SIZE 个相邻词项）集合计算固定长度的MinHash签名，
+两个签名中取值相同的位置比例即为两个shingle集合Jaccard相似度的无偏估计。
+shingle保留了词序，词汇相同但含义不同的文本（表格、数字版本、调换顺序的条款）不会被估计为近似重复。
+签名在导入文档时对每个文档块计算一次并随索引保存，检索结果之间的相似度比较只需向量化的整数比较，无需重新分词。
+"""
+
+import zlib
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import jieba
+import numpy as np
+
+NUM_PERM = 64
+# 每个shingle包含的相邻词项数；改变后已保存索引中的签名在加载时重新计算
+SHINGLE_SIZE = 3
+
+# 哈希函数 (a * h + b) mod p 的参数：p 为梅森素数 2^61-1，a < 2^31、h < 2^32 保证乘积不超出uint64
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_rng = np.random.RandomState(0)
+_A = _rng.randint(1, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+# 空词项集合的签名：与任何签名（包括另一个空签名）都视为不相似
+EMPTY_SIGNATURE = np.full(NUM_PERM, 0xFFFFFFFF, dtype=np.uint32)
+
+def token_signature(tokens: Iterable[str]) -> np.ndarray:
+    """
+    词项集合的MinHash签名
+
+    词项以crc32哈希（跨进程稳定，签名可随索引持久化），返回长度为 NUM_PERM 的uint32数组
+    """
+    hashes = np.fromiter({zlib.crc32(token.encode('utf-8')) for token in tokens}, dtype=np.uint64)
+    if not len(hashes):
+        return EMPTY_SIGNATURE.copy()
+    permuted = (np.outer(hashes, _A) + _B) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=0).astype(np.uint32)
+
+def text_shingles(text: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    """文本的词级shingle集合：jieba分词（忽略空白）后每 size 个相邻词项组成一个shingle，词项不足 size 个时整段为一个"""
+    tokens = [token for token in jieba.lcut(text) if not token.isspace()]
+    if len(tokens) <= size:
+        return {'\x1f'.join(tokens)} if tokens else set()
+    return {'\x1f'.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+def text_signature(text: str) -> np.ndarray:
+    """文本的MinHash签名（对词级shingle集合计算）"""
+    return token_signature(text_shingles(text))
+
+def text_signatures(texts: List[str]) -> np.ndarray:
+    """多段文本的签名矩阵，形状为 (len(texts), NUM_PERM)"""
+    signatures = np.empty((len(texts), NUM_PERM), dtype=np.uint32)
+    for i, text in enumerate(texts):
+        signatures[i] = text_signature(text)
+    return signatures
+
+def pairwise_similarity(signatures: np.ndarray) -> np.ndarray:
+    """
+    签名两两之间的Jaccard相似度估计
+
+    Args:
+        signatures: 形状为 (n, NUM_PERM) 的签名矩阵
+
+    Returns:
+        (n, n) 相似度矩阵；空签名所在的行和列为0
+    """
+    signatures = np.asarray(signatures, dtype=np.uint32)
+    similarity = (signatures[:, None, :] == signatures[None, :, :]).mean(axis=2)
+    empty = (signatures == EMPTY_SIGNATURE).all(axis=1)
+    similarity[empty, :] = 0.0
+    similarity[:, empty] = 0.0
+    return similarity
+
+def pair_similarity(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """逐行比较两个签名矩阵，返回每对签名的Jaccard相似度估计（任一为空签名时为0）"""
+    left = np.asarray(left, dtype=np.uint32)
+    right = np.asarray(right, dtype=np.uint32)
+    similarity = (left == right).mean(axis=1)
+    similarity[(left == EMPTY_SIGNATURE).all(axis=1) | (right == EMPTY_SIGNATURE).all(axis=1)] = 0.0
+    return similarity
+
+def near_duplicate_pairs(signatures: np.ndarray, threshold: float) -> List[Tuple[int, int, float]]:
+    """估计相似度不低于 threshold 的签名对 (i, j, 相似度)，i < j"""
+    similarity = pairwise_similarity(signatures)
+    rows, cols = np.nonzero(np.triu(similarity >= threshold, k=1))
+    return [(int(i), int(j), float(similarity[i, j])) for i, j in zip(rows, cols)]
+
+class MinHashLSH:
+    """
+    MinHash签名的LSH分段索引
+
+    签名按 bands 段切分，任一段完全相同的签名互为候选；候选再以完整签名估计相似度，
+    不低于 threshold 的才视为近似重复。16段×4行时，相似度0.8的签名成为候选的概率超过99.9%。
+    """
+
+    def __init__(self, threshold: float, bands: int = 16):
+        if NUM_PERM % bands:
+            raise ValueError(f"bands 必须整除签名长度 {NUM_PERM}")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+        self._signatures: Dict[int, np.ndarray] = {}
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def insert(self, key: int, signature: np.ndarray):
+        """加入一个签名（空签名不参与近似重复检测）"""
+        signature = np.asarray(signature, dtype=np.uint32)
+        if (signature == EMPTY_SIGNATURE).all():
+            return
+        self._signatures[key] = signature
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            buckets.setdefault(band_key, []).append(key)
+
+    def query(self, signature: np.ndarray) -> Optional[Tuple[int, float]]:
+        """
+        查找与签名近似重复的已加入签名
+
+        Returns:
+            (最相似的键, 相似度估计)，没有达到阈值的候选时为None
+        """
+        signature = np.asarray(signature, dtype=np.uint32)
+        if (signature == EMPTY_SIGNATURE).all():
+            return None
+        candidates = set()
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(buckets.get(band_key, ()))
+        if not candidates:
+            return None
+        keys = sorted(candidates)
+        similarity = (np.array([self._signatures[key] for key in keys]) == signature).mean(axis=1)
+        best = int(np.argmax(similarity))
+        if similarity[best] < self.threshold:
+            return None
+        return keys[best], float(similarity[best])
+
+    def __len__(self) -> int:
+        return len(self._signatures)
@@ -0,0 +1,88 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from typing import List, Dict, Any, Callable, Optional, Tuple
+
+_PROFILE_NAME_PATTERN = re.compile(r'^[\w.-]+\.pstats$')
+
+class ProfileStore:
+    """
+    按需性能剖析：在cProfile下执行单个调用，并将结果保存为pstats文件
+
+    文件保存在有界的目录环形缓冲区中，超过上限时删除最旧的文件。
+    同一时刻只允许一个剖析（cProfile不支持多个同时启用），忙碌时调用按未剖析方式执行。
+    """
+
+    def __init__(self, directory: str = "profiles", max_profiles: int = 20):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def profile_call(self, label: str, fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, Optional[str]]:
+        """
+        在剖析器下执行调用
+
+        Returns:
+            (调用结果, 剖析文件名；剖析器忙碌时为None)
+        """
+        if not self._lock.acquire(blocking=False):
+            return fn(*args, **kwargs), None
+        try:
+            profiler = cProfile.Profile()
+            result = profiler.runcall(fn, *args, **kwargs)
+            name = self._save(profiler, label)
+            return result, name
+        finally:
+            self._lock.release()
+
+    def _save(self, profiler: cProfile.Profile, label: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        safe_label = re.sub(r'[^\w-]', '_', label)[:40]
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_label}-{uuid.uuid4().hex[:8]}.pstats"
+        profiler.dump_stats(os.path.join(self.directory, name))
+        self._trim()
+        return name
+
+    def _trim(self):
+        """删除超出上限的最旧剖析文件"""
+        profiles = self.list_profiles()
+        for profile in profiles[self.max_profiles:]:
+            try:
+                os.remove(os.path.join(self.directory, profile['name']))
+            except OSError:
+                pass
+
+    def list_profiles(self) -> List[Dict[str, Any]]:
+        """列出已保存的剖析文件（最新的在前）"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in os.listdir(self.directory):
+            if not _PROFILE_NAME_PATTERN.match(name):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            profiles.append({'name': name, 'size': stat.st_size, 'created': stat.st_mtime})
+        profiles.sort(key=lambda profile: profile['created'], reverse=True)
+        return profiles
+
+    def path_for(self, name: str) -> Optional[str]:
+        """返回剖析文件路径；名称非法或文件不存在时返回None"""
+        if not _PROFILE_NAME_PATTERN.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+    def summary(self, name: str, limit: int = 50) -> Optional[str]:
+        """按累计耗时排序的文本摘要"""
+        path = self.path_for(name)
+        if path is None:
+            return None
+        output = io.StringIO()
+        stats = pstats.Stats(path, stream=output)
+        stats.sort_stats('cumulative').print_stats(limit)
+        return output.getvalue()
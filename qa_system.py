@@ -1,7 +1,16 @@
 import requests
+import json
 from config import Config
 from rag_system import RAGSystem
-from typing import List, Dict, Any
+from context_builder import ContextBuilder, estimate_tokens
+from llm_backends import BackendPool, LLMBackendError
+from admission import AdmissionController, AdmissionRejected
+from retrieval_policy import RetrievalGate, AdaptiveTopK
+from telemetry import StageTimer, LatencyStats
+from metrics import STAGE_LATENCY, LLM_TOKENS, LLM_TOKEN_RATE, ANSWER_REQUESTS
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import threading
 import time
 
 class OllamaLLM:
@@ -28,152 +37,313 @@ class OllamaLLM:
         except Exception as e:
             raise RuntimeError(f"Ollama LLM API 调用失败: {e}")
 
+class SingleFlight:
+    """合并相同键的并发调用：同一时刻只执行一次，其余调用方等待并共享结果"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Any, Future] = {}
+
+    def do(self, key: Any, fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, bool]:
+        """
+        执行调用或加入进行中的相同调用
+        
+        Returns:
+            (结果, 是否为共享结果)
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._calls[key] = future
+        
+        if not is_leader:
+            return future.result(), True
+        
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def in_flight(self) -> int:
+        """当前进行中的调用数量"""
+        with self._lock:
+            return len(self._calls)
+
 class QASystem:
-    def __init__(self, rag_system: RAGSystem, llm_config=None):
+    def __init__(self, rag_system: RAGSystem, llm_config=None, admission: AdmissionController = None):
         self.rag_system = rag_system
         self.llm_config = llm_config or {}
+        self.admission = admission or AdmissionController(
+            max_concurrent=Config.LLM_MAX_CONCURRENCY,
+            max_queue=Config.LLM_MAX_QUEUE,
+            queue_timeout=Config.LLM_QUEUE_TIMEOUT
+        )
+        self.top_k = self.llm_config.get('top_k', Config.RETRIEVAL_TOP_K)
+        self.adaptive_top_k = None
+        if self.llm_config.get('adaptive_top_k', Config.ADAPTIVE_TOP_K):
+            self.adaptive_top_k = AdaptiveTopK(
+                min_k=Config.ADAPTIVE_TOP_K_MIN,
+                max_k=Config.ADAPTIVE_TOP_K_MAX,
+                relative_threshold=Config.ADAPTIVE_TOP_K_RELATIVE_THRESHOLD,
+                max_relative_gap=Config.ADAPTIVE_TOP_K_MAX_RELATIVE_GAP
+            )
+        self.context_builder = ContextBuilder(
+            token_budget=self.llm_config.get('context_token_budget', Config.CONTEXT_TOKEN_BUDGET)
+        )
+        self._singleflight = SingleFlight()
+        self.latency_stats = LatencyStats()
+        self.retrieval_gate = RetrievalGate(
+            min_score=self.llm_config.get('gate_min_score', Config.RETRIEVAL_GATE_MIN_SCORE),
+            confident_score=self.llm_config.get('gate_confident_score', Config.RETRIEVAL_GATE_CONFIDENT_SCORE),
+            min_relative_gap=self.llm_config.get('gate_min_relative_gap', Config.RETRIEVAL_GATE_MIN_RELATIVE_GAP)
+        )
+        self.gate_mode = self.llm_config.get('gate_mode', Config.RETRIEVAL_GATE_MODE)
+        self.backend_pool = BackendPool(
+            self._backend_urls(),
+            hedge=self.llm_config.get('hedge', Config.LLM_HEDGING),
+            failure_threshold=Config.LLM_FAILURE_THRESHOLD,
+            cooldown_seconds=Config.LLM_CIRCUIT_COOLDOWN
+        )
 
-    def _call_ollama_llm(self, prompt: str) -> str:
+    def _backend_urls(self) -> List[str]:
+        """LLM后端地址列表（支持 base_urls/api_urls 配置多个等价后端）"""
+        provider = self.llm_config.get('provider', 'ollama')
+        if provider == 'custom':
+            urls = self.llm_config.get('api_urls') or [self.llm_config.get('api_url', '')]
+        elif provider == 'openai':
+            urls = self.llm_config.get('base_urls') or [self.llm_config.get('base_url', 'https://api.openai.com/v1')]
+        else:
+            urls = self.llm_config.get('base_urls') or [self.llm_config.get('base_url', 'http://localhost:11434')]
+        return urls
+    
+    def _call_ollama_llm(self, prompt: str) -> Dict[str, Any]:
         """调用Ollama LLM API"""
         try:
-            # 检查是否有可用的LLM模型
-            response = requests.get("http://localhost:11434/api/tags", timeout=10)
-            if response.status_code == 200:
-                models = response.json().get('models', [])
-                llm_models = [m for m in models if 'embed' not in m['name'].lower()]
-                
-                if not llm_models:
-                    return "抱歉，当前Ollama服务中没有可用的LLM模型。请先下载一个LLM模型，例如：\n" + \
-                           "1. ollama pull llama3\n" + \
-                           "2. ollama pull qwen2.5:7b\n" + \
-                           "3. ollama pull gemma2:2b\n" + \
-                           "或者配置使用OpenAI API等其他LLM服务。"
-            
-            # 尝试使用配置的模型
-            model_name = self.llm_config.get('model', 'llama3')
-            
-            payload = {
-                "model": model_name,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                    "max_tokens": 1000
-                }
-            }
-            
-            response = requests.post(
-                f"{self.llm_config.get('base_url', 'http://localhost:11434')}/api/generate",
-                json=payload,
-                timeout=120  # 增加超时时间到120秒
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result.get('response', '')
-            else:
-                error_msg = f"Ollama LLM API 调用失败: {response.status_code} {response.reason}"
-                try:
-                    error_detail = response.json().get('error', '')
-                    if error_detail:
-                        error_msg += f" - {error_detail}"
-                except:
-                    pass
-                return f"生成答案时出错: {error_msg}"
-                
+            return self.backend_pool.call(lambda base_url: self._ollama_generate(base_url, prompt))
         except requests.exceptions.Timeout:
-            return "生成答案时出错: LLM API 请求超时（120秒），模型可能正在加载中，请稍后再试"
+            return self._failed_generation("LLM API 请求超时（120秒），模型可能正在加载中，请稍后再试")
         except requests.exceptions.ConnectionError:
-            return "生成答案时出错: 无法连接到Ollama服务，请确保Ollama正在运行"
+            return self._failed_generation("无法连接到Ollama服务，请确保Ollama正在运行")
+        except LLMBackendError as e:
+            if e.status_code == 404 and not self._ollama_has_llm_models(e.base_url):
+                return {"text": "抱歉，当前Ollama服务中没有可用的LLM模型。请先下载一个LLM模型，例如：\n" + \
+                                "1. ollama pull llama3\n" + \
+                                "2. ollama pull qwen2.5:7b\n" + \
+                                "3. ollama pull gemma2:2b\n" + \
+                                "或者配置使用OpenAI API等其他LLM服务。",
+                        "error": "Ollama服务中没有可用的LLM模型"}
+            return self._failed_generation(str(e))
         except Exception as e:
-            return f"生成答案时出错: {str(e)}"
+            return self._failed_generation(str(e))
     
-    def _call_openai_llm(self, prompt: str) -> str:
-        """调用OpenAI兼容的LLM API"""
+    @staticmethod
+    def _failed_generation(error: str) -> Dict[str, Any]:
+        """生成失败时的结果：答案文本为错误提示，error 标记失败原因"""
+        return {"text": f"生成答案时出错: {error}", "error": error}
+    
+    def _ollama_has_llm_models(self, base_url: str) -> bool:
+        """检查Ollama服务中是否有可用的LLM模型"""
         try:
-            headers = {
-                "Authorization": f"Bearer {self.llm_config.get('api_key', '')}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "model": self.llm_config.get('model', 'gpt-3.5-turbo'),
-                "messages": [
-                    {"role": "system", "content": "你是一个有用的AI助手，请基于提供的上下文信息回答问题。"},
-                    {"role": "user", "content": prompt}
-                ],
+            response = requests.get(f"{base_url}/api/tags", timeout=10)
+            if response.status_code == 200:
+                models = response.json().get('models', [])
+                return any('embed' not in m['name'].lower() for m in models)
+        except Exception:
+            pass
+        return True
+    
+    def _ollama_generate(self, base_url: str, prompt: str) -> Dict[str, Any]:
+        """在指定Ollama后端上生成，失败时抛出异常"""
+        # 尝试使用配置的模型
+        model_name = self.llm_config.get('model', 'llama3')
+        stream = self.llm_config.get('stream', Config.LLM_STREAM)
+        
+        payload = {
+            "model": model_name,
+            "prompt": prompt,
+            "stream": stream,
+            "options": {
                 "temperature": 0.7,
+                "top_p": 0.9,
                 "max_tokens": 1000
             }
-            
-            response = requests.post(
-                f"{self.llm_config.get('base_url', 'https://api.openai.com/v1')}/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=60
+        }
+        
+        start = time.perf_counter()
+        response = requests.post(
+            f"{base_url}/api/generate",
+            json=payload,
+            timeout=120,  # 增加超时时间到120秒
+            stream=stream
+        )
+        
+        if response.status_code != 200:
+            error_msg = f"Ollama LLM API 调用失败: {response.status_code} {response.reason}"
+            try:
+                error_detail = response.json().get('error', '')
+                if error_detail:
+                    error_msg += f" - {error_detail}"
+            except:
+                pass
+            raise LLMBackendError(error_msg, status_code=response.status_code, base_url=base_url)
+        
+        if not stream:
+            result = response.json()
+            return {"text": result.get('response', ''), "usage": self._ollama_usage(result)}
+        
+        # 流式读取，记录首个token的时间；最后一个事件带有计数
+        parts = []
+        ttft_ms = None
+        usage = None
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get('error'):
+                raise LLMBackendError(f"Ollama LLM API 调用失败: {chunk['error']}", base_url=base_url)
+            if chunk.get('response'):
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - start) * 1000
+                parts.append(chunk['response'])
+            if chunk.get('done'):
+                usage = self._ollama_usage(chunk)
+                break
+        return {"text": "".join(parts), "ttft_ms": ttft_ms, "usage": usage}
+    
+    @staticmethod
+    def _ollama_usage(result: Dict[str, Any]) -> Dict[str, Any]:
+        """提取Ollama返回的token计数和耗时（纳秒转换为毫秒）"""
+        def to_ms(key):
+            value = result.get(key)
+            return value / 1e6 if value is not None else None
+        
+        return {
+            "provider": "ollama",
+            "prompt_tokens": result.get('prompt_eval_count'),
+            "completion_tokens": result.get('eval_count'),
+            "prompt_eval_ms": to_ms('prompt_eval_duration'),
+            "eval_ms": to_ms('eval_duration'),
+            "load_ms": to_ms('load_duration'),
+            "backend_total_ms": to_ms('total_duration')
+        }
+    
+    @staticmethod
+    def _openai_usage(usage: Dict[str, Any]) -> Dict[str, Any]:
+        """提取OpenAI兼容接口返回的token计数（不提供服务端耗时）"""
+        return {
+            "provider": "openai",
+            "prompt_tokens": usage.get('prompt_tokens'),
+            "completion_tokens": usage.get('completion_tokens'),
+            "prompt_eval_ms": None,
+            "eval_ms": None,
+            "load_ms": None,
+            "backend_total_ms": None
+        }
+    
+    def _call_openai_llm(self, prompt: str) -> Dict[str, Any]:
+        """调用OpenAI兼容的LLM API"""
+        try:
+            return self.backend_pool.call(
+                lambda base_url: self._chat_completion(f"{base_url}/chat/completions", prompt, "OpenAI API")
             )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result['choices'][0]['message']['content']
-            else:
-                error_msg = f"OpenAI API 调用失败: {response.status_code} {response.reason}"
-                try:
-                    error_detail = response.json().get('error', {}).get('message', '')
-                    if error_detail:
-                        error_msg += f" - {error_detail}"
-                except:
-                    pass
-                return f"生成答案时出错: {error_msg}"
-                
         except Exception as e:
-            return f"生成答案时出错: {str(e)}"
+            return self._failed_generation(str(e))
     
-    def _call_custom_llm(self, prompt: str) -> str:
+    def _call_custom_llm(self, prompt: str) -> Dict[str, Any]:
         """调用自定义LLM API"""
         try:
-            headers = {
-                "Authorization": f"Bearer {self.llm_config.get('api_key', '')}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "model": self.llm_config.get('model', ''),
-                "messages": [
-                    {"role": "system", "content": "你是一个有用的AI助手，请基于提供的上下文信息回答问题。"},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.7,
-                "max_tokens": 1000
-            }
-            
-            response = requests.post(
-                self.llm_config.get('api_url', ''),
-                headers=headers,
-                json=payload,
-                timeout=60
+            return self.backend_pool.call(
+                lambda api_url: self._chat_completion(api_url, prompt, "自定义API")
             )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result['choices'][0]['message']['content']
-            else:
-                error_msg = f"自定义API 调用失败: {response.status_code} {response.reason}"
-                try:
-                    error_detail = response.json().get('error', {}).get('message', '')
-                    if error_detail:
-                        error_msg += f" - {error_detail}"
-                except:
-                    pass
-                return f"生成答案时出错: {error_msg}"
-                
         except Exception as e:
-            return f"生成答案时出错: {str(e)}"
+            return self._failed_generation(str(e))
     
-    def _generate_answer(self, query: str, context: str) -> str:
-        """生成答案"""
+    def _chat_completion(self, url: str, prompt: str, api_name: str) -> Dict[str, Any]:
+        """调用OpenAI兼容的chat/completions接口，失败时抛出异常"""
+        default_model = 'gpt-3.5-turbo' if self.llm_config.get('provider') == 'openai' else ''
+        stream = self.llm_config.get('stream', Config.LLM_STREAM)
+        headers = {
+            "Authorization": f"Bearer {self.llm_config.get('api_key', '')}",
+            "Content-Type": "application/json"
+        }
+        
+        payload = {
+            "model": self.llm_config.get('model', default_model),
+            "messages": [
+                {"role": "system", "content": "你是一个有用的AI助手，请基于提供的上下文信息回答问题。"},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.7,
+            "max_tokens": 1000,
+            "stream": stream
+        }
+        if stream and self.llm_config.get('provider') == 'openai':
+            # 流式响应默认不含用量，需要显式请求
+            payload["stream_options"] = {"include_usage": True}
+        
+        start = time.perf_counter()
+        response = requests.post(
+            url,
+            headers=headers,
+            json=payload,
+            timeout=60,
+            stream=stream
+        )
+        
+        if response.status_code != 200:
+            error_msg = f"{api_name} 调用失败: {response.status_code} {response.reason}"
+            try:
+                error_detail = response.json().get('error', {}).get('message', '')
+                if error_detail:
+                    error_msg += f" - {error_detail}"
+            except:
+                pass
+            raise LLMBackendError(error_msg, status_code=response.status_code, base_url=url)
+        
+        if not stream:
+            result = response.json()
+            usage = self._openai_usage(result['usage']) if result.get('usage') else None
+            return {"text": result['choices'][0]['message']['content'], "usage": usage}
+        
+        # 流式读取SSE事件，记录首个token的时间
+        parts = []
+        ttft_ms = None
+        usage = None
+        for line in response.iter_lines():
+            if not line or not line.startswith(b"data:"):
+                continue
+            data = line[len(b"data:"):].strip()
+            if data == b"[DONE]":
+                break
+            chunk = json.loads(data)
+            if chunk.get('usage'):
+                usage = self._openai_usage(chunk['usage'])
+            choices = chunk.get('choices') or [{}]
+            content = choices[0].get('delta', {}).get('content')
+            if content:
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - start) * 1000
+                parts.append(content)
+        return {"text": "".join(parts), "ttft_ms": ttft_ms, "usage": usage}
+    
+    def _generate_answer(self, query: str, context: str, priority: str = 'interactive',
+                         timer: StageTimer = None) -> Tuple[str, Dict[str, Any], Optional[str]]:
+        """
+        生成答案（受准入控制，队列已满或排队超时时抛出 AdmissionRejected）
+        
+        Returns:
+            (答案文本, 后端返回的token计数和耗时；不可用时为None, 生成失败的原因；成功时为None)
+        """
         provider = self.llm_config.get('provider', 'ollama')
+        timer = timer or StageTimer()
         
         # 构建提示词
         prompt = f"""基于以下上下文信息回答问题。如果上下文中没有相关信息，请说明无法从提供的信息中找到答案。
@@ -187,49 +357,206 @@ class QASystem:
 
         # 根据提供商调用相应的API
         if provider == 'ollama':
-            return self._call_ollama_llm(prompt)
+            call_llm = self._call_ollama_llm
         elif provider == 'openai':
-            return self._call_openai_llm(prompt)
+            call_llm = self._call_openai_llm
         elif provider == 'custom':
-            return self._call_custom_llm(prompt)
+            call_llm = self._call_custom_llm
         else:
-            return "生成答案时出错: 不支持的LLM提供商"
+            result = self._failed_generation("不支持的LLM提供商")
+            return result['text'], None, result['error']
+        
+        queue_start = time.perf_counter()
+        with self.admission.admit(priority):
+            timer.record('queue', (time.perf_counter() - queue_start) * 1000)
+            with timer.stage('llm'):
+                result = call_llm(prompt)
+        timer.record('ttft', result.get('ttft_ms'))
+        self._record_usage_metrics(result.get('usage'))
+        return result['text'], result.get('usage'), result.get('error')
+    
+    def _record_usage_metrics(self, usage: Dict[str, Any]):
+        """记录后端报告的token数和速率"""
+        if not usage:
+            return
+        for kind, count_key, duration_key in (('prompt', 'prompt_tokens', 'prompt_eval_ms'),
+                                              ('completion', 'completion_tokens', 'eval_ms')):
+            count = usage.get(count_key)
+            if not count:
+                continue
+            LLM_TOKENS.inc(count, kind=kind)
+            duration_ms = usage.get(duration_key)
+            if duration_ms:
+                LLM_TOKEN_RATE.observe(count / (duration_ms / 1000), phase=kind)
+    
+    def _fetch_k(self) -> int:
+        """从向量索引中取回的结果数量（自适应top-k时多取）"""
+        return self.adaptive_top_k.max_k if self.adaptive_top_k else self.top_k
+    
+    def _cache_key(self, query: str) -> Tuple:
+        """答案缓存/请求合并的键：规范化后的问题 + 影响答案的配置"""
+        normalized_query = " ".join(query.split())
+        return (
+            normalized_query,
+            self.llm_config.get('provider', 'ollama'),
+            self.llm_config.get('model', ''),
+            tuple(self._backend_urls()),
+            self._fetch_k(),
+            self.context_builder.token_budget
+        )
+    
+    def get_answer_with_sources(self, query: str, priority: str = 'interactive') -> Dict[str, Any]:
+        """
+        获取答案和来源（相同问题的并发请求只执行一次检索和生成）
+        
+        Raises:
+            AdmissionRejected: 生成队列已满或排队超时
+        """
+        result, shared = self._singleflight.do(self._cache_key(query), self._answer_query, query, priority)
+        ANSWER_REQUESTS.inc(result='shared' if shared else 'leader')
+        if shared:
+            # 共享结果时返回副本，避免调用方之间互相修改
+            result = dict(result)
+            result["query"] = query
+            result["coalesced"] = True
+        return result
     
-    def get_answer_with_sources(self, query: str) -> Dict[str, Any]:
-        """获取答案和来源"""
+    def _answer_query(self, query: str, priority: str = 'interactive') -> Dict[str, Any]:
+        """执行检索和生成"""
         start_time = time.time()
+        timer = StageTimer()
         
         try:
             # 检查RAG系统是否已初始化
             if not self.rag_system.is_initialized:
-                return {
-                    "query": query,
-                    "answer": "RAG系统尚未初始化，请先添加文档并构建索引",
-                    "sources": [],
-                    "confidence": 0.0,
-                    "response_time": 0
-                }
+                return self._not_initialized_response(query, timer)
             
             # 检索相关文档
-            results = self.rag_system.search(query, top_k=5)
+            with timer.stage('embed'):
+                query_vector = self.rag_system.embed_query(query)
+            with timer.stage('search'):
+                results = self.rag_system.search_by_vector(query_vector, top_k=self._fetch_k())
             
+            return self._answer_from_results(query, results, start_time, priority, timer)
+            
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            return self._error_response(query, e, start_time, timer)
+    
+    def answer_batch(self, queries: List[str], max_workers: int = 4, priority: str = 'batch',
+                     retrieval_depth: int = 0) -> Iterator[Dict[str, Any]]:
+        """
+        批量问答：一次性计算所有查询嵌入并执行向量化检索，再由有界线程池并发生成答案
+        
+        Args:
+            queries: 问题列表
+            max_workers: 并发生成答案的最大线程数
+            priority: 生成准入的优先级类别
+            retrieval_depth: 大于0时检索至该深度，并在结果的 "retrieved_chunk_ids" 中返回原始排序的文档块编号
+                （未经检索门控和自适应截断，用于评估检索指标）；生成答案仍只使用前 top_k 个结果
+            
+        Yields:
+            每个问题完成时的结果，"index" 为该问题在输入中的位置
+        """
+        start_time = time.time()
+        
+        if not self.rag_system.is_initialized:
+            for i, query in enumerate(queries):
+                yield dict(self._not_initialized_response(query), index=i)
+            return
+        
+        # 嵌入和检索为整批共享，各问题记录相同的阶段耗时
+        timers = [StageTimer() for _ in queries]
+        batch_timer = StageTimer()
+        try:
+            with batch_timer.stage('embed'):
+                query_vectors = self.rag_system.embed_queries(queries)
+            fetch_k = self._fetch_k()
+            with batch_timer.stage('search'):
+                all_results = self.rag_system.search_vectors(query_vectors, top_k=max(fetch_k, retrieval_depth))
+            for timer in timers:
+                timer.timings.update(batch_timer.timings)
+        except Exception as e:
+            for i, (query, timer) in enumerate(zip(queries, timers)):
+                timer.timings.update(batch_timer.timings)
+                yield dict(self._error_response(query, e, start_time, timer), index=i)
+            return
+        
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        stop = threading.Event()
+        try:
+            futures = {
+                executor.submit(self._answer_with_retry, query, results[:fetch_k], start_time, priority, timer, stop): i
+                for i, (query, results, timer) in enumerate(zip(queries, all_results, timers))
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = self._error_response(queries[i], e, start_time, timers[i])
+                result["index"] = i
+                if retrieval_depth:
+                    result["retrieved_chunk_ids"] = [
+                        item.get('metadata', {}).get('chunk_id') for item in all_results[i][:retrieval_depth]
+                    ]
+                yield result
+        finally:
+            # 调用方提前停止迭代时取消尚未开始的生成，正在退避等待的问题不再重试
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _answer_with_retry(self, query: str, results: List[Dict[str, Any]], start_time: float, priority: str,
+                           timer: StageTimer, stop: threading.Event) -> Dict[str, Any]:
+        """
+        批量问答中生成单个问题的答案：未被准入时按 retry_after 退避重试，而不是让该问题失败
+        
+        批量和评估请求的优先级较低，队列满或排队超时是正常负载下的预期情况；
+        累计等待超过 Config.BATCH_ADMISSION_MAX_WAIT 秒时才抛出 AdmissionRejected
+        """
+        deadline = time.monotonic() + Config.BATCH_ADMISSION_MAX_WAIT
+        while True:
+            try:
+                return self._answer_from_results(query, results, start_time, priority, timer)
+            except AdmissionRejected as e:
+                delay = min(e.retry_after, deadline - time.monotonic())
+                if delay <= 0 or stop.is_set():
+                    raise
+                wait_start = time.perf_counter()
+                if stop.wait(delay):
+                    raise
+                timer.record('queue', (time.perf_counter() - wait_start) * 1000)
+    
+    def _answer_from_results(self, query: str, results: List[Dict[str, Any]], start_time: float,
+                             priority: str = 'interactive', timer: StageTimer = None) -> Dict[str, Any]:
+        """基于检索结果生成答案"""
+        timer = timer or StageTimer()
+        try:
             if not results:
                 return {
                     "query": query,
                     "answer": "抱歉，没有找到与您问题相关的文档信息。",
                     "sources": [],
                     "confidence": 0.0,
-                    "response_time": 0
+                    "response_time": 0,
+                    "timings": self._finish_timings(timer)
                 }
             
-            # 构建上下文
-            context = "\n\n".join([f"文档片段 {i+1}: {result['content']}" for i, result in enumerate(results)])
+            pack_start = time.perf_counter()
             
-            # 生成答案
-            answer = self._generate_answer(query, context)
+            # 检索证据是否充足（基于完整的检索分数分布）
+            gate = self.retrieval_gate.evaluate(results)
             
-            # 计算响应时间
-            response_time = (time.time() - start_time) * 1000
+            # 自适应截断检索结果
+            fetched_results = results
+            if self.adaptive_top_k:
+                results = self.adaptive_top_k.select(results)
+            retrieval_stats = {
+                "fetched_k": len(fetched_results),
+                "chosen_k": len(results),
+                "pruned_tokens": sum(estimate_tokens(result['content']) for result in fetched_results[len(results):])
+            }
             
             # 计算置信度（基于检索结果的相似度分数）
             confidence = sum(result['score'] for result in results) / len(results) if results else 0.0
@@ -241,22 +568,95 @@ class QASystem:
                     "rank": i + 1,
                     "content": result['content'],
                     "score": result['score'],
-                    "metadata": result.get('metadata', {})
+                    "metadata": result.get('metadata', {}),
+                    "minhash": result.get('minhash')
                 })
+            self.rag_system.flag_near_duplicates(sources)
+            
+            # 检索证据不足时跳过生成
+            if not gate['passed']:
+                timer.record('pack', (time.perf_counter() - pack_start) * 1000)
+                response = self._gated_response(query, sources, confidence, gate, start_time)
+                response["timings"] = self._finish_timings(timer)
+                return response
+            
+            # 构建上下文（合并重叠块并限制token预算）
+            context, context_stats = self.context_builder.build(results)
+            timer.record('pack', (time.perf_counter() - pack_start) * 1000)
             
-            return {
+            # 生成答案
+            answer, llm_usage, error = self._generate_answer(query, context, priority, timer)
+            
+            # 计算响应时间
+            response_time = (time.time() - start_time) * 1000
+            
+            response = {
                 "query": query,
                 "answer": answer,
                 "sources": sources,
                 "confidence": confidence,
-                "response_time": response_time
+                "response_time": response_time,
+                "context_stats": context_stats,
+                "retrieval_stats": retrieval_stats,
+                "timings": self._finish_timings(timer),
+                "llm_usage": llm_usage
             }
+            if error:
+                response["error"] = error
+            return response
             
+        except AdmissionRejected:
+            raise
         except Exception as e:
-            return {
-                "query": query,
-                "answer": f"处理问题时出错: {str(e)}",
-                "sources": [],
-                "confidence": 0.0,
-                "response_time": (time.time() - start_time) * 1000
-            } 
\ No newline at end of file
+            return self._error_response(query, e, start_time, timer)
+    
+    def _finish_timings(self, timer: StageTimer) -> Dict[str, Any]:
+        """结束计时并计入延迟统计"""
+        timings = timer.as_dict()
+        self.latency_stats.observe(timings)
+        for name, value in timings.items():
+            if value is not None:
+                STAGE_LATENCY.observe(value / 1000, stage=name[:-len('_ms')])
+        return timings
+    
+    def _gated_response(self, query: str, sources: List[Dict[str, Any]], confidence: float,
+                        gate: Dict[str, Any], start_time: float) -> Dict[str, Any]:
+        """检索证据不足、未调用LLM时的响应"""
+        if self.gate_mode == 'retrieval_only':
+            answer = "检索到的文档与问题的相关性较低，未生成答案，请参考以下检索结果。"
+        else:
+            answer = "无法从提供的信息中找到答案。"
+            sources = []
+        return {
+            "query": query,
+            "answer": answer,
+            "sources": sources,
+            "confidence": confidence,
+            "response_time": (time.time() - start_time) * 1000,
+            "gate": gate
+        }
+    
+    def _not_initialized_response(self, query: str, timer: StageTimer = None) -> Dict[str, Any]:
+        """RAG系统未初始化时的响应"""
+        return {
+            "query": query,
+            "answer": "RAG系统尚未初始化，请先添加文档并构建索引",
+            "sources": [],
+            "confidence": 0.0,
+            "response_time": 0,
+            "timings": self._finish_timings(timer or StageTimer()),
+            "error": "RAG系统尚未初始化"
+        }
+    
+    def _error_response(self, query: str, error: Exception, start_time: float,
+                        timer: StageTimer = None) -> Dict[str, Any]:
+        """处理出错时的响应"""
+        return {
+            "query": query,
+            "answer": f"处理问题时出错: {str(error)}",
+            "sources": [],
+            "confidence": 0.0,
+            "response_time": (time.time() - start_time) * 1000,
+            "timings": self._finish_timings(timer or StageTimer()),
+            "error": str(error)
+        }
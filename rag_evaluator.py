@@ -1,9 +1,89 @@
 import time
 import numpy as np
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, FrozenSet, Sequence
 import re
 import jieba
 
+from config import Config
+from minhash import pairwise_similarity, text_shingles
+
+# 各指标组的主分数字段：{汇总名称: (指标组, 字段)}
+PRIMARY_SCORES = {
+    'overall_score': ('overall_score', 'overall_score'),
+    'answer_relevance': ('answer_relevance', 'overall_relevance'),
+    'answer_faithfulness': ('answer_faithfulness', 'faithfulness_score'),
+    'context_precision': ('context_precision', 'precision_score'),
+    'context_recall': ('context_recall', 'recall_score'),
+    'answer_completeness': ('answer_completeness', 'completeness_score'),
+    'answer_consistency': ('answer_consistency', 'consistency_score'),
+    'source_diversity': ('source_diversity', 'diversity_score')
+}
+
+# 综合评分中各指标的权重；只评估部分指标时按所选指标的权重之和重新归一化
+OVERALL_WEIGHTS = {
+    'answer_relevance': 0.25,
+    'answer_faithfulness': 0.20,
+    'context_precision': 0.15,
+    'context_recall': 0.15,
+    'answer_completeness': 0.10,
+    'answer_consistency': 0.10,
+    'source_diversity': 0.05
+}
+
+# evaluate_rag_response 可选择的指标组（按计算顺序）
+METRIC_NAMES = (
+    'answer_relevance',
+    'answer_faithfulness',
+    'context_precision',
+    'context_recall',
+    'answer_completeness',
+    'answer_consistency',
+    'source_diversity',
+    'performance_metrics'
+)
+
+def primary_scores(evaluation_results: Dict[str, Any]) -> Dict[str, float]:
+    """从评估结果中提取各指标组的主分数"""
+    scores = {}
+    for name, (metric, field) in PRIMARY_SCORES.items():
+        value = evaluation_results.get(metric, {}).get(field)
+        if value is not None:
+            scores[name] = float(value)
+    return scores
+
+class TokenCache:
+    """
+    单次评估内的分词缓存
+
+    每段文本只调用一次jieba分词，各指标共享同一个关键词集合；
+    来源文档的关键词并集也只计算一次。
+    """
+    
+    def __init__(self):
+        self._keywords: Dict[str, FrozenSet[str]] = {}
+        self._unions: Dict[tuple, FrozenSet[str]] = {}
+    
+    def keywords(self, text: str) -> FrozenSet[str]:
+        """文本的关键词集合"""
+        keywords = self._keywords.get(text)
+        if keywords is None:
+            keywords = frozenset(jieba.lcut(text))
+            self._keywords[text] = keywords
+        return keywords
+    
+    def union(self, texts: Iterable[str]) -> FrozenSet[str]:
+        """多段文本关键词集合的并集"""
+        key = tuple(texts)
+        keywords = self._unions.get(key)
+        if keywords is None:
+            keywords = frozenset().union(*(self.keywords(text) for text in key))
+            self._unions[key] = keywords
+        return keywords
+    
+    def sources_union(self, retrieved_sources: List[Dict]) -> FrozenSet[str]:
+        """所有来源文档关键词集合的并集"""
+        return self.union(source.get('content', '') for source in retrieved_sources)
+
 class RAGEvaluator:
     """RAG系统评估器"""
     
@@ -15,46 +95,80 @@ class RAGEvaluator:
                             answer: str, 
                             retrieved_sources: List[Dict], 
                             ground_truth: Optional[str] = None,
-                            response_time: Optional[float] = None) -> Dict[str, Any]:
-        """全面评估RAG响应"""
+                            response_time: Optional[float] = None,
+                            llm_usage: Optional[Dict[str, Any]] = None,
+                            timings: Optional[Dict[str, Any]] = None,
+                            metrics: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        评估RAG响应
+
+        Args:
+            metrics: 要计算的指标组（取自 METRIC_NAMES），默认全部；
+                     综合评分只在所选指标上按权重重新归一化
+        """
+        selected = self._select_metrics(metrics)
         evaluation_results = {}
+        # 查询、答案和每个来源文档只在首个需要它的指标中分词一次，供其他指标共享；
+        # 未选中的指标不会触发其依赖文本的分词（如只评估忠实度时不对查询分词）
+        tokens = TokenCache()
         
         # 1. 答案相关性评估
-        evaluation_results['answer_relevance'] = self._evaluate_answer_relevance(query, answer)
+        if 'answer_relevance' in selected:
+            evaluation_results['answer_relevance'] = self._evaluate_answer_relevance(query, answer, tokens)
         
         # 2. 答案忠实度评估
-        evaluation_results['answer_faithfulness'] = self._evaluate_answer_faithfulness(answer, retrieved_sources)
+        if 'answer_faithfulness' in selected:
+            evaluation_results['answer_faithfulness'] = self._evaluate_answer_faithfulness(answer, retrieved_sources, tokens)
         
         # 3. 上下文精确率
-        evaluation_results['context_precision'] = self._evaluate_context_precision(query, retrieved_sources)
+        if 'context_precision' in selected:
+            evaluation_results['context_precision'] = self._evaluate_context_precision(query, retrieved_sources, tokens)
         
         # 4. 上下文召回率
-        evaluation_results['context_recall'] = self._evaluate_context_recall(query, retrieved_sources, ground_truth)
+        if 'context_recall' in selected:
+            evaluation_results['context_recall'] = self._evaluate_context_recall(query, retrieved_sources, ground_truth, tokens)
         
         # 5. 答案完整性
-        evaluation_results['answer_completeness'] = self._evaluate_answer_completeness(query, answer)
+        if 'answer_completeness' in selected:
+            evaluation_results['answer_completeness'] = self._evaluate_answer_completeness(query, answer)
         
         # 6. 答案一致性
-        evaluation_results['answer_consistency'] = self._evaluate_answer_consistency(answer, retrieved_sources)
+        if 'answer_consistency' in selected:
+            evaluation_results['answer_consistency'] = self._evaluate_answer_consistency(answer, retrieved_sources, tokens)
         
-        # 7. 源文档多样性
-        evaluation_results['source_diversity'] = self._evaluate_source_diversity(retrieved_sources)
+        # 7. 源文档多样性（来源文档两两比较，开销最大）
+        if 'source_diversity' in selected:
+            evaluation_results['source_diversity'] = self._evaluate_source_diversity(retrieved_sources)
         
         # 8. 响应性能指标
-        evaluation_results['performance_metrics'] = self._evaluate_performance_metrics(
-            query, answer, retrieved_sources, response_time
-        )
+        if 'performance_metrics' in selected:
+            evaluation_results['performance_metrics'] = self._evaluate_performance_metrics(
+                query, answer, retrieved_sources, response_time, llm_usage, timings
+            )
         
         # 9. 计算综合评分
         evaluation_results['overall_score'] = self._calculate_overall_score(evaluation_results)
         
         return evaluation_results
     
-    def _evaluate_answer_relevance(self, query: str, answer: str) -> Dict[str, float]:
+    @staticmethod
+    def _select_metrics(metrics: Optional[Iterable[str]]) -> FrozenSet[str]:
+        """校验并返回要计算的指标组，未指定时为全部"""
+        if metrics is None:
+            return frozenset(METRIC_NAMES)
+        selected = frozenset(metrics)
+        unknown = selected - set(METRIC_NAMES)
+        if unknown:
+            raise ValueError(f"未知的评估指标: {', '.join(sorted(unknown))}（可选: {', '.join(METRIC_NAMES)}）")
+        return selected
+    
+    def _evaluate_answer_relevance(self, query: str, answer: str,
+                                   tokens: Optional[TokenCache] = None) -> Dict[str, float]:
         """评估答案与查询的相关性"""
+        tokens = tokens or TokenCache()
         # 关键词匹配度
-        query_keywords = set(jieba.lcut(query))
-        answer_keywords = set(jieba.lcut(answer))
+        query_keywords = tokens.keywords(query)
+        answer_keywords = tokens.keywords(answer)
         keyword_overlap = len(query_keywords & answer_keywords) / max(len(query_keywords), 1)
         
         # 长度相关性
@@ -69,18 +183,16 @@ class RAGEvaluator:
             'overall_relevance': float(relevance_score)
         }
     
-    def _evaluate_answer_faithfulness(self, answer: str, retrieved_sources: List[Dict]) -> Dict[str, float]:
+    def _evaluate_answer_faithfulness(self, answer: str, retrieved_sources: List[Dict],
+                                      tokens: Optional[TokenCache] = None) -> Dict[str, float]:
         """评估答案对源文档的忠实度"""
         if not retrieved_sources:
             return {'faithfulness_score': 0.0, 'source_coverage': 0.0}
         
+        tokens = tokens or TokenCache()
         # 计算答案与源文档的关键词重叠
-        answer_keywords = set(jieba.lcut(answer))
-        source_keywords = set()
-        
-        for source in retrieved_sources:
-            source_content = source.get('content', '')
-            source_keywords.update(jieba.lcut(source_content))
+        answer_keywords = tokens.keywords(answer)
+        source_keywords = tokens.sources_union(retrieved_sources)
         
         # 忠实度分数（答案关键词在源文档中的覆盖率）
         faithfulness_score = len(answer_keywords & source_keywords) / max(len(answer_keywords), 1)
@@ -94,17 +206,18 @@ class RAGEvaluator:
             'max_source_similarity': float(faithfulness_score)
         }
     
-    def _evaluate_context_precision(self, query: str, retrieved_sources: List[Dict]) -> Dict[str, float]:
+    def _evaluate_context_precision(self, query: str, retrieved_sources: List[Dict],
+                                    tokens: Optional[TokenCache] = None) -> Dict[str, float]:
         """评估上下文精确率"""
         if not retrieved_sources:
             return {'precision_score': 0.0, 'relevant_sources_count': 0}
         
-        query_keywords = set(jieba.lcut(query))
+        tokens = tokens or TokenCache()
+        query_keywords = tokens.keywords(query)
         relevant_sources = 0
         
         for source in retrieved_sources:
-            source_content = source.get('content', '')
-            source_keywords = set(jieba.lcut(source_content))
+            source_keywords = tokens.keywords(source.get('content', ''))
             
             # 如果关键词重叠超过阈值，认为是相关文档
             overlap = len(query_keywords & source_keywords) / max(len(query_keywords), 1)
@@ -120,22 +233,150 @@ class RAGEvaluator:
             'total_sources_count': len(retrieved_sources)
         }
     
-    def _evaluate_context_recall(self, query: str, retrieved_sources: List[Dict], ground_truth: Optional[str] = None) -> Dict[str, float]:
+    def _evaluate_context_recall(self, query: str, retrieved_sources: List[Dict], ground_truth: Optional[str] = None,
+                                 tokens: Optional[TokenCache] = None) -> Dict[str, float]:
         """评估上下文召回率"""
         if not retrieved_sources:
             return {'recall_score': 0.0, 'coverage_estimate': 0.0}
         
-        query_keywords = set(jieba.lcut(query))
-        all_content = ' '.join([source.get('content', '') for source in retrieved_sources])
-        content_keywords = set(jieba.lcut(all_content))
+        tokens = tokens or TokenCache()
+        # 使用各来源文档关键词的并集，而非对拼接后的全文重新分词
+        query_keywords = tokens.keywords(query)
+        content_keywords = tokens.sources_union(retrieved_sources)
         
         keyword_coverage = len(query_keywords & content_keywords) / max(len(query_keywords), 1)
         
-        return {
+        recall = {
             'recall_score': float(keyword_coverage),
             'coverage_estimate': float(keyword_coverage),
             'keyword_coverage': float(keyword_coverage)
         }
+        
+        # 有参考答案时，以参考答案关键词被检索内容覆盖的比例作为召回率
+        if ground_truth:
+            truth_keywords = tokens.keywords(ground_truth)
+            truth_coverage = len(truth_keywords & content_keywords) / max(len(truth_keywords), 1)
+            recall['recall_score'] = float(truth_coverage)
+            recall['ground_truth_coverage'] = float(truth_coverage)
+        
+        return recall
+    
+    def evaluate_retrieval(self, retrieved_ids: List[List[Any]], relevant_ids: List[Iterable[Any]],
+                           k_values: Sequence[int] = (1, 3, 5, 10)) -> Dict[str, Any]:
+        """
+        基于标注的检索评估：recall@k、precision@k、nDCG@k、hit-rate@k 和 MRR
+        
+        在整个查询集上向量化计算。ID可以是文档块编号（chunk_id）或文档来源（source），
+        同一ID在检索结果中重复出现时只计首次出现的排名。
+        一个检索结果可以对应多个ID（如导入时去重合并的文档块同时代表重复块所在的文档），此时该项为ID列表。
+        
+        Args:
+            retrieved_ids: 每个查询按排名排列的检索结果ID（或ID列表）
+            relevant_ids: 每个查询的相关ID（没有标注相关ID的查询不计入）
+            k_values: 截断位置
+            
+        Returns:
+            {'queries': 参与评估的查询数, 'mrr': 平均倒数排名, 'at_k': {k: {recall, precision, ndcg, hit_rate}}}
+        """
+        pairs = []
+        for retrieved, relevant in zip(retrieved_ids, relevant_ids):
+            relevant = {i for i in relevant or [] if i is not None}
+            if relevant:
+                pairs.append((self._first_occurrences(retrieved), relevant))
+        
+        k_values = sorted(set(k_values))
+        if not pairs:
+            return {'queries': 0, 'mrr': 0.0, 'at_k': {}}
+        
+        # 将ID编码为整数，检索结果以-1、相关ID以-2补齐，逐元素比较得到 (查询, 排名, 相关ID) 覆盖矩阵
+        codes: Dict[Any, int] = {}
+        depth = max(max(len(retrieved) for retrieved, _ in pairs), k_values[-1])
+        group = max((len(ids) for retrieved, _ in pairs for ids in retrieved), default=1)
+        width = max(len(relevant) for _, relevant in pairs)
+        retrieved_matrix = np.full((len(pairs), depth, group), -1, dtype=np.int64)
+        relevant_matrix = np.full((len(pairs), width), -2, dtype=np.int64)
+        for row, (retrieved, relevant) in enumerate(pairs):
+            for rank, ids in enumerate(retrieved):
+                retrieved_matrix[row, rank, :len(ids)] = [codes.setdefault(i, len(codes)) for i in ids]
+            relevant_matrix[row, :len(relevant)] = [codes.setdefault(i, len(codes)) for i in relevant]
+        covered = (retrieved_matrix[:, :, :, None] == relevant_matrix[:, None, None, :]).any(axis=2)
+        hits = covered.any(axis=2)
+        relevant_counts = np.array([len(relevant) for _, relevant in pairs])
+        
+        # 折损增益：每个结果的增益为其覆盖的相关ID数（每个结果一个ID时即二值相关性）
+        discounts = 1.0 / np.log2(np.arange(2, depth + 2))
+        ideal_dcg = np.cumsum(discounts)
+        
+        first_hit = hits.argmax(axis=1) + 1
+        reciprocal_rank = np.where(hits.any(axis=1), 1.0 / first_hit, 0.0)
+        
+        at_k = {}
+        for k in k_values:
+            hits_at_k = hits[:, :k].sum(axis=1)
+            dcg = (covered[:, :k].sum(axis=2) * discounts[:k]).sum(axis=1)
+            at_k[k] = {
+                'recall': float(np.mean(covered[:, :k].sum(axis=(1, 2)) / relevant_counts)),
+                'precision': float(np.mean(hits_at_k / k)),
+                # 一个结果覆盖多个相关ID时DCG可能超过理想值
+                'ndcg': float(np.mean(np.minimum(dcg / ideal_dcg[np.minimum(relevant_counts, k) - 1], 1.0))),
+                'hit_rate': float(np.mean(hits_at_k > 0))
+            }
+        
+        return {
+            'queries': len(pairs),
+            'mrr': float(np.mean(reciprocal_rank)),
+            'at_k': at_k
+        }
+    
+    @staticmethod
+    def retrieved_ids_from_sources(retrieved_sources: List[Dict], id_field: str = 'chunk_id') -> List[Any]:
+        """
+        从检索结果的元数据中提取ID（chunk_id 或 source）
+        
+        导入时去重合并的文档块在元数据 duplicates 中记录了重复块的来源，此时该结果的ID为
+        [自身ID, 重复块的ID...]，使标注为重复块所在文档的查询同样能命中
+        """
+        ids = []
+        for source in retrieved_sources:
+            metadata = source.get('metadata', {})
+            duplicates = [duplicate.get(id_field) for duplicate in metadata.get('duplicates', [])
+                          if duplicate.get(id_field) is not None]
+            ids.append([metadata.get(id_field)] + duplicates if duplicates else metadata.get(id_field))
+        return ids
+    
+    @staticmethod
+    def _first_occurrences(retrieved: List[Any]) -> List[List[Any]]:
+        """将每个检索结果规范为ID列表，只保留各ID首次出现的位置，不含新ID的结果被去掉"""
+        seen = set()
+        ranked = []
+        for item in retrieved:
+            ids = item if isinstance(item, (list, tuple, set, frozenset)) else [item]
+            new_ids = [i for i in dict.fromkeys(ids) if i is not None and i not in seen]
+            if new_ids:
+                seen.update(new_ids)
+                ranked.append(new_ids)
+        return ranked
+    
+    def retrieval_tradeoff_table(self, runs: Dict[str, Dict[str, Any]], k: int = 5) -> str:
+        """
+        生成检索延迟与召回率的对比表
+        
+        Args:
+            runs: {配置名称: {'retrieval': evaluate_retrieval 的结果, 'latencies_ms': 各查询检索耗时}}
+            k: 表中报告的截断位置
+        """
+        header = f"{'配置':<24} {'recall@' + str(k):>10} {'precision@' + str(k):>13} {'nDCG@' + str(k):>9} " \
+                 f"{'hit@' + str(k):>8} {'MRR':>7} {'p50 ms':>9} {'p95 ms':>9}"
+        lines = [header, '-' * len(header)]
+        for name, run in runs.items():
+            metrics = run['retrieval']['at_k'].get(k, {})
+            latencies = np.asarray(run.get('latencies_ms') or [np.nan], dtype=float)
+            lines.append(
+                f"{name:<24} {metrics.get('recall', 0.0):>10.4f} {metrics.get('precision', 0.0):>13.4f} "
+                f"{metrics.get('ndcg', 0.0):>9.4f} {metrics.get('hit_rate', 0.0):>8.4f} "
+                f"{run['retrieval']['mrr']:>7.4f} {np.percentile(latencies, 50):>9.3f} {np.percentile(latencies, 95):>9.3f}"
+            )
+        return '\n'.join(lines)
     
     def _evaluate_answer_completeness(self, query: str, answer: str) -> Dict[str, Any]:
         """评估答案的完整性"""
@@ -157,18 +398,16 @@ class RAGEvaluator:
             'content_density': len(answer.strip()) / max(len(answer), 1)
         }
     
-    def _evaluate_answer_consistency(self, answer: str, retrieved_sources: List[Dict]) -> Dict[str, float]:
+    def _evaluate_answer_consistency(self, answer: str, retrieved_sources: List[Dict],
+                                     tokens: Optional[TokenCache] = None) -> Dict[str, float]:
         """评估答案的一致性"""
         if not retrieved_sources:
             return {'consistency_score': 0.0, 'contradictions_count': 0}
         
+        tokens = tokens or TokenCache()
         # 简单的关键词一致性检查
-        answer_keywords = set(jieba.lcut(answer))
-        source_keywords = set()
-        
-        for source in retrieved_sources:
-            source_content = source.get('content', '')
-            source_keywords.update(jieba.lcut(source_content))
+        answer_keywords = tokens.keywords(answer)
+        source_keywords = tokens.sources_union(retrieved_sources)
         
         # 一致性分数（答案关键词在源文档中的覆盖率）
         consistency_score = len(answer_keywords & source_keywords) / max(len(answer_keywords), 1)
@@ -180,44 +419,43 @@ class RAGEvaluator:
         }
     
     def _evaluate_source_diversity(self, retrieved_sources: List[Dict]) -> Dict[str, float]:
-        """评估源文档的多样性"""
+        """
+        评估源文档的多样性
+        
+        来源文档均带有MinHash签名（检索结果的 minhash 字段）时，以签名向量化估计两两词级shingle集合的Jaccard相似度，
+        无需分词；否则对来源文档分词后精确计算同一相似度
+        """
         if not retrieved_sources:
             return {'diversity_score': 0.0, 'unique_sources': 0}
         
         if len(retrieved_sources) < 2:
             return {'diversity_score': 1.0, 'unique_sources': 1}
         
-        # 计算源文档的关键词多样性
-        all_keywords = set()
-        source_keyword_sets = []
-        
-        for source in retrieved_sources:
-            source_content = source.get('content', '')
-            keywords = set(jieba.lcut(source_content))
-            all_keywords.update(keywords)
-            source_keyword_sets.append(keywords)
-        
-        # 计算关键词重叠度
-        overlaps = 0
-        total_pairs = 0
-        
-        for i in range(len(source_keyword_sets)):
-            for j in range(i + 1, len(source_keyword_sets)):
-                overlap = len(source_keyword_sets[i] & source_keyword_sets[j]) / max(len(source_keyword_sets[i] | source_keyword_sets[j]), 1)
-                overlaps += overlap
-                total_pairs += 1
-        
-        avg_overlap = overlaps / max(total_pairs, 1)
+        if all(source.get('minhash') is not None for source in retrieved_sources):
+            similarity = pairwise_similarity([source['minhash'] for source in retrieved_sources])
+            overlaps = similarity[np.triu_indices(len(retrieved_sources), k=1)].tolist()
+        else:
+            # 计算源文档两两之间的shingle重叠度（与签名估计的相似度一致）
+            shingle_sets = [text_shingles(source.get('content', '')) for source in retrieved_sources]
+            overlaps = []
+            for i in range(len(shingle_sets)):
+                for j in range(i + 1, len(shingle_sets)):
+                    overlaps.append(len(shingle_sets[i] & shingle_sets[j]) / max(len(shingle_sets[i] | shingle_sets[j]), 1))
+        
+        avg_overlap = sum(overlaps) / max(len(overlaps), 1)
         diversity_score = 1.0 - avg_overlap
         
         return {
             'diversity_score': float(diversity_score),
             'avg_source_similarity': float(avg_overlap),
-            'unique_sources': len(set([source.get('content', '') for source in retrieved_sources]))
+            'unique_sources': len(set([source.get('content', '') for source in retrieved_sources])),
+            'near_duplicate_pairs': sum(1 for overlap in overlaps if overlap >= Config.NEAR_DUPLICATE_THRESHOLD)
         }
     
     def _evaluate_performance_metrics(self, query: str, answer: str, 
-                                    retrieved_sources: List[Dict], response_time: Optional[float] = None) -> Dict[str, Any]:
+                                    retrieved_sources: List[Dict], response_time: Optional[float] = None,
+                                    llm_usage: Optional[Dict[str, Any]] = None,
+                                    timings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """评估性能指标"""
         metrics = {
             'response_time_seconds': response_time or 0.0,
@@ -234,52 +472,64 @@ class RAGEvaluator:
         else:
             metrics['avg_source_score'] = 0.0
         
+        metrics.update(self._evaluate_throughput(llm_usage or {}, timings or {}))
+        
         return metrics
     
-    def _calculate_overall_score(self, evaluation_results: Dict[str, Any]) -> Dict[str, Any]:
-        """计算综合评分"""
-        weights = {
-            'answer_relevance': 0.25,
-            'answer_faithfulness': 0.20,
-            'context_precision': 0.15,
-            'context_recall': 0.15,
-            'answer_completeness': 0.10,
-            'answer_consistency': 0.10,
-            'source_diversity': 0.05
+    def _evaluate_throughput(self, llm_usage: Dict[str, Any], timings: Dict[str, Any]) -> Dict[str, Any]:
+        """基于后端返回的token计数和耗时计算真实吞吐量"""
+        prompt_tokens = llm_usage.get('prompt_tokens')
+        completion_tokens = llm_usage.get('completion_tokens')
+        prompt_eval_ms = llm_usage.get('prompt_eval_ms')
+        eval_ms = llm_usage.get('eval_ms')
+        backend_total_ms = llm_usage.get('backend_total_ms')
+        llm_ms = timings.get('llm_ms')
+        ttft_ms = timings.get('ttft_ms')
+        
+        prompt_tps = None
+        if prompt_tokens and prompt_eval_ms:
+            prompt_tps = prompt_tokens / (prompt_eval_ms / 1000)
+        elif prompt_tokens and ttft_ms:
+            # 没有服务端耗时时，以首个token时间近似提示词处理时间
+            prompt_tps = prompt_tokens / (ttft_ms / 1000)
+        
+        generation_tps = None
+        if completion_tokens and eval_ms:
+            generation_tps = completion_tokens / (eval_ms / 1000)
+        elif completion_tokens and llm_ms:
+            generation_ms = llm_ms - ttft_ms if ttft_ms else llm_ms
+            generation_tps = completion_tokens / max(generation_ms / 1000, 1e-3)
+        
+        # 客户端观测耗时与服务端实际处理耗时之差：网络、服务端排队和模型加载等开销
+        queueing_overhead_ms = None
+        if llm_ms is not None and backend_total_ms is not None:
+            queueing_overhead_ms = max(llm_ms - backend_total_ms, 0.0) + (llm_usage.get('load_ms') or 0.0)
+        
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'prompt_tokens_per_second': float(prompt_tps) if prompt_tps is not None else None,
+            'generation_tokens_per_second': float(generation_tps) if generation_tps is not None else None,
+            'queueing_overhead_ms': queueing_overhead_ms,
+            'admission_wait_ms': timings.get('queue_ms')
         }
+    
+    def _calculate_overall_score(self, evaluation_results: Dict[str, Any]) -> Dict[str, Any]:
+        """计算综合评分（只计入已评估的指标，按其权重之和归一化；未评估任何计权指标时为None）"""
+        weights = {metric: weight for metric, weight in OVERALL_WEIGHTS.items() if metric in evaluation_results}
         
         weighted_score = 0.0
         total_weight = 0.0
         
         for metric, weight in weights.items():
-            if metric in evaluation_results:
-                if isinstance(evaluation_results[metric], dict):
-                    if metric == 'answer_relevance':
-                        score = evaluation_results[metric]['overall_relevance']
-                    elif metric == 'answer_faithfulness':
-                        score = evaluation_results[metric]['faithfulness_score']
-                    elif metric == 'context_precision':
-                        score = evaluation_results[metric]['precision_score']
-                    elif metric == 'context_recall':
-                        score = evaluation_results[metric]['recall_score']
-                    elif metric == 'answer_completeness':
-                        score = evaluation_results[metric]['completeness_score']
-                    elif metric == 'answer_consistency':
-                        score = evaluation_results[metric]['consistency_score']
-                    elif metric == 'source_diversity':
-                        score = evaluation_results[metric]['diversity_score']
-                    else:
-                        continue
-                else:
-                    score = evaluation_results[metric]
-                
-                weighted_score += score * weight
-                total_weight += weight
-        
-        overall_score = weighted_score / total_weight if total_weight > 0 else 0.0
+            group, field = PRIMARY_SCORES[metric]
+            weighted_score += evaluation_results[group][field] * weight
+            total_weight += weight
+        
+        overall_score = float(weighted_score / total_weight) if total_weight > 0 else None
         
         return {
-            'overall_score': float(overall_score),
+            'overall_score': overall_score,
             'weighted_components': weights
         }
     
@@ -1,28 +1,65 @@
 import os
+import sys
 import pickle
-from typing import List, Dict, Any
+import hashlib
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from multiprocessing.connection import wait as wait_connections
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 import numpy as np
 import faiss
 from sentence_transformers import SentenceTransformer
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
 from langchain_community.embeddings import HuggingFaceEmbeddings
 import openai
 import requests
 from config import Config
+from metrics import EMBED_BATCH_SIZE
+from telemetry import process_rss_bytes, jieba_dictionary_bytes
+from minhash import NUM_PERM, SHINGLE_SIZE, MinHashLSH, text_signatures, pairwise_similarity
+from tokenizer import init_tokenizer
 
 class OllamaEmbeddings:
     def __init__(self, base_url: str, model: str):
         self.base_url = base_url.rstrip('/')
         self.model = model
+        # 旧版Ollama没有批量接口 /api/embed，探测到后改为逐条调用 /api/embeddings
+        self.batch_supported = True
 
     def embed_documents(self, texts):
-        vectors = []
-        for text in texts:
-            vectors.append(self.embed_query(text))
-        return vectors
+        """一次请求计算一批文本的嵌入（/api/embed 的 input 列表，返回单位长度的向量）"""
+        texts = list(texts)
+        if not texts:
+            return []
+        if not self.batch_supported:
+            return [self._embed_single(text) for text in texts]
+        
+        url = f"{self.base_url}/api/embed"
+        payload = {"model": self.model, "input": texts}
+        try:
+            resp = requests.post(url, json=payload, timeout=30 + len(texts))
+            # 接口不存在时返回纯文本404（模型不存在时为JSON错误）
+            if resp.status_code == 404 and 'json' not in resp.headers.get('Content-Type', ''):
+                self.batch_supported = False
+                return [self._embed_single(text) for text in texts]
+            resp.raise_for_status()
+            embeddings = resp.json()["embeddings"]
+        except Exception as e:
+            raise RuntimeError(f"Ollama embedding API 调用失败: {e}")
+        if len(embeddings) != len(texts):
+            raise RuntimeError(f"Ollama embedding API 返回了 {len(embeddings)} 个向量，请求了 {len(texts)} 个")
+        return embeddings
 
     def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def _embed_single(self, text):
         url = f"{self.base_url}/api/embeddings"
         payload = {"model": self.model, "prompt": text}
         try:
@@ -33,6 +70,254 @@ class OllamaEmbeddings:
         except Exception as e:
             raise RuntimeError(f"Ollama embedding API 调用失败: {e}")
 
+def iter_document_chunks(file_path: str, text_splitter: RecursiveCharacterTextSplitter) -> Iterator[Dict[str, Any]]:
+    """
+    逐块解析并分割文档（PDF按页懒加载，每次只分割一页）
+    
+    Args:
+        file_path: 文档路径
+        text_splitter: 文本分割器
+        
+    Yields:
+        文档块，包含 content 和 metadata（source、page、start_index）
+    """
+    file_extension = file_path.lower().split('.')[-1]
+    
+    if file_extension == 'pdf':
+        chunks = (chunk for page in PyPDFLoader(file_path).lazy_load()
+                  for chunk in text_splitter.split_documents([page]))
+    elif file_extension in ['docx', 'doc']:
+        chunks = (chunk for page in Docx2txtLoader(file_path).lazy_load()
+                  for chunk in text_splitter.split_documents([page]))
+    elif file_extension == 'txt':
+        # 分段读取文本文件，内存占用与文件大小无关
+        chunks = iter_text_file_chunks(file_path, text_splitter)
+    else:
+        raise ValueError(f"不支持的文件格式: {file_extension}")
+    
+    for chunk in chunks:
+        yield {
+            'content': chunk.page_content,
+            'metadata': {
+                'source': file_path,
+                'page': chunk.metadata.get('page'),
+                'start_index': chunk.metadata.get('start_index', -1)
+            }
+        }
+
+def iter_text_file_chunks(file_path: str, text_splitter: RecursiveCharacterTextSplitter,
+                          window_chars: Optional[int] = None) -> Iterator[Document]:
+    """
+    分段读取并分割文本文件
+    
+    按 window_chars 个字符为一段读取（文本模式下逐块增量解码UTF-8，跨块的多字节字符不会被截断），
+    对当前窗口调用同一个分割器；窗口末尾附近的文档块可能被窗口边界截断，暂不输出，
+    从其所在段落（分割器的首选分隔符）的起点开始并入下一个窗口重新分割。
+    文档块大小和重叠与分割器配置一致，start_index 为在整个文件中的字符位置；
+    除段落分隔符分布极不均匀的文件外，结果与对整个文件调用 create_documents 相同。
+    
+    Args:
+        file_path: 文本文件路径
+        text_splitter: 文本分割器
+        window_chars: 每次读取的字符数，默认取 Config.TEXT_CHUNK_WINDOW_CHARS
+        
+    Yields:
+        文档块，metadata 中包含 start_index
+    """
+    window_chars = window_chars or Config.TEXT_CHUNK_WINDOW_CHARS
+    chunk_size = text_splitter._chunk_size
+    chunk_overlap = text_splitter._chunk_overlap
+    # 结束位置落在窗口最后这些字符内的文档块留到下一个窗口
+    holdback = 4 * chunk_size
+    
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buffer = ''
+        buffer_start = 0
+        while True:
+            block = f.read(window_chars)
+            buffer += block
+            final = not block
+            if not final and len(buffer) < max(window_chars, 2 * holdback):
+                continue
+            
+            # 与 create_documents 相同的 start_index 计算方式
+            chunks, positions = text_splitter.split_text(buffer), []
+            position, previous_length = 0, 0
+            for chunk in chunks:
+                position = buffer.find(chunk, max(0, position + previous_length - chunk_overlap))
+                previous_length = len(chunk)
+                positions.append(position)
+            
+            if final:
+                emit, carry = len(chunks), len(buffer)
+            else:
+                held = next((i for i, (chunk, position) in enumerate(zip(chunks, positions))
+                             if position + len(chunk) > len(buffer) - holdback), len(chunks))
+                emit, carry = _restart_point(buffer, positions, held, text_splitter)
+            
+            for chunk, position in zip(chunks[:emit], positions[:emit]):
+                yield Document(page_content=chunk, metadata={'start_index': buffer_start + position})
+            
+            if final:
+                return
+            buffer_start += carry
+            buffer = buffer[carry:]
+
+def _restart_point(buffer: str, positions: List[int], held: int,
+                   text_splitter: RecursiveCharacterTextSplitter) -> Tuple[int, int]:
+    """
+    选择下一个窗口的起点：从第 held 个文档块往前找第一个位于分隔符边界上的文档块
+    
+    分割器在分隔符处切分段落并从段落起点合并文档块，从这样的位置重新分割得到的后续文档块与整体分割一致
+    
+    Returns:
+        (本窗口输出的文档块数, 下一个窗口在 buffer 中的起点)
+    """
+    if held == 0:
+        # 窗口内还没有可输出的文档块，继续读取
+        return 0, 0
+    separator = next(s for s in text_splitter._separators if s == '' or s in buffer)
+    for i in range(min(held, len(positions) - 1), 0, -1):
+        start = positions[i]
+        while start > 0 and buffer[start - 1].isspace():
+            start -= 1
+        if separator == '':
+            return i, positions[i]
+        boundary = buffer.find(separator, start, positions[i])
+        if boundary >= 0:
+            return i, boundary
+    return held, positions[held] if held < len(positions) else len(buffer)
+
+def split_document(file_path: str, text_splitter: RecursiveCharacterTextSplitter) -> List[Dict[str, Any]]:
+    """
+    解析文档并分割成带元数据的块
+    
+    Args:
+        file_path: 文档路径
+        text_splitter: 文本分割器
+        
+    Returns:
+        文档块列表，每项包含 content 和 metadata（source、page、start_index）
+    """
+    return list(iter_document_chunks(file_path, text_splitter))
+
+def parse_document(file_path: str, text_splitter: RecursiveCharacterTextSplitter) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+    """解析并分割文档，同时计算各文档块的MinHash签名（两者均为CPU密集操作）"""
+    chunks = split_document(file_path, text_splitter)
+    return chunks, text_signatures([chunk['content'] for chunk in chunks])
+
+def _parse_worker_main(conn, text_splitter: RecursiveCharacterTextSplitter):
+    """解析进程主循环：初始化完成后回传None，再逐个接收 (序号, 文件路径)，回传 (序号, 解析结果, 错误信息)；收到None时退出"""
+    init_tokenizer()
+    conn.send(None)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        index, file_path = task
+        try:
+            conn.send((index, parse_document(file_path, text_splitter), None))
+        except Exception as e:
+            conn.send((index, None, str(e)))
+
+def worker_context(*preload: str):
+    """
+    工作进程（文档解析、离线评分）的启动方式：forkserver（不可用时为spawn）
+    
+    服务进程中有多个线程时fork可能继承被其他线程持有的锁；forkserver 从预加载了本模块（及 preload 中的模块）的
+    单线程服务进程派生工作进程，既安全又避免每个进程重新导入依赖。forkserver 启动后预加载列表不再生效
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__, *preload])
+        return context
+    return multiprocessing.get_context('spawn')
+
+class _ReadWriteLock:
+    """读写锁：读者可以并发持有，写者独占；有写者等待时新读者让行，避免持续检索使写入饿死"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+class _ParseWorker:
+    """一个解析进程及与其通信的管道（每个进程独占管道，终止进程不影响其他进程的通信）"""
+
+    def __init__(self, context, text_splitter: RecursiveCharacterTextSplitter):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_parse_worker_main, args=(child_conn, text_splitter),
+                                       name='ingest-parse-worker', daemon=True)
+        self.process.start()
+        child_conn.close()
+        # 是否已完成初始化；正在解析的文件序号及其截止时间（从开始解析起计时）
+        self.ready = False
+        self.index: Optional[int] = None
+        self.deadline = float('inf')
+
+    @property
+    def idle(self) -> bool:
+        return self.ready and self.index is None
+
+    def submit(self, index: int, file_path: str, timeout: float):
+        self.conn.send((index, file_path))
+        self.index = index
+        self.deadline = time.monotonic() + timeout
+
+    def finish(self):
+        self.index = None
+        self.deadline = float('inf')
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        """通知进程退出，未及时退出时终止"""
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
 class RAGSystem:
     def __init__(self, embedding_config=None, **kwargs):
         if embedding_config is None:
@@ -61,11 +346,59 @@ class RAGSystem:
             chunk_size=1000,
             chunk_overlap=200,
             length_function=len,
+            add_start_index=True,
         )
         self.documents = []
-        self.embeddings_matrix = None
+        self.chunk_metadata = []
+        # 文本块与元数据占用内存的估算（字节），随导入增量更新，查询统计时不遍历语料
+        self._chunk_text_bytes = 0
+        self._chunk_metadata_bytes = 0
+        # 每个文档块的MinHash签名，与 documents 一一对应
+        self._signature_buffer = np.empty((0, NUM_PERM), dtype=np.uint32)
+        self._signature_count = 0
+        # 导入时去重：内容哈希 -> 文档块编号，及近似重复检测的LSH索引
+        self.dedup_mode = kwargs.get('dedup', Config.INGEST_DEDUP)
+        self.content_hashes = {}
+        self.lsh = MinHashLSH(Config.NEAR_DUPLICATE_THRESHOLD)
+        self.dedup_stats = {'exact': 0, 'near': 0}
+        # 并行解析文档的进程数（0 表示CPU核数）及单个文件的解析超时（为0且只有一个进程时在当前线程中逐个解析）
+        self.ingest_workers = kwargs.get('ingest_workers', Config.INGEST_WORKERS) or os.cpu_count() or 1
+        self.ingest_file_timeout = kwargs.get('ingest_file_timeout', Config.INGEST_FILE_TIMEOUT)
+        # 嵌入向量只保存在FAISS索引中；索引可能落后于 documents（尚未嵌入的文档块），检索只返回已加入索引的块
         self.index = None
         self.is_initialized = False
+        # 检索之间可以并发（FAISS检索不修改索引且释放GIL）；追加向量（可能重新分配FAISS内部存储）或替换索引时独占
+        self._index_lock = _ReadWriteLock()
+        # 导入文档（分配文档块编号、更新去重索引和签名）逐个进行，并发上传不会交错写入
+        self._ingest_lock = threading.Lock()
+    
+    @property
+    def chunk_signatures(self) -> np.ndarray:
+        """每个文档块的MinHash签名，与 documents 一一对应"""
+        return self._signature_buffer[:self._signature_count]
+    
+    @chunk_signatures.setter
+    def chunk_signatures(self, signatures: np.ndarray):
+        self._signature_buffer = np.asarray(signatures, dtype=np.uint32).reshape(-1, NUM_PERM)
+        self._signature_count = len(self._signature_buffer)
+    
+    def _append_signatures(self, signatures: List[np.ndarray]):
+        """追加签名（容量按倍数增长，逐块追加的总复制量与文档块数成线性）"""
+        needed = self._signature_count + len(signatures)
+        if needed > len(self._signature_buffer):
+            buffer = np.empty((max(needed, 2 * len(self._signature_buffer), 64), NUM_PERM), dtype=np.uint32)
+            buffer[:self._signature_count] = self.chunk_signatures
+            self._signature_buffer = buffer
+        self._signature_buffer[self._signature_count:needed] = signatures
+        self._signature_count = needed
+    
+    @property
+    def embeddings_matrix(self) -> Optional[np.ndarray]:
+        """索引中全部嵌入向量的副本（按需从FAISS索引重建，不常驻内存）"""
+        if self.index is None or self.index.ntotal == 0:
+            return None
+        with self._index_lock.read():
+            return self.index.reconstruct_n(0, self.index.ntotal)
         
     def _create_simple_embeddings(self):
         """创建简单的嵌入模型作为备选"""
@@ -115,62 +448,360 @@ class RAGSystem:
         Returns:
             文档块列表
         """
-        file_extension = file_path.lower().split('.')[-1]
-        
-        if file_extension == 'pdf':
-            loader = PyPDFLoader(file_path)
-            documents = loader.load()
-            chunks = self.text_splitter.split_documents(documents)
-            return [chunk.page_content for chunk in chunks]
-        elif file_extension in ['docx', 'doc']:
-            loader = Docx2txtLoader(file_path)
-            documents = loader.load()
-            chunks = self.text_splitter.split_documents(documents)
-            return [chunk.page_content for chunk in chunks]
-        elif file_extension == 'txt':
-            # 直接读取文本文件
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            chunks = self.text_splitter.split_text(content)
-            return chunks
-        else:
-            raise ValueError(f"不支持的文件格式: {file_extension}")
+        return [chunk['content'] for chunk in self.load_document_chunks(file_path)]
     
-    def add_documents(self, file_paths: List[str]):
+    def load_document_chunks(self, file_path: str) -> List[Dict[str, Any]]:
+        """
+        加载文档并分割成带元数据的块
+        
+        Args:
+            file_path: 文档路径
+            
+        Returns:
+            文档块列表，每项包含 content 和 metadata（source、page、start_index）
+        """
+        return split_document(file_path, self.text_splitter)
+    
+    def add_documents(self, file_paths: List[str]) -> List[Dict[str, Any]]:
         """
         添加多个文档到系统
         
+        在解析进程中并行解析和分割，按 file_paths 的顺序加入；
+        单个文件解析失败或超时只跳过该文件，不影响其他文件；并发调用时逐个执行
+        
         Args:
             file_paths: 文档路径列表
+            
+        Returns:
+            每个文件的导入结果：file、chunks（加入的文本块数）、skipped（重复的文本块数）、error（失败原因，成功时为None）
         """
-        for file_path in file_paths:
-            try:
-                chunks = self.load_document(file_path)
-                self.documents.extend(chunks)
-                print(f"成功加载文档: {file_path}, 添加了 {len(chunks)} 个文本块")
-            except Exception as e:
-                print(f"加载文档失败 {file_path}: {str(e)}")
+        with self._ingest_lock:
+            report = []
+            for file_path, parsed, error in self._parse_documents(file_paths):
+                if error is not None:
+                    print(f"加载文档失败 {file_path}: {error}")
+                    report.append({'file': file_path, 'chunks': 0, 'skipped': 0, 'error': error})
+                    continue
+                try:
+                    chunks, signatures = parsed
+                    kept = []
+                    for chunk, signature in zip(chunks, signatures):
+                        if self._is_duplicate(chunk, signature):
+                            continue
+                        self._append_chunk(chunk, signature)
+                        kept.append(signature)
+                    if kept:
+                        self._append_signatures(kept)
+                    skipped = len(chunks) - len(kept)
+                    print(f"成功加载文档: {file_path}, 添加了 {len(kept)} 个文本块"
+                          + (f"，跳过 {skipped} 个重复文本块" if skipped else ""))
+                    report.append({'file': file_path, 'chunks': len(kept), 'skipped': skipped, 'error': None})
+                except Exception as e:
+                    print(f"加载文档失败 {file_path}: {str(e)}")
+                    report.append({'file': file_path, 'chunks': 0, 'skipped': 0, 'error': str(e)})
+            return report
+    
+    def _parse_documents(self, file_paths: List[str]) -> Iterator[Tuple[str, Optional[Tuple[List[Dict[str, Any]], np.ndarray]], Optional[str]]]:
+        """
+        解析文档，按输入顺序逐个产出 (文件路径, (文档块, 签名), 错误信息)
+        
+        在 ingest_workers 个解析进程中并行解析；每个文件从开始解析起超过 ingest_file_timeout 秒即记为失败，
+        其解析进程被终止并由新进程替换，后续文件不受影响。ingest_file_timeout 为0且只有一个解析进程时在当前线程中解析
+        """
+        workers = min(self.ingest_workers, len(file_paths))
+        if workers <= 1 and self.ingest_file_timeout <= 0:
+            for file_path in file_paths:
+                try:
+                    yield file_path, parse_document(file_path, self.text_splitter), None
+                except Exception as e:
+                    yield file_path, None, str(e)
+            return
+        
+        timeout = self.ingest_file_timeout if self.ingest_file_timeout > 0 else float('inf')
+        context = worker_context()
+        pending = deque(enumerate(file_paths))
+        finished: Dict[int, Tuple[Optional[Tuple[List[Dict[str, Any]], np.ndarray]], Optional[str]]] = {}
+        live: Dict[Any, _ParseWorker] = {}
+        
+        def start_worker():
+            worker = _ParseWorker(context, self.text_splitter)
+            live[worker.conn] = worker
+        
+        def replace_worker(worker: _ParseWorker, error: str):
+            # 正在解析的文件记为失败，终止该进程并启动新进程接替
+            finished[worker.index] = (None, error)
+            del live[worker.conn]
+            worker.kill()
+            start_worker()
+        
+        try:
+            for _ in range(workers):
+                start_worker()
+            for next_index, file_path in enumerate(file_paths):
+                while next_index not in finished:
+                    if not live:
+                        # 解析进程均无法启动
+                        while pending:
+                            finished[pending.popleft()[0]] = (None, "解析进程启动失败")
+                        break
+                    
+                    for worker in list(live.values()):
+                        if pending and worker.idle:
+                            index, path = pending.popleft()
+                            try:
+                                worker.submit(index, path, timeout)
+                            except OSError:
+                                worker.index = index
+                                replace_worker(worker, f"解析进程异常退出（退出码 {worker.process.exitcode}）")
+                    
+                    nearest = min(worker.deadline for worker in live.values())
+                    wait_seconds = max(0.0, min(nearest - time.monotonic(), 60.0))
+                    for conn in wait_connections(list(live), timeout=wait_seconds):
+                        worker = live[conn]
+                        try:
+                            message = conn.recv()
+                        except (EOFError, OSError):
+                            if worker.index is not None:
+                                replace_worker(worker, f"解析进程异常退出（退出码 {worker.process.exitcode}）")
+                            else:
+                                # 启动阶段退出的进程不再替换，避免反复启动
+                                print(f"解析进程启动失败（退出码 {worker.process.exitcode}）")
+                                del live[conn]
+                                worker.kill()
+                            continue
+                        if message is None:
+                            worker.ready = True
+                            continue
+                        index, parsed, error = message
+                        finished[index] = (parsed, error)
+                        worker.finish()
+                    
+                    now = time.monotonic()
+                    for worker in list(live.values()):
+                        if worker.deadline <= now:
+                            replace_worker(worker, f"解析超时（超过 {self.ingest_file_timeout} 秒）")
+                
+                parsed, error = finished.pop(next_index)
+                yield file_path, parsed, error
+        finally:
+            for worker in live.values():
+                if worker.index is None:
+                    worker.stop()
+                else:
+                    worker.kill()
+    
+    @staticmethod
+    def _content_hash(content: str) -> str:
+        """忽略空白差异的内容哈希"""
+        return hashlib.blake2b(' '.join(content.split()).encode('utf-8'), digest_size=16).hexdigest()
+    
+    def _register_chunk(self, content: str, signature: np.ndarray, chunk_id: int):
+        """将已保留的文档块加入去重索引"""
+        if self.dedup_mode == 'off':
+            return
+        self.content_hashes.setdefault(self._content_hash(content), chunk_id)
+        if self.dedup_mode == 'near':
+            self.lsh.insert(chunk_id, signature)
+    
+    def _append_chunk(self, chunk: Dict[str, Any], signature: np.ndarray):
+        """保留文档块：分配编号、加入去重索引并累计内存占用（签名由调用方追加）"""
+        chunk_id = len(self.documents)
+        chunk['metadata']['chunk_id'] = chunk_id
+        self._register_chunk(chunk['content'], signature, chunk_id)
+        self.documents.append(chunk['content'])
+        self.chunk_metadata.append(chunk['metadata'])
+        self._chunk_text_bytes += sys.getsizeof(chunk['content'])
+        self._chunk_metadata_bytes += self._dict_bytes(chunk['metadata'])
+    
+    @staticmethod
+    def _dict_bytes(values: Dict[str, Any]) -> int:
+        """字典及其各值的浅层大小"""
+        return sys.getsizeof(values) + sum(sys.getsizeof(value) for value in values.values())
+    
+    def _recount_memory(self):
+        """加载索引后重新计算文本块与元数据的内存占用"""
+        self._chunk_text_bytes = sum(sys.getsizeof(document) for document in self.documents)
+        self._chunk_metadata_bytes = sum(
+            self._dict_bytes(metadata) + sum(self._dict_bytes(entry) for entry in metadata.get('duplicates', ()))
+            for metadata in self.chunk_metadata
+        )
+    
+    def _is_duplicate(self, chunk: Dict[str, Any], signature: np.ndarray) -> bool:
+        """
+        判断文档块是否与已保留的文档块重复（内容相同或MinHash近似重复）
+        
+        重复时在被保留文档块的元数据 duplicates 中记录该块的来源位置，不再单独嵌入和索引
+        """
+        if self.dedup_mode == 'off':
+            return False
+        
+        kind, similarity = 'exact', 1.0
+        original = self.content_hashes.get(self._content_hash(chunk['content']))
+        if original is None and self.dedup_mode == 'near':
+            match = self.lsh.query(signature)
+            if match is not None:
+                original, similarity = match
+                kind = 'near'
+        if original is None:
+            return False
+        
+        duplicate = {
+            'source': chunk['metadata']['source'],
+            'page': chunk['metadata'].get('page'),
+            'start_index': chunk['metadata'].get('start_index', -1),
+            'similarity': similarity
+        }
+        metadata = self.chunk_metadata[original]
+        if 'duplicates' not in metadata:
+            metadata['duplicates'] = []
+            self._chunk_metadata_bytes += sys.getsizeof(metadata['duplicates'])
+        list_bytes = sys.getsizeof(metadata['duplicates'])
+        metadata['duplicates'].append(duplicate)
+        self._chunk_metadata_bytes += sys.getsizeof(metadata['duplicates']) - list_bytes + self._dict_bytes(duplicate)
+        self.dedup_stats[kind] += 1
+        return True
+    
+    def _rebuild_dedup_index(self):
+        """加载索引后重建去重索引，使后续导入的文档也与已有文档块去重"""
+        self.content_hashes = {}
+        self.lsh = MinHashLSH(Config.NEAR_DUPLICATE_THRESHOLD)
+        for chunk_id, (content, signature) in enumerate(zip(self.documents, self.chunk_signatures)):
+            self._register_chunk(content, signature, chunk_id)
     
     def build_index(self):
         """
         构建向量索引
         """
-        if not self.documents:
-            raise ValueError("没有文档可以索引")
+        with self._ingest_lock:
+            if not self.documents:
+                raise ValueError("没有文档可以索引")
+                
+            print("开始构建向量索引...")
             
-        print("开始构建向量索引...")
-        
-        # 计算文档嵌入
-        embeddings_list = self.embeddings.embed_documents(self.documents)
-        self.embeddings_matrix = np.array(embeddings_list).astype('float32')
+            # 按批计算文档嵌入并逐批加入新索引，不在内存中保留全部嵌入；构建期间检索仍使用旧索引
+            index = None
+            batch_size = Config.INGEST_EMBED_BATCH_SIZE
+            for start in range(0, len(self.documents), batch_size):
+                vectors = self._embed_block(self.documents[start:start + batch_size])
+                if index is None:
+                    index = faiss.IndexFlatIP(vectors.shape[1])  # 内积索引，用于余弦相似度
+                index.add(vectors)
+            
+            with self._index_lock.write():
+                self.index = index
+                self.is_initialized = True
+            print(f"索引构建完成，包含 {len(self.documents)} 个文档块")
+    
+    def _index_pending(self, batch_size: Optional[int] = None):
+        """嵌入并索引所有尚未加入索引的文档块"""
+        batch_size = batch_size or Config.INGEST_EMBED_BATCH_SIZE
+        for start in range(self.index_size(), len(self.documents), batch_size):
+            self._add_vectors(self._embed_block(self.documents[start:start + batch_size]))
+    
+    def _embed_block(self, texts: List[str]) -> np.ndarray:
+        """计算一批文档块的嵌入"""
+        EMBED_BATCH_SIZE.observe(len(texts))
+        return np.asarray(self.embeddings.embed_documents(texts), dtype='float32')
+    
+    def _add_vectors(self, vectors: np.ndarray):
+        """向索引追加一批向量（首批时创建索引）"""
+        with self._index_lock.write():
+            if self.index is None:
+                self.index = faiss.IndexFlatIP(vectors.shape[1])
+            self.index.add(vectors)
+            self.is_initialized = True
+    
+    def ingest_documents(self, file_paths: List[str], batch_size: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        流式导入文档：解析 → 分割 → 嵌入 → 索引
         
-        # 创建FAISS索引
-        dimension = self.embeddings_matrix.shape[1]
-        self.index = faiss.IndexFlatIP(dimension)  # 内积索引，用于余弦相似度
-        self.index.add(self.embeddings_matrix)
+        后台线程从解析进程（与 add_documents 相同，受 ingest_file_timeout 限制，单个文件失败不影响其他文件）
+        逐个取得解析结果，经有界队列交给当前线程去重、按批嵌入并立即加入索引，解析（CPU）与嵌入（网络）重叠进行；
+        内存中只保留队列、正在解析的文件和当前一批文档块，与语料规模无关。
+        导入前先补齐此前已加载但尚未索引的文档块；与 add_documents、build_index 互斥，并发调用时逐个执行。
         
-        self.is_initialized = True
-        print(f"索引构建完成，包含 {len(self.documents)} 个文档块")
+        Args:
+            file_paths: 文档路径列表
+            batch_size: 每批嵌入的文档块数，默认取 Config.INGEST_EMBED_BATCH_SIZE
+            
+        Returns:
+            每个文件的导入结果，格式同 add_documents
+        """
+        with self._ingest_lock:
+            batch_size = batch_size or Config.INGEST_EMBED_BATCH_SIZE
+            self._index_pending(batch_size)
+            
+            chunk_queue = queue.Queue(maxsize=Config.INGEST_QUEUE_SIZE)
+            stop = threading.Event()
+            
+            def put(item):
+                # 消费者出错退出后不再阻塞在已满的队列上
+                while not stop.is_set():
+                    try:
+                        chunk_queue.put(item, timeout=0.1)
+                        return
+                    except queue.Full:
+                        continue
+            
+            def produce():
+                parsed_files = self._parse_documents(file_paths)
+                try:
+                    for file_path, parsed, error in parsed_files:
+                        if error is not None:
+                            put(('error', file_path, error))
+                            continue
+                        for chunk, signature in zip(*parsed):
+                            if stop.is_set():
+                                return
+                            put(('chunk', file_path, (chunk, signature)))
+                        put(('done', file_path, None))
+                finally:
+                    # 提前退出时终止解析进程
+                    parsed_files.close()
+                    put(None)
+            
+            producer = threading.Thread(target=produce, name='ingest-parser', daemon=True)
+            producer.start()
+            
+            counts = {file_path: {'file': file_path, 'chunks': 0, 'skipped': 0, 'error': None} for file_path in file_paths}
+            report = []
+            try:
+                while True:
+                    item = chunk_queue.get()
+                    if item is None:
+                        break
+                    kind, file_path, payload = item
+                    if kind == 'chunk':
+                        chunk, signature = payload
+                        if self._is_duplicate(chunk, signature):
+                            counts[file_path]['skipped'] += 1
+                            continue
+                        self._append_chunk(chunk, signature)
+                        self._append_signatures([signature])
+                        counts[file_path]['chunks'] += 1
+                        if len(self.documents) - self.index_size() >= batch_size:
+                            self._index_pending(batch_size)
+                        continue
+                    
+                    if kind == 'error':
+                        counts[file_path]['error'] = payload
+                        print(f"加载文档失败 {file_path}: {payload}")
+                    else:
+                        print(f"成功导入文档: {file_path}, 添加了 {counts[file_path]['chunks']} 个文本块"
+                              + (f"，跳过 {counts[file_path]['skipped']} 个重复文本块" if counts[file_path]['skipped'] else ""))
+                    report.append(counts[file_path])
+                
+                self._index_pending(batch_size)
+            finally:
+                stop.set()
+                producer.join()
+            
+            print(f"索引已更新，包含 {self.index_size()} 个文档块")
+            return report
+    
+    def index_size(self) -> int:
+        """已加入索引的文档块数"""
+        return self.index.ntotal if self.index is not None else 0
     
     def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
         """
@@ -183,27 +814,135 @@ class RAGSystem:
         Returns:
             相关文档列表
         """
+        return self.search_by_vector(self.embed_query(query), top_k)
+    
+    def embed_query(self, query: str) -> np.ndarray:
+        """
+        计算查询嵌入
+        
+        Args:
+            query: 查询文本
+            
+        Returns:
+            形状为 (1, dimension) 的查询向量
+        """
         if not self.is_initialized:
             raise ValueError("索引尚未构建，请先调用 build_index()")
             
-        # 计算查询嵌入
+        EMBED_BATCH_SIZE.observe(1)
         query_embedding = self.embeddings.embed_query(query)
-        query_vector = np.array([query_embedding]).astype('float32')
+        return np.array([query_embedding]).astype('float32')
+    
+    def search_by_vector(self, query_vector: np.ndarray, top_k: int = 5) -> List[Dict[str, Any]]:
+        """
+        使用查询向量搜索相关文档
         
+        Args:
+            query_vector: 形状为 (1, dimension) 的查询向量
+            top_k: 返回的文档数量
+            
+        Returns:
+            相关文档列表
+        """
+        return self.search_vectors(query_vector, top_k)[0]
+    
+    def search_vectors(self, query_vectors: np.ndarray, top_k: int = 5) -> List[List[Dict[str, Any]]]:
+        """
+        使用一组查询向量进行一次向量化检索
+        
+        Args:
+            query_vectors: 形状为 (n, dimension) 的查询向量
+            top_k: 每个查询返回的文档数量
+            
+        Returns:
+            与查询向量顺序一致的相关文档列表
+        """
+        if not self.is_initialized:
+            raise ValueError("索引尚未构建，请先调用 build_index()")
+            
         # 搜索相似文档
-        scores, indices = self.index.search(query_vector, top_k)
+        with self._index_lock.read():
+            scores, indices = self.index.search(query_vectors, top_k)
+        
+        return [self._format_results(scores[i], indices[i]) for i in range(len(query_vectors))]
+    
+    def search_batch(self, queries: List[str], top_k: int = 5) -> List[List[Dict[str, Any]]]:
+        """
+        批量搜索相关文档（一次计算全部查询嵌入，一次向量化检索）
+        
+        Args:
+            queries: 查询文本列表
+            top_k: 每个查询返回的文档数量
+            
+        Returns:
+            与查询顺序一致的相关文档列表
+        """
+        if not queries:
+            return []
+        
+        return self.search_vectors(self.embed_queries(queries), top_k)
+    
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        批量计算查询嵌入
+        
+        Args:
+            queries: 查询文本列表
+            
+        Returns:
+            形状为 (n, dimension) 的查询向量
+        """
+        if not self.is_initialized:
+            raise ValueError("索引尚未构建，请先调用 build_index()")
+        
+        EMBED_BATCH_SIZE.observe(len(queries))
+        return np.array(self.embeddings.embed_documents(queries)).astype('float32')
+    
+    def _format_results(self, scores, indices) -> List[Dict[str, Any]]:
+        """
+        将FAISS检索结果转换为文档列表
         
+        每个结果附带文档块的MinHash签名（minhash），并以签名标记与排名更靠前的结果近似重复的文档块
+        （near_duplicate_of 为被重复结果的排名）
+        """
         results = []
-        for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-            if idx < len(self.documents):
+        for i, (score, idx) in enumerate(zip(scores, indices)):
+            if 0 <= idx < len(self.documents):
                 results.append({
                     'content': self.documents[idx],
                     'score': float(score),
-                    'rank': i + 1
+                    'rank': i + 1,
+                    'metadata': self._get_chunk_metadata(idx),
+                    'minhash': self.chunk_signatures[idx].tolist() if idx < len(self.chunk_signatures) else None
                 })
         
+        self.flag_near_duplicates(results)
         return results
     
+    def flag_near_duplicates(self, results: List[Dict[str, Any]]):
+        """
+        以MinHash签名标记与排名更靠前的结果近似重复的检索结果
+        
+        Args:
+            results: 按排名排列、带有 rank 和 minhash 的检索结果，原地设置 near_duplicate_of
+        """
+        for result in results:
+            result['near_duplicate_of'] = None
+        signed = [result for result in results if result.get('minhash') is not None]
+        if len(signed) < 2:
+            return
+        similarity = pairwise_similarity([result['minhash'] for result in signed])
+        for j in range(1, len(signed)):
+            duplicates = np.flatnonzero(similarity[j, :j] >= Config.NEAR_DUPLICATE_THRESHOLD)
+            if len(duplicates):
+                signed[j]['near_duplicate_of'] = signed[duplicates[0]]['rank']
+    
+    def _get_chunk_metadata(self, idx: int) -> Dict[str, Any]:
+        """获取文档块元数据（旧索引没有元数据时只返回块编号）"""
+        if idx < len(self.chunk_metadata):
+            return self.chunk_metadata[idx]
+        return {'chunk_id': int(idx)}
+    
     def save_index(self, file_path: str):
         """
         保存索引到文件
@@ -216,7 +955,9 @@ class RAGSystem:
             
         data = {
             'documents': self.documents,
-            'embeddings_matrix': self.embeddings_matrix,
+            'chunk_metadata': self.chunk_metadata,
+            'chunk_signatures': self.chunk_signatures,
+            'signature_shingle_size': SHINGLE_SIZE,
             'index': self.index,
             'model_name': self.model_name
         }
@@ -236,7 +977,18 @@ class RAGSystem:
             data = pickle.load(f)
             
         self.documents = data['documents']
-        self.embeddings_matrix = data['embeddings_matrix']
+        # 旧索引没有元数据，补齐为只有块编号的元数据，使去重时可以在被保留的文档块上记录重复来源
+        self.chunk_metadata = data.get('chunk_metadata') or []
+        self.chunk_metadata += [{'chunk_id': i} for i in range(len(self.chunk_metadata), len(self.documents))]
+        self._recount_memory()
+        # 旧索引没有保存签名或签名按其他方式计算（如按词项集合），加载时补算一次（再次保存后即随索引持久化）
+        signatures = data.get('chunk_signatures')
+        if (signatures is None or len(signatures) != len(self.documents)
+                or data.get('signature_shingle_size') != SHINGLE_SIZE):
+            signatures = text_signatures(self.documents)
+        self.chunk_signatures = signatures
+        self._rebuild_dedup_index()
+        # 嵌入向量已在索引中，旧索引文件中单独保存的嵌入矩阵不再保留
         self.index = data['index']
         self.model_name = data['model_name']
         self.is_initialized = True
@@ -254,6 +1006,48 @@ class RAGSystem:
             'document_count': len(self.documents),
             'is_initialized': self.is_initialized,
             'model_name': self.model_name,
-            'embedding_dimension': self.embeddings_matrix.shape[1] if self.embeddings_matrix is not None else None,
-            'use_offline': self.use_offline
-        } 
\ No newline at end of file
+            'embedding_dimension': self.index.d if self.index is not None else None,
+            'indexed_count': self.index_size(),
+            'use_offline': self.use_offline,
+            'ingest_dedup': dict(self.dedup_stats, mode=self.dedup_mode),
+            'memory': self.get_memory_stats()
+        }
+    
+    def get_memory_stats(self) -> Dict[str, Any]:
+        """
+        获取内存占用统计（字节）
+        
+        文本块与元数据的占用在导入时增量累计，调用开销与语料规模无关，可在每次指标抓取时调用
+        
+        Returns:
+            文本块、元数据、签名、FAISS索引（含嵌入向量）、jieba词典及进程常驻内存的占用
+        """
+        return {
+            'chunk_text_bytes': self._chunk_text_bytes,
+            'chunk_metadata_bytes': self._chunk_metadata_bytes,
+            'chunk_signatures_bytes': self.chunk_signatures.nbytes,
+            'index': self._index_memory_stats(),
+            'jieba_dictionary_bytes': jieba_dictionary_bytes(),
+            'process_rss_bytes': process_rss_bytes()
+        }
+    
+    def _index_memory_stats(self) -> Dict[str, Any]:
+        """按索引类型估算FAISS索引占用的内存"""
+        if self.index is None:
+            return {'type': None, 'vectors': 0, 'bytes': 0}
+        
+        index = faiss.downcast_index(self.index)
+        ntotal = index.ntotal
+        code_size = getattr(index, 'code_size', index.d * 4)
+        
+        if hasattr(index, 'invlists'):
+            # IVF：倒排表中的编码和ID，加上聚类中心
+            index_bytes = ntotal * (code_size + 8) + index.nlist * index.d * 4
+        elif hasattr(index, 'hnsw'):
+            # HNSW：底层存储加上图的邻接表
+            storage = faiss.downcast_index(index.storage)
+            index_bytes = ntotal * getattr(storage, 'code_size', index.d * 4) + index.hnsw.neighbors.size() * 4
+        else:
+            index_bytes = ntotal * code_size
+        
+        return {'type': type(index).__name__, 'vectors': ntotal, 'bytes': int(index_bytes)} 
\ No newline at end of file
@@ -0,0 +1,92 @@
+from typing import List, Dict, Any, Optional
+
+class RetrievalGate:
+    """
+    检索置信度门控：根据检索分数分布判断证据是否足以生成答案
+
+    - 最高分低于 min_score：证据太弱，拒绝
+    - 最高分不低于 confident_score：直接通过
+    - 介于两者之间时，若第一名与第二名的相对差距小于 min_relative_gap（没有突出的结果），
+      或检索结果带有 bm25_score 且第一名没有词面匹配，则拒绝
+    """
+
+    def __init__(self, min_score: Optional[float] = None, confident_score: Optional[float] = None,
+                 min_relative_gap: float = 0.0):
+        self.min_score = min_score
+        self.confident_score = confident_score
+        self.min_relative_gap = min_relative_gap
+
+    @property
+    def enabled(self) -> bool:
+        return self.min_score is not None
+
+    def evaluate(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        评估检索结果
+
+        Returns:
+            {'passed': 是否通过, 'reason': 拒绝原因, 'signals': 分数分布信号}
+        """
+        scores = sorted((result['score'] for result in results), reverse=True)
+        max_score = scores[0] if scores else 0.0
+        second_score = scores[1] if len(scores) > 1 else None
+        gap = max_score - second_score if second_score is not None else None
+        relative_gap = gap / abs(max_score) if gap is not None and max_score else None
+
+        top_result = max(results, key=lambda result: result['score']) if results else {}
+        bm25_agreement = None
+        if 'bm25_score' in top_result:
+            bm25_agreement = top_result['bm25_score'] > 0
+
+        signals = {
+            'max_score': max_score,
+            'second_score': second_score,
+            'gap': gap,
+            'relative_gap': relative_gap,
+            'bm25_agreement': bm25_agreement
+        }
+
+        if not self.enabled:
+            return {'passed': True, 'reason': 'disabled', 'signals': signals}
+        if max_score < self.min_score:
+            return {'passed': False, 'reason': 'low_max_score', 'signals': signals}
+        if self.confident_score is not None and max_score >= self.confident_score:
+            return {'passed': True, 'reason': 'confident', 'signals': signals}
+        if relative_gap is not None and relative_gap < self.min_relative_gap:
+            return {'passed': False, 'reason': 'no_distinct_top_result', 'signals': signals}
+        if bm25_agreement is False:
+            return {'passed': False, 'reason': 'no_lexical_agreement', 'signals': signals}
+        return {'passed': True, 'reason': 'sufficient', 'signals': signals}
+
+class AdaptiveTopK:
+    """
+    自适应top-k：从向量索引多取 max_k 个结果，按分数依次保留，直到满足停止规则
+
+    - 分数低于最高分的 relative_threshold 倍时停止
+    - 与上一个结果的分数差超过最高分的 max_relative_gap 倍时停止
+    - 保留数量始终在 [min_k, max_k] 之内
+    """
+
+    def __init__(self, min_k: int = 2, max_k: int = 10, relative_threshold: float = 0.8,
+                 max_relative_gap: float = 0.1):
+        self.min_k = max(1, min_k)
+        self.max_k = max(self.min_k, max_k)
+        self.relative_threshold = relative_threshold
+        self.max_relative_gap = max_relative_gap
+
+    def select(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """按停止规则截断检索结果（结果需按分数降序排列）"""
+        if len(results) <= self.min_k:
+            return list(results)
+
+        top_score = results[0]['score']
+        scale = abs(top_score)
+        kept = list(results[:self.min_k])
+        for result in results[self.min_k:self.max_k]:
+            score = result['score']
+            if top_score > 0 and score < top_score * self.relative_threshold:
+                break
+            if scale and kept[-1]['score'] - score > scale * self.max_relative_gap:
+                break
+            kept.append(result)
+        return kept
@@ -0,0 +1,121 @@
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+class StageTimer:
+    """使用单调时钟记录单个请求各阶段的耗时（毫秒）"""
+
+    def __init__(self):
+        self.timings: Dict[str, Optional[float]] = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        """计时一个阶段，同名阶段的耗时累加"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def record(self, name: str, elapsed_ms: Optional[float]):
+        """直接记录一个阶段的耗时"""
+        key = f"{name}_ms"
+        if elapsed_ms is None:
+            self.timings.setdefault(key, None)
+        else:
+            self.timings[key] = (self.timings.get(key) or 0.0) + elapsed_ms
+
+    def as_dict(self) -> Dict[str, Optional[float]]:
+        """各阶段耗时及总耗时"""
+        timings = dict(self.timings)
+        timings['total_ms'] = (time.perf_counter() - self._start) * 1000
+        return timings
+
+class LatencyStats:
+    """在滚动窗口内聚合各阶段耗时"""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, timings: Dict[str, Optional[float]]):
+        """记录一次请求的各阶段耗时"""
+        with self._lock:
+            for name, value in timings.items():
+                if value is None:
+                    continue
+                if name not in self._samples:
+                    self._samples[name] = deque(maxlen=self.window)
+                    self._counts[name] = 0
+                self._samples[name].append(value)
+                self._counts[name] += 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """各阶段的请求数、均值、p50、p95和最大值"""
+        with self._lock:
+            snapshot = {name: sorted(samples) for name, samples in self._samples.items()}
+            counts = dict(self._counts)
+
+        summary = {}
+        for name, samples in snapshot.items():
+            if not samples:
+                continue
+            summary[name] = {
+                'count': counts[name],
+                'mean': sum(samples) / len(samples),
+                'p50': _percentile(samples, 0.50),
+                'p95': _percentile(samples, 0.95),
+                'max': samples[-1]
+            }
+        return summary
+
+    def approximate_bytes(self) -> int:
+        """滚动窗口样本占用的内存估算"""
+        with self._lock:
+            return sum(sys.getsizeof(samples) + len(samples) * sys.getsizeof(0.0)
+                       for samples in self._samples.values())
+
+def _percentile(sorted_samples, quantile: float) -> float:
+    """已排序样本的分位数（最近秩法）"""
+    index = min(int(len(sorted_samples) * quantile), len(sorted_samples) - 1)
+    return sorted_samples[index]
+
+def process_rss_bytes() -> Optional[int]:
+    """当前进程的常驻内存（字节）"""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # 非Linux平台只能取得峰值常驻内存（macOS单位为字节，其余为KB）
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+_jieba_size_cache = {}
+
+def jieba_dictionary_bytes() -> Optional[int]:
+    """jieba词典占用的内存估算（字节）；尚未加载jieba词典时返回None"""
+    jieba = sys.modules.get('jieba')
+    if jieba is None or not jieba.dt.initialized:
+        return None
+    freq = jieba.dt.FREQ
+    # 词典加载后基本不变，按词条数缓存计算结果
+    if len(freq) not in _jieba_size_cache:
+        size = sys.getsizeof(freq)
+        for word, count in freq.items():
+            size += sys.getsizeof(word) + sys.getsizeof(count)
+        _jieba_size_cache.clear()
+        _jieba_size_cache[len(freq)] = size
+    return _jieba_size_cache[len(freq)]
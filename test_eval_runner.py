@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+离线评估运行器的检查点续跑测试（离线嵌入，LLM后端以注入的函数代替）
+"""
+
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from eval_runner import EvaluationRunner, completed_ids, read_results
+from llm_backends import LLMBackendError
+from qa_system import QASystem
+from rag_system import RAGSystem
+
+QUERIES = ["什么是人工智能？", "机器学习和深度学习有什么关系？", "神经网络有哪些应用？"]
+
+def _qa_system(tmp_path, generate) -> QASystem:
+    document = tmp_path / "ai.txt"
+    document.write_text("人工智能是计算机科学的一个分支。\n\n机器学习是人工智能的一个子集。\n\n"
+                        "深度学习使用多层神经网络，广泛应用于图像识别和语音识别。", encoding='utf-8')
+    rag_system = RAGSystem(use_offline=True, ingest_workers=1, ingest_file_timeout=0)
+    rag_system.add_documents([str(document)])
+    rag_system.build_index()
+    qa_system = QASystem(rag_system, llm_config={'provider': 'ollama', 'base_url': 'http://127.0.0.1:9'})
+    qa_system._ollama_generate = generate
+    return qa_system
+
+def test_resume_retries_failed_generations(tmp_path):
+    """后端失败的记录不计为完成：汇总计入 errors，续跑时重新生成并评分"""
+    dataset = tmp_path / "dataset.jsonl"
+    dataset.write_text("".join(f'{{"id": "q{i}", "query": "{query}"}}\n' for i, query in enumerate(QUERIES)),
+                       encoding='utf-8')
+    output = tmp_path / "results.jsonl"
+
+    def failing_generate(base_url, prompt):
+        raise LLMBackendError("Ollama LLM API 调用失败: 500 Internal Server Error", status_code=500, base_url=base_url)
+
+    runner = EvaluationRunner(_qa_system(tmp_path, failing_generate), concurrency=2, scoring_workers=1)
+    summary = runner.run(str(dataset), str(output))
+    assert summary['errors'] == len(QUERIES)
+    assert summary['evaluated'] == 0
+    assert completed_ids(str(output)) == set()
+    assert all(result.get('error') for result in read_results(str(output)))
+
+    calls = []
+
+    def working_generate(base_url, prompt):
+        calls.append(prompt)
+        return {"text": "人工智能是计算机科学的一个分支。", "ttft_ms": 1.0, "usage": None}
+
+    runner = EvaluationRunner(_qa_system(tmp_path, working_generate), concurrency=2, scoring_workers=1)
+    summary = runner.run(str(dataset), str(output))
+    assert len(calls) == len(QUERIES)
+    assert summary['records'] == len(QUERIES)
+    assert summary['errors'] == 0
+    assert summary['evaluated'] == len(QUERIES)
+    assert completed_ids(str(output)) == {f"q{i}" for i in range(len(QUERIES))}
+
+def test_retrieval_metrics_use_full_ranked_results(tmp_path):
+    """检索指标按请求的截断位置检索，不受交给LLM的 top_k 限制"""
+    document = tmp_path / "topics.txt"
+    document.write_text("\n\n".join(f"主题{i}：" + "".join(f"词{i}_{j} " for j in range(200)) for i in range(12)),
+                        encoding='utf-8')
+    rag_system = RAGSystem(use_offline=True, ingest_workers=1, ingest_file_timeout=0, dedup='off')
+    rag_system.add_documents([str(document)])
+    rag_system.build_index()
+    qa_system = QASystem(rag_system, llm_config={'provider': 'ollama', 'base_url': 'http://127.0.0.1:9', 'top_k': 3})
+    qa_system._ollama_generate = lambda base_url, prompt: {"text": "答案", "ttft_ms": 1.0, "usage": None}
+    assert len(rag_system.documents) > 10
+
+    dataset = tmp_path / "dataset.jsonl"
+    relevant = list(range(len(rag_system.documents)))
+    dataset.write_text(f'{{"id": "q0", "query": "主题5", "relevant_chunk_ids": {relevant}}}\n', encoding='utf-8')
+    output = tmp_path / "results.jsonl"
+    summary = EvaluationRunner(qa_system, scoring_workers=1).run(str(dataset), str(output), k_values=(1, 10))
+
+    result, = read_results(str(output))
+    assert len(result['retrieved_chunk_ids']) == 10
+    assert len(result['sources']) <= 3
+    assert summary['retrieval']['at_k'][10]['recall'] == pytest.approx(10 / len(relevant))
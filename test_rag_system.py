@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+RAGSystem 索引加载与导入的回归测试（离线嵌入，不依赖Ollama服务）
+"""
+
+import pickle
+import threading
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("sentence_transformers")
+faiss = pytest.importorskip("faiss")
+
+from minhash import NUM_PERM
+from rag_system import RAGSystem
+
+DOCUMENTS = [
+    "人工智能是计算机科学的一个分支，旨在创建能够执行通常需要人类智能的任务的系统。",
+    "机器学习是人工智能的一个子集，它使计算机能够在没有明确编程的情况下学习和改进。",
+    "深度学习使用多层神经网络来学习数据的表示。"
+]
+
+def _offline_system() -> RAGSystem:
+    return RAGSystem(use_offline=True, ingest_workers=1, ingest_file_timeout=0)
+
+def test_load_baseline_index(tmp_path):
+    """最初版本保存的索引（只有 documents、embeddings_matrix、index、model_name）可以加载"""
+    rag_system = _offline_system()
+    embeddings = np.asarray(rag_system.embeddings.embed_documents(DOCUMENTS), dtype='float32')
+    index = faiss.IndexFlatIP(embeddings.shape[1])
+    index.add(embeddings)
+    path = tmp_path / "baseline_index.pkl"
+    with open(path, 'wb') as f:
+        pickle.dump({'documents': DOCUMENTS, 'embeddings_matrix': embeddings,
+                     'index': index, 'model_name': 'nomic-embed-text'}, f)
+
+    rag_system.load_index(str(path))
+
+    assert rag_system.chunk_signatures.shape == (len(DOCUMENTS), NUM_PERM)
+    assert [rag_system._get_chunk_metadata(i)['chunk_id'] for i in range(len(DOCUMENTS))] == [0, 1, 2]
+    results = rag_system.search(DOCUMENTS[1], top_k=3)
+    assert len(results) == len(DOCUMENTS)
+    for result in results:
+        assert result['content'] == DOCUMENTS[result['metadata']['chunk_id']]
+        assert result['minhash'] is not None
+
+    # 导入与已加载文档块重复的内容时，重复来源记录在被保留的文档块上
+    duplicate = tmp_path / "duplicate.txt"
+    duplicate.write_text(DOCUMENTS[0], encoding='utf-8')
+    report = rag_system.add_documents([str(duplicate)])
+    assert report == [{'file': str(duplicate), 'chunks': 0, 'skipped': 1, 'error': None}]
+    assert rag_system.chunk_metadata[0]['duplicates'][0]['source'] == str(duplicate)
+
+    # 再次保存后签名随索引持久化
+    resaved = tmp_path / "resaved_index.pkl"
+    rag_system.save_index(str(resaved))
+    reloaded = _offline_system()
+    reloaded.load_index(str(resaved))
+    np.testing.assert_array_equal(reloaded.chunk_signatures, rag_system.chunk_signatures)
+
+def test_concurrent_ingest_keeps_index_aligned(tmp_path, monkeypatch):
+    """并发导入时文档块编号、签名与索引位置保持一致"""
+    rag_system = _offline_system()
+    embed_documents = rag_system.embeddings.embed_documents
+
+    def slow_embed_documents(texts):
+        # 模拟嵌入服务的网络延迟，使并发导入在嵌入期间交错
+        time.sleep(0.01)
+        return embed_documents(texts)
+
+    monkeypatch.setattr(rag_system.embeddings, 'embed_documents', slow_embed_documents)
+    paths = []
+    for i in range(4):
+        path = tmp_path / f"doc_{i}.txt"
+        path.write_text("\n\n".join(" ".join(f"词{i}_{j}_{k}" for k in range(150)) for j in range(20)),
+                        encoding='utf-8')
+        paths.append(str(path))
+
+    threads = [threading.Thread(target=rag_system.ingest_documents, args=([path],), kwargs={'batch_size': 4})
+               for path in paths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert rag_system.index_size() == len(rag_system.documents)
+    assert len(rag_system.chunk_signatures) == len(rag_system.documents)
+    assert [metadata['chunk_id'] for metadata in rag_system.chunk_metadata] == list(range(len(rag_system.documents)))
+    vectors = np.asarray(embed_documents(rag_system.documents), dtype='float32')
+    np.testing.assert_allclose(rag_system.embeddings_matrix, vectors)
+
+def test_near_dedup_respects_word_order(tmp_path):
+    """词汇相同但词序不同的文档块不视为近似重复，只有标点差异的文档块被去除"""
+    texts = ["版本 1.2.3 支持 Python 3.8，版本 3.8.1 支持 Python 1.2",
+             "版本 3.8.1 支持 Python 1.2，版本 1.2.3 支持 Python 3.8",
+             DOCUMENTS[0],
+             DOCUMENTS[0].replace("。", "！")]
+    paths = []
+    for i, text in enumerate(texts):
+        path = tmp_path / f"doc_{i}.txt"
+        path.write_text(text, encoding='utf-8')
+        paths.append(str(path))
+
+    rag_system = _offline_system()
+    report = rag_system.add_documents(paths)
+
+    assert [entry['chunks'] for entry in report] == [1, 1, 1, 0]
+    assert rag_system.dedup_stats['near'] == 1
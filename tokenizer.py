@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+jieba分词器的显式初始化
+
+jieba默认在首次分词时才构建前缀词典（数秒），并阻塞触发它的那次调用。
+启动时调用 init_tokenizer() 完成加载：指定预构建的缓存文件时直接反序列化缓存，
+缓存文件不存在时构建一次并写入，后续进程（其他worker、评估子进程、重启后的服务）均直接加载。
+
+jieba词典是Python字典，无法以内存映射方式跨进程只读共享；
+在fork子进程前完成初始化并调用 freeze_for_fork()，子进程即以写时复制方式共享父进程已加载的词典；
+多线程进程（如服务、离线评估运行器）以 forkserver/spawn 启动子进程，子进程从缓存文件加载词典。
+"""
+
+import argparse
+import gc
+import os
+import threading
+import time
+from typing import List, Dict, Any, Optional
+
+import jieba
+
+from config import Config
+
+_lock = threading.Lock()
+_state: Dict[str, Any] = {
+    'initialized': False,
+    'cache_file': None,
+    'user_dicts': [],
+    'load_ms': None
+}
+
+def init_tokenizer(cache_file: Optional[str] = None, user_dicts: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    初始化jieba分词器（幂等，重复调用直接返回）
+
+    Args:
+        cache_file: 词典缓存文件路径，默认取 Config.TOKENIZER_CACHE_FILE；为空时使用jieba默认的临时目录缓存
+        user_dicts: 用户词典路径列表，默认取 Config.TOKENIZER_USER_DICTS
+
+    Returns:
+        分词器状态：是否已初始化、缓存文件、已加载的用户词典和加载耗时
+    """
+    cache_file = Config.TOKENIZER_CACHE_FILE if cache_file is None else cache_file
+    user_dicts = Config.TOKENIZER_USER_DICTS if user_dicts is None else user_dicts
+
+    with _lock:
+        if not _state['initialized']:
+            start = time.perf_counter()
+            if cache_file and not jieba.dt.initialized:
+                jieba.dt.cache_file = os.path.abspath(cache_file)
+            jieba.initialize()
+            for path in user_dicts:
+                jieba.load_userdict(path)
+            _state.update({
+                'initialized': True,
+                'cache_file': jieba.dt.cache_file,
+                'user_dicts': list(user_dicts),
+                'load_ms': (time.perf_counter() - start) * 1000
+            })
+        return dict(_state)
+
+def tokenizer_stats() -> Dict[str, Any]:
+    """分词器当前状态"""
+    with _lock:
+        return dict(_state)
+
+def freeze_for_fork():
+    """
+    在fork子进程前调用：将已加载的对象移出垃圾回收跟踪
+
+    避免子进程中的垃圾回收触碰词典对象，导致共享内存页被逐页复制
+    """
+    gc.freeze()
+
+def build_cache(cache_file: str) -> str:
+    """重新构建词典缓存文件（用于部署时预先生成）"""
+    cache_file = os.path.abspath(cache_file)
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
+    tokenizer = jieba.Tokenizer()
+    tokenizer.cache_file = cache_file
+    tokenizer.initialize()
+    # jieba以0600权限写入缓存，放宽为只读共享给其他用户运行的进程
+    os.chmod(cache_file, 0o644)
+    return cache_file
+
+def main():
+    parser = argparse.ArgumentParser(description="预构建jieba词典缓存")
+    parser.add_argument("cache_file", nargs="?", default=Config.TOKENIZER_CACHE_FILE or "jieba.cache",
+                        help="缓存文件路径（默认取 TOKENIZER_CACHE_FILE）")
+    args = parser.parse_args()
+
+    path = build_cache(args.cache_file)
+    print(f"词典缓存已生成: {path}（{os.path.getsize(path) / 1024 / 1024:.1f} MB）")
+
+if __name__ == "__main__":
+    main()